@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+# Deckard, a Web based Glade Runner
+# Copyright (C) 2013  Nicolas Delvaux <contact@nicolas-delvaux.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of GladeRunner.load
+
+Glade files are loaded several times in this process and the median time of
+each phase (parse, preprocess, builder and postprocess) is reported.
+The files of benchmarks/corpus/ exercise the costly paths: a large preferences
+window, templates, libhandy widgets, unknown widgets replaced by placeholders
+and unknown internal children which make GtkBuilder try again.
+
+Results can be saved as a baseline, and later compared with it: the exit
+status is 1 if any phase of any file got slower than allowed, or if there is
+no baseline to compare with.
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import gladerunner
+from gladerunner import GladeRunner, GladeRunnerException, profiler
+
+PHASES = ("parse", "preprocess", "builder", "postprocess")
+EXTENSIONS = (".ui", ".glade")
+
+
+def find_files(paths):
+    """Yields (name, path) for each Glade file of paths
+
+    Directories are searched recursively. Names are relative to the parent of
+    the given directory, so that they stay the same from one run to another.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield os.path.basename(path), path
+            continue
+        parent = os.path.dirname(os.path.abspath(path))
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(EXTENSIONS):
+                    full_path = os.path.join(dirpath, filename)
+                    yield os.path.relpath(full_path, parent), full_path
+
+
+def measure(path, repeat, catalog_paths=(), mapping_path=None):
+    """Returns the median time of each phase to load path, in seconds
+
+    The first load is not accounted: placeholders and libhandy are only set
+    up once for all.
+    """
+    times = {phase: [] for phase in PHASES}
+    for i in range(repeat + 1):
+        gr = GladeRunner(path, catalog_paths=catalog_paths, mapping_path=mapping_path)
+        profiler.take()  # GTK import and catalog parsing are not measured
+        try:
+            gr.load()
+        finally:
+            record = profiler.take()
+            for window in gr.windows.values():
+                window.destroy()
+        if i > 0:
+            for phase in PHASES:
+                times[phase].append(record["phases"].get(phase, 0))
+    result = {phase: statistics.median(times[phase]) for phase in PHASES}
+    result["total"] = sum(result.values())
+    result["retries"] = record.get("retries", 0)
+    return result
+
+
+def compare(results, baseline, threshold, min_delta):
+    """Returns the list of regressions of results against baseline
+
+    A phase regresses if it is both threshold times and min_delta seconds
+    slower than in the baseline.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None or "error" in result or "error" in previous:
+            continue
+        for phase in PHASES + ("total",):
+            old = previous.get(phase, 0)
+            new = result[phase]
+            if new > old * (1 + threshold) and new - old > min_delta:
+                regressions.append(
+                    "%s: %s went from %.2f ms to %.2f ms"
+                    % (name, phase, old * 1000, new * 1000)
+                )
+    return regressions
+
+
+def report(results, baseline):
+    """Print the results, in milliseconds"""
+    print(
+        "%-40s" % "file"
+        + "".join("%12s" % phase for phase in PHASES + ("total",))
+        + "%9s %10s" % ("retries", "baseline")
+    )
+    for name, result in sorted(results.items()):
+        if "error" in result:
+            print("%-40s %s" % (name, result["error"]))
+            continue
+        line = "%-40s" % name + "".join(
+            "%12.2f" % (result[phase] * 1000) for phase in PHASES + ("total",)
+        )
+        line += "%9d" % result["retries"]
+        previous = baseline.get(name, {})
+        if previous.get("total"):
+            line += " %+9.0f%%" % ((result["total"] / previous["total"] - 1) * 100)
+        print(line)
+
+
+def parse():
+    """Argument parsing"""
+    parser = argparse.ArgumentParser(description="Benchmark GladeRunner.load.")
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=[os.path.join(ROOT, "benchmarks", "corpus")],
+        metavar="PATH",
+        help="Glade files or directories of Glade files, like a content "
+        "folder (default: the synthetic corpus).",
+    )
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        default=10,
+        help="Number of measured loads of each file.",
+    )
+    parser.add_argument(
+        "-c",
+        "--catalog-path",
+        action="append",
+        default=[],
+        dest="catalog_paths",
+        help="Load the specified Glade catalog. "
+        "This option can be given several times.",
+    )
+    parser.add_argument(
+        "-m",
+        "--mapping-path",
+        help="Load the merged Glade catalogs from the specified file "
+        "(see gladecatalog.compile_mapping).",
+    )
+    parser.add_argument(
+        "-b",
+        "--with-broadwayd",
+        type=int,
+        metavar="PORT",
+        help="Start a broadwayd daemon on the specified port and load files "
+        "on it. Otherwise, the default display is used (eg. with xvfb-run).",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=os.path.join(ROOT, "benchmarks", "glade_load_baseline.json"),
+        help="Baseline to compare the results with (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Save the results as the new baseline instead of comparing.",
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Slowdown allowed for each phase, 0.2 meaning 20%%.",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.5,
+        help="Slowdowns below this many milliseconds are ignored as noise.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    baseline = {}
+    if not args.save_baseline:
+        if not os.path.isfile(args.baseline):
+            sys.exit(
+                "No baseline to compare with in %s, save one with --save-baseline."
+                % args.baseline
+            )
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.with_broadwayd is not None:
+        os.environ["GDK_BACKEND"] = "broadway"
+        gladerunner.start_broadwayd(args.with_broadwayd)
+    gladerunner.preload_gtk()
+    try:
+        gladerunner.wait_for_display()
+    except GladeRunnerException as exp:
+        sys.exit(exp)
+
+    results = {}
+    for name, path in find_files(args.paths):
+        try:
+            results[name] = measure(
+                path, args.repeat, args.catalog_paths, args.mapping_path
+            )
+        except GladeRunnerException as exp:
+            results[name] = {"error": str(exp)}
+
+    report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Baseline saved in %s." % args.baseline)
+    else:
+        regressions = compare(results, baseline, args.threshold, args.min_delta / 1000)
+        for regression in regressions:
+            print("Regression: %s" % regression)
+        if regressions:
+            sys.exit(1)
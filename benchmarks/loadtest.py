@@ -0,0 +1,566 @@
+#!/usr/bin/env python3
+
+# Deckard, a Web based Glade Runner
+# Copyright (C) 2013  Nicolas Delvaux <contact@nicolas-delvaux.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Load test of the Deckard WSGI application
+
+Simulated browsers do what the Deckard page does: get the page, upload or
+download a PO file, display files and send a keep-alive every 2 seconds.
+Runners are replaced by stub_runner.py and PO files are downloaded from a
+local HTTP server, so only Deckard itself is measured.
+
+The application is called directly, or through a local HTTP server with
+--http. Latencies of each action, the throughput and the contention on the
+sessions registry lock (from /metrics) are reported at the end.
+"""
+
+import os
+import io
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import importlib.util
+import importlib.machinery
+from uuid import uuid4
+from threading import Lock, Thread
+from socketserver import ThreadingMixIn
+from urllib.parse import urlencode
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = {"gedit": ["gedit-window.ui", "gedit-preferences.ui"], "nautilus": ["a.ui"]}
+
+
+class Stats:
+    """Latencies and errors of each action"""
+
+    def __init__(self):
+        self.latencies = {}  # {action: [seconds]}
+        self.errors = {}  # {(action, message): count}
+        self.queued = {}  # {action: count}
+        self._lock = Lock()
+
+    def add(self, action, seconds, error=None, queued=False):
+        with self._lock:
+            self.latencies.setdefault(action, []).append(seconds)
+            if queued:
+                self.queued[action] = self.queued.get(action, 0) + 1
+            if error is not None:
+                key = (action, error)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+
+class DirectClient:
+    """Call the WSGI application in this process"""
+
+    def __init__(self, application):
+        self.application = application
+
+    def request(self, method, path, body=b"", content_type=""):
+        """Returns the body of the response"""
+        path, _, query = path.partition("?")
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "CONTENT_TYPE": content_type,
+            "CONTENT_LENGTH": str(len(body)),
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.url_scheme": "http",
+            "wsgi.version": (1, 0),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        chunks = self.application(environ, lambda status, headers: None)
+        try:
+            return b"".join(chunks)
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+
+class HttpClient:
+    """Send requests to a HTTP server"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def request(self, method, path, body=b"", content_type=""):
+        """Returns the body of the response"""
+        connection = HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            headers = {"Content-Type": content_type} if content_type else {}
+            connection.request(method, path, body, headers)
+            return connection.getresponse().read()
+        finally:
+            connection.close()
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *_):
+        """Don't log every request"""
+
+
+class PoHandler(BaseHTTPRequestHandler):
+    """Serve the same PO file whatever its name, like a PO mirror"""
+
+    def do_GET(self):
+        body = self.server.po
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        """Don't log every request"""
+
+
+class Browser:
+    """A simulated user of the Deckard page"""
+
+    def __init__(self, client, stats, args, po):
+        self.client = client
+        self.stats = stats
+        self.args = args
+        self.po = po
+        self.session = None
+        self.ticket = None
+        self.custom_po = None
+
+    def _call(self, action, method, path, body=b"", content_type=""):
+        """Send a request and account it
+
+        Returns the decoded JSON answer, or None for the page.
+        """
+        start = time.perf_counter()
+        error = None
+        res = None
+        queued = False
+        try:
+            data = self.client.request(method, path, body, content_type)
+            if action != "page":
+                res = json.loads(data)
+                if res["status"] == "error":
+                    error = res["message"].split("\n")[0]
+                queued = res["status"] == "queued"
+        except Exception as e:
+            error = "%s: %s" % (type(e).__name__, e)
+        self.stats.add(action, time.perf_counter() - start, error, queued)
+        return res
+
+    def _post(self, action, params):
+        return self._call(
+            action,
+            "POST",
+            "/",
+            urlencode(params).encode(),
+            "application/x-www-form-urlencoded",
+        )
+
+    def _store_po(self, action, po_name, content=None):
+        """Upload a PO file, or download it if content is None"""
+        while True:
+            fields = {"po_name": po_name, "po_module": "gedit"}
+            if self.session is not None:
+                fields["session"] = self.session
+            if self.ticket is not None:
+                fields["ticket"] = self.ticket
+            boundary = uuid4().hex
+            body = b""
+            for name, value in fields.items():
+                body += (
+                    '--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n'
+                    "%s\r\n" % (boundary, name, value)
+                ).encode()
+            if content is not None:
+                body += (
+                    "--%s\r\nContent-Disposition: form-data; "
+                    'name="po_file"; filename="%s"\r\n'
+                    "Content-Type: text/x-gettext-translation\r\n\r\n"
+                    % (boundary, po_name)
+                ).encode()
+                body += content + b"\r\n"
+            body += ("--%s--\r\n" % boundary).encode()
+            content_type = "multipart/form-data; boundary=%s" % boundary
+            res = self._call(action, "POST", "/", body, content_type)
+            if res is None or res["status"] != "queued":
+                break
+            self.ticket = res["ticket"]
+            time.sleep(2)
+        self.ticket = None
+        if res is not None and res["status"] == "ok":
+            self.session = res["session"]
+            self.custom_po = po_name
+
+    def _spawn(self):
+        module = random.choice(list(MODULES))
+        params = {
+            "action": "spawn",
+            "module": module,
+            "file": random.choice(MODULES[module]),
+            "lang": "POSIX",
+        }
+        if self.custom_po is not None and module == "gedit":
+            params["lang"] = self.custom_po
+        while True:
+            if self.session is not None:
+                params["session"] = self.session
+            if self.ticket is not None:
+                params["ticket"] = self.ticket
+            res = self._post("spawn", params)
+            if res is None or res["status"] != "queued":
+                break
+            # Like the page, ask again to keep our place in the queue
+            self.ticket = res["ticket"]
+            time.sleep(2)
+        self.ticket = None
+        if res is not None and res["status"] == "ok":
+            self.session = res["session"]
+
+    def run(self):
+        self._call("page", "GET", "/")
+        draw = random.random()
+        if draw < self.args.upload_rate:
+            self._store_po("store_po", "upload.po", self.po)
+        elif draw < self.args.upload_rate + self.args.download_rate:
+            self._store_po("download_po", "download.po")
+        self._spawn()
+        end = time.monotonic() + self.args.session_seconds
+        while time.monotonic() < end and self.session is not None:
+            time.sleep(2)
+            res = self._post(
+                "keep_alive", {"action": "keep_alive", "session": self.session}
+            )
+            if res is None or res["status"] != "ok":
+                break
+            if random.random() < self.args.respawn_rate:
+                # Display another file
+                self._spawn()
+
+
+def make_po(messages):
+    """Returns a French PO file with that many messages"""
+    lines = [
+        'msgid ""',
+        'msgstr ""',
+        '"Content-Type: text/plain; charset=UTF-8\\n"',
+        '"Language: fr\\n"',
+        '"Plural-Forms: nplurals=2; plural=(n > 1);\\n"',
+        "",
+    ]
+    for i in range(messages):
+        lines.extend(('msgid "Message %d"' % i, 'msgstr "Message %d traduit"' % i, ""))
+    return "\n".join(lines).encode()
+
+
+def make_content(path):
+    """Create a small content folder"""
+    os.makedirs(os.path.join(path, "LANGS", "fr", "LC_MESSAGES"))
+    for module, files in MODULES.items():
+        os.makedirs(os.path.join(path, module))
+        for name in files:
+            with open(os.path.join(path, module, name), "w") as ui:
+                ui.write('<interface><object class="GtkWindow"/></interface>\n')
+
+
+def lock_figures(client):
+    """Returns the sums and counts of the lock histograms of /metrics"""
+    text = client.request("GET", "/metrics").decode()
+    figures = {}
+    for name in (
+        "deckard_lock_wait_seconds_sum",
+        "deckard_lock_wait_seconds_count",
+        "deckard_lock_hold_seconds_sum",
+        "deckard_lock_hold_seconds_count",
+    ):
+        match = re.search(r"^%s (\S+)$" % name, text, re.M)
+        figures[name] = float(match.group(1)) if match else 0.0
+    match = re.search(
+        r'^deckard_lock_wait_seconds_bucket\{le="0.001"\} (\S+)$', text, re.M
+    )
+    figures["fast_waits"] = float(match.group(1)) if match else 0.0
+    return figures
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[round(percent / 100 * (len(values) - 1))]
+
+
+def report(stats, duration, before, after):
+    """Print the results and returns them as a dictionary"""
+    total = sum(len(latencies) for latencies in stats.latencies.values())
+    results = {"duration": duration, "throughput": total / duration, "actions": {}}
+    print(
+        "%d requests in %.1f s: %.1f requests/s" % (total, duration, total / duration)
+    )
+    print(
+        "%-12s %8s %8s %10s %10s %10s %8s %8s"
+        % (
+            "action",
+            "count",
+            "req/s",
+            "p50 (ms)",
+            "p99 (ms)",
+            "max (ms)",
+            "queued",
+            "errors",
+        )
+    )
+    for action, latencies in sorted(stats.latencies.items()):
+        errors = sum(
+            count for (name, _), count in stats.errors.items() if name == action
+        )
+        figures = {
+            "count": len(latencies),
+            "throughput": len(latencies) / duration,
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies),
+            "queued": stats.queued.get(action, 0),
+            "errors": errors,
+        }
+        results["actions"][action] = figures
+        print(
+            "%-12s %8d %8.1f %10.1f %10.1f %10.1f %8d %8d"
+            % (
+                action,
+                figures["count"],
+                figures["throughput"],
+                figures["p50"] * 1000,
+                figures["p99"] * 1000,
+                figures["max"] * 1000,
+                figures["queued"],
+                errors,
+            )
+        )
+    for (action, message), count in sorted(stats.errors.items()):
+        print("  %s: %dx %s" % (action, count, message))
+
+    delta = {name: after[name] - before[name] for name in after}
+    waits = delta["deckard_lock_wait_seconds_count"]
+    holds = delta["deckard_lock_hold_seconds_count"]
+    results["lock"] = {
+        "acquisitions": waits,
+        "mean_wait": delta["deckard_lock_wait_seconds_sum"] / waits if waits else 0,
+        "slow_waits": waits - delta["fast_waits"],
+        "mean_hold": delta["deckard_lock_hold_seconds_sum"] / holds if holds else 0,
+    }
+    print(
+        "Registry lock: %d acquisitions, mean wait %.3f ms (%d over 1 ms), "
+        "mean hold %.3f ms"
+        % (
+            waits,
+            results["lock"]["mean_wait"] * 1000,
+            results["lock"]["slow_waits"],
+            results["lock"]["mean_hold"] * 1000,
+        )
+    )
+    return results
+
+
+def parse():
+    """Argument parsing"""
+    parser = argparse.ArgumentParser(
+        description="Load test the Deckard WSGI application."
+    )
+    parser.add_argument(
+        "-u", "--users", type=int, default=20, help="Simulated browsers."
+    )
+    parser.add_argument(
+        "-r",
+        "--ramp-up",
+        type=float,
+        default=10,
+        help="Seconds over which the browsers arrive.",
+    )
+    parser.add_argument(
+        "-s",
+        "--session-seconds",
+        type=float,
+        default=20,
+        help="Seconds each browser stays on the page.",
+    )
+    parser.add_argument(
+        "--upload-rate",
+        type=float,
+        default=0.3,
+        help="Share of the browsers which upload a PO file.",
+    )
+    parser.add_argument(
+        "--download-rate",
+        type=float,
+        default=0.2,
+        help="Share of the browsers which download a PO file.",
+    )
+    parser.add_argument(
+        "--respawn-rate",
+        type=float,
+        default=0.2,
+        help="Chance to display another file after each keep-alive.",
+    )
+    parser.add_argument(
+        "--po-messages",
+        type=int,
+        default=2000,
+        help="Messages in the uploaded and downloaded PO file.",
+    )
+    parser.add_argument(
+        "--max-users", type=int, default=10, help="max_users of Deckard."
+    )
+    parser.add_argument(
+        "--pool-size", type=int, default=2, help="runner_pool_size of Deckard."
+    )
+    parser.add_argument(
+        "--startup-delay",
+        type=float,
+        default=0.5,
+        help="Start-up time of the stub runners.",
+    )
+    parser.add_argument(
+        "--load-delay",
+        type=float,
+        default=0.1,
+        help="Time the stub runners take to load a file.",
+    )
+    parser.add_argument(
+        "--runner-memory",
+        type=int,
+        default=30000000,
+        help="Memory used by each stub runner, in bytes.",
+    )
+    parser.add_argument(
+        "--option",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Any other Deckard setting (see deckard.conf).",
+    )
+    parser.add_argument(
+        "--http",
+        action="store_true",
+        help="Send requests through a local HTTP server.",
+    )
+    parser.add_argument("--json", metavar="FILE", help="Also save the results there.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    work = tempfile.mkdtemp(prefix="deckard_loadtest_")
+    try:
+        content = os.path.join(work, "content")
+        make_content(content)
+        po = make_po(args.po_messages)
+
+        po_server = ThreadingHTTPServer(("127.0.0.1", 0), PoHandler)
+        po_server.daemon_threads = True
+        po_server.po = po
+        Thread(target=po_server.serve_forever, daemon=True).start()
+
+        # Runners are started without PATH, so give the full paths
+        runner = os.path.join(work, "runner.sh")
+        with open(runner, "w") as script:
+            script.write(
+                '#!/bin/sh\nexec %s %s --startup-delay %s --load-delay %s --memory %d "$@"\n'
+                % (
+                    sys.executable,
+                    os.path.join(ROOT, "benchmarks", "stub_runner.py"),
+                    args.startup_delay,
+                    args.load_delay,
+                    args.runner_memory,
+                )
+            )
+        os.chmod(runner, 0o755)
+
+        settings = {
+            "content_dir_path": content,
+            "gladerunner_path": runner,
+            "template_dir_path": os.path.join(ROOT, "resources"),
+            "po_urls": "http://127.0.0.1:%d/%%s" % po_server.server_port,
+            "max_users": str(args.max_users),
+            "runner_pool_size": str(args.pool_size),
+        }
+        settings.update(option.split("=", 1) for option in args.option)
+        conf = os.path.join(work, "deckard.conf")
+        with open(conf, "w") as f:
+            f.write("[deckard]\n")
+            for name, value in settings.items():
+                f.write("%s = %s\n" % (name, value))
+        os.environ["DECKARD_CONF_FILE"] = conf
+
+        sys.path.insert(0, ROOT)
+        spec = importlib.util.spec_from_file_location(
+            "deckard_qh",
+            os.path.join(ROOT, "wsgi", "deckard_qh.wsgi"),
+            loader=importlib.machinery.SourceFileLoader(
+                "deckard_qh", os.path.join(ROOT, "wsgi", "deckard_qh.wsgi")
+            ),
+        )
+        wsgi = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(wsgi)
+
+        if args.http:
+            server = make_server(
+                "127.0.0.1",
+                0,
+                wsgi.application,
+                ThreadingWSGIServer,
+                QuietHandler,
+            )
+            Thread(target=server.serve_forever, daemon=True).start()
+            client = HttpClient("127.0.0.1", server.server_port)
+        else:
+            client = DirectClient(wsgi.application)
+
+        client.request("GET", "/")  # initialize Deckard and its runner pool
+        time.sleep(args.startup_delay)
+        stats = Stats()
+        before = lock_figures(client)
+        start = time.monotonic()
+        browsers = []
+        for i in range(args.users):
+            browser = Thread(target=Browser(client, stats, args, po).run)
+            browser.start()
+            browsers.append(browser)
+            time.sleep(args.ramp_up / args.users)
+        for browser in browsers:
+            browser.join()
+        duration = time.monotonic() - start
+        results = report(stats, duration, before, lock_figures(client))
+        if args.json is not None:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
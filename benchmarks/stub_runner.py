@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# Deckard, a Web based Glade Runner
+# Copyright (C) 2013  Nicolas Delvaux <contact@nicolas-delvaux.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Stand-in for gladerunner.py, used by loadtest.py
+
+It speaks the same protocol on STDIN (see gladerunner.CommandChannel), but
+does not need GTK nor broadwayd: the cost of a runner is modeled by a start-up
+delay, a delay for each loaded file and some memory.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+
+def parse():
+    """Argument parsing
+
+    The options of gladerunner.py which don't matter here are ignored.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--startup-delay",
+        type=float,
+        default=0.5,
+        help="Seconds spent before reading commands, like importing GTK.",
+    )
+    parser.add_argument(
+        "--load-delay",
+        type=float,
+        default=0.1,
+        help="Seconds spent loading each file.",
+    )
+    parser.add_argument(
+        "--memory",
+        type=int,
+        default=30000000,
+        help="Bytes of memory used by the runner.",
+    )
+    parser.add_argument("--profile", type=int, metavar="FD")
+    parser.add_argument("--reply-fd", type=int, metavar="FD")
+    return parser.parse_known_args()[0]
+
+
+if __name__ == "__main__":
+    args = parse()
+    time.sleep(args.startup_delay)
+    # Touch every page, so the memory is really used
+    ballast = bytearray(b"\1" * args.memory)
+
+    buffer = b""
+    loaded = False  # the first file is not answered, like gladerunner.py
+    while True:
+        data = os.read(0, 65536)
+        if not data:
+            # Deckard is done with us
+            sys.exit()
+        *lines, buffer = (buffer + data).split(b"\n")
+        for line in lines:
+            command = json.loads(line)
+            if command.get("action") != "load":
+                continue
+            start = time.perf_counter()
+            time.sleep(args.load_delay)
+            error = None
+            if not os.path.isfile(command["glade_file_path"]):
+                error = "%s: no such file." % command["glade_file_path"]
+            if loaded and args.reply_fd is not None:
+                os.write(args.reply_fd, (json.dumps({"error": error}) + "\n").encode())
+            if error is not None:
+                sys.exit(error)
+            loaded = True
+            if command.get("profile") and args.profile is not None:
+                seconds = time.perf_counter() - start
+                record = {
+                    "module": command["gettext_domain"],
+                    "file": os.path.basename(command["glade_file_path"]),
+                    "windows": 1,
+                    "phases": {"builder": seconds},
+                    "seconds": seconds,
+                }
+                os.write(args.profile, (json.dumps(record) + "\n").encode())
@@ -0,0 +1,649 @@
+#!/usr/bin/env python3
+
+# Deckard, a Web based Glade Runner
+# Copyright (C) 2013-2019  Nicolas Delvaux <contact@nicolas-delvaux.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Build a Deckard content folder from the GNOME git repositories
+
+Modules translated on Damned-Lies are retrieved and processed in parallel.
+The resulting folder comes with a manifest recording the state of each module,
+so that modules which did not change (and were built with the same locales
+and Glade catalogs) are copied from the previous content folder instead of
+being processed again.
+
+The cache/, content_tmp/ and content/ folders are created in the current
+directory.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import datetime
+import subprocess
+import urllib.request
+import xml.etree.ElementTree as ET
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import libdeckard
+from gladerunner import Validator, cache_key
+from gladecatalog import compile_mapping, load_mapping
+
+DAMNED_LIES = "https://l10n.gnome.org"
+MANIFEST = "manifest.json"
+UI_EXTENSIONS = {".ui", ".xml", ".glade"}
+KEPT_EXTENSIONS = UI_EXTENSIONS | {".png", ".jpg", ".jpeg", ".svg"}
+BROADWAY_DISPLAY = ":99"  # Ensure we do not conflict with the Deckard instance
+
+# Supported locales
+locales = [
+    "af_ZA",
+    "am_ET",
+    "an_ES",
+    "ar_AE",
+    "as_IN",
+    "ast_ES",
+    "az_AZ",
+    "be_BY",
+    "bem_ZM",
+    "bn_IN",
+    "brx_IN",
+    "bs_BA",
+    "ca_ES",
+    "cs_CZ",
+    "cy_GB",
+    "da_DK",
+    "de_DE",
+    "el_GR",
+    "en_AU",
+    "eo",
+    "es_ES",
+    "et_EE",
+    "eu_ES",
+    "fi_FI",
+    "fur_IT",
+    "fr_FR",
+    "gd_GB",
+    "gl_ES",
+    "gu_IN",
+    "he_IL",
+    "hi_IN",
+    "hr_HR",
+    "hu_HU",
+    "hy_AM",
+    "id_ID",
+    "is_IS",
+    "it_IT",
+    "ja_JP",
+    "kn_IN",
+    "ko_KR",
+    "lt_LT",
+    "lv_LV",
+    "mai_IN",
+    "mg_MG",
+    "mk_MK",
+    "ml_IN",
+    "mn_MN",
+    "mr_IN",
+    "ms_MY",
+    "my_MM",
+    "nb_NO",
+    "nds_NL",
+    "ne_NP",
+    "nl_NL",
+    "nn_NO",
+    "nso_ZA",
+    "oc_FR",
+    "or_IN",
+    "pa_IN",
+    "pl_PL",
+    "pt_BR",
+    "pt_PT",
+    "ro_RO",
+    "ru_RU",
+    "rw_RW",
+    "si_LK",
+    "sk_SK",
+    "sl_SI",
+    "sq_AL",
+    "sr_RS",
+    "sv_SE",
+    "ta_IN",
+    "te_IN",
+    "tg_TJ",
+    "th_TH",
+    "tr_TR",
+    "ug_CN",
+    "uk_UA",
+    "uz_UZ",
+    "vi_VN",
+    "wa_BE",
+    "xh_ZA",
+    "zh_CN",
+    "zh_HK",
+    "zh_TW",
+    "zu_ZA",
+]
+
+# Project blacklist
+# List of modules known to contain nothing displayable by Deckard
+# This list avoid us to clone these projects for nothing.
+modules_blacklist = {
+    "accountsservice",
+    "adwaita-icon-theme",
+    "amtk",
+    "appstream-glib",
+    "at-spi2-core",
+    "atk",
+    "atomato",
+    "cantarell-fonts",
+    "caribou",
+    "chrome-gnome-shell",
+    "clutter",
+    "clutter-gtk",
+    "cogl",
+    "damned-lies",
+    "dconf",
+    "desktop-icons",
+    "ekiga",
+    "evolution-activesync",
+    "evolution-ews",
+    "evolution-mapi",
+    "extensions-web",
+    "flatpak",
+    "folks",
+    "gcab",
+    "gdk-pixbuf",
+    "gdl",
+    "gdm",
+    "gegl",
+    "genius",
+    "ghex",
+    "gimp-gap",
+    "gimp-help",
+    "gimp-tiny-fu",
+    "glib",
+    "glib-networking",
+    "glib-openssl",
+    "gnome-backgrounds",
+    "gnome-commander",
+    "gnome-directory-thumbnailer",
+    "gnome-dvb-daemon",
+    "gnome-font-viewer",
+    "gnome-getting-started-docs",
+    "gnome-hello",
+    "gnome-internet-radio-locator",
+    "gnome-keyring",
+    "gnome-latex",
+    "gnome-menus",
+    "gnome-notes",
+    "gnome-online-accounts",
+    "gnome-settings-daemon",
+    "gnome-shell",
+    "gnome-shell-extensions",
+    "gnome-sound-recorder",
+    "gnome-themes-extra",
+    "gnome-tweaks",
+    "gnome-user-docs",
+    "gnome-user-share",
+    "gnome-video-effects",
+    "gnomemm-website",
+    "goocanvas",
+    "gparted",
+    "grilo",
+    "grilo-plugins",
+    "gsettings-desktop-schemas",
+    "gtk",
+    "gtk-doc",
+    "gtk-mac-integration",
+    "gtk-vnc",
+    "gucharmap",
+    "gvfs",
+    "gxml",
+    "jhbuild",
+    "json-glib",
+    "lasem",
+    "libgdata",
+    "libgnome-games-support",
+    "libgovirt",
+    "libgsf",
+    "libgtop",
+    "libgweather",
+    "libpeas",
+    "library-web",
+    "libsecret",
+    "libsoup",
+    "libwnck",
+    "ModemManager",
+    "msitools",
+    "mutter",
+    "nautilus-sendto",
+    "NetworkManager",
+    "notification-daemon",
+    "pan",
+    "phodav",
+    "polkit",
+    "PulseAudio",
+    "quadrapassel",
+    "release-notes",
+    "sushi",
+    "template-glib",
+    "tepl",
+    "totem-pl-parser",
+    "tracker-miner-chatlog",
+    "tracker-miners",
+    "video-subtitles",
+    "vino",
+    "webkit",
+    "xdg-desktop-portal",
+    "xdg-user-dirs-gtk",
+    "yelp",
+    "yelp-xsl",
+}
+
+
+def get_json(url):
+    """Fetch and decode a JSON document"""
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+
+def po_candidates(lang):
+    """Returns the possible PO file names for a locale, the best first"""
+    parts = re.split("[_.]", lang)
+    return ["%s.po" % name for name in (lang, "_".join(parts[:2]), parts[0])]
+
+
+class ContentBuilder:
+    """Build a content folder, several modules at a time"""
+
+    def __init__(self, jobs, full=False, catalogs=()):
+        self.cache = os.path.abspath("cache")
+        self.work = os.path.abspath("content_tmp")
+        self.content = os.path.abspath("content")
+        self.glade_cache = os.path.join(self.work, libdeckard.GLADE_CACHE)
+        self.jobs = jobs
+        # Merged like Deckard does, which will then find them up to date
+        self.catalogs = catalogs
+        self.mapping_path = None
+        if len(catalogs) > 0:
+            self.mapping_path = os.path.join(self.glade_cache, libdeckard.GLADE_MAPPING)
+        self.mapping = {}  # loaded once merged, see run
+        # Modules built with other locales or catalogs can't be reused
+        self.settings = self.settings_digest()
+        # msgfmt processes are run from this pool
+        self.process_pool = ThreadPoolExecutor(jobs)
+        self.validator = Validator(
+            jobs,
+            cache_dir=self.glade_cache,
+            env=dict(
+                os.environ, GDK_BACKEND="broadway", BROADWAY_DISPLAY=BROADWAY_DISPLAY
+            ),
+            mapping_path=self.mapping_path,
+        )
+        self.previous = {}  # manifest of the previous build
+        if not full:
+            try:
+                with open(os.path.join(self.content, MANIFEST)) as manifest:
+                    self.previous = json.load(manifest)
+            except (OSError, ValueError):
+                pass
+        self._print_lock = Lock()
+
+    def settings_digest(self):
+        """Returns the SHA-256 of the locales and of the catalogs contents"""
+        digests = []
+        for path in self.catalogs:
+            try:
+                with open(path, "rb") as catalog:
+                    digests.append(hashlib.sha256(catalog.read()).hexdigest())
+            except OSError:
+                digests.append(None)
+        return hashlib.sha256(json.dumps([locales, digests]).encode()).hexdigest()
+
+    def log(self, message):
+        """Print a message without mixing it with other threads output"""
+        with self._print_lock:
+            print(message, flush=True)
+
+    def get_modules(self):
+        """Returns the Damned-Lies API URL of all modules"""
+        return [
+            DAMNED_LIES + module["href"]
+            for module in get_json(DAMNED_LIES + "/api/v1/modules/")
+        ]
+
+    def fetch(self, name, url):
+        """Clone or update the cached repository of a module
+
+        If the cached repository can't be updated (eg. the server is
+        unreachable), it is used as is. Only a failed clone is an error.
+        Returns the commit hash of the cached repository.
+        """
+        repo = os.path.join(self.cache, name)
+        if os.path.isdir(os.path.join(repo, ".git")):
+            for command in (
+                ["git", "fetch", "origin"],
+                ["git", "reset", "--hard", "@{upstream}"],
+                ["git", "gc", "--prune=now"],  # Minimize disk space
+            ):
+                try:
+                    subprocess.run(command, cwd=repo, check=True, capture_output=True)
+                except subprocess.CalledProcessError as e:
+                    self.log(
+                        "%s: %s failed, using the cached checkout: %s"
+                        % (
+                            name,
+                            " ".join(command),
+                            e.stderr.decode(errors="replace").strip(),
+                        )
+                    )
+                    break
+        else:
+            os.makedirs(self.cache, exist_ok=True)
+            subprocess.run(
+                ["git", "clone", url, repo],
+                cwd=self.cache,
+                check=True,
+                capture_output=True,
+            )
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=repo,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    def build_translations(self, name, repo):
+        """Compile the PO files of a module for all supported locales
+
+        Returns the list of locales with a translation.
+        """
+        futures = {}
+        for lang in locales:
+            for candidate in po_candidates(lang):
+                po_path = os.path.join(repo, "po", candidate)
+                if os.path.isfile(po_path):
+                    mo_path = os.path.join(
+                        self.work, "LANGS", lang, "LC_MESSAGES", name + ".mo"
+                    )
+                    futures[lang] = self.process_pool.submit(
+                        subprocess.run,
+                        ["msgfmt", "--output-file", mo_path, po_path],
+                        capture_output=True,
+                    )
+                    break
+        return sorted(
+            lang for lang, future in futures.items() if future.result().returncode == 0
+        )
+
+    def copy_ui_folders(self, repo, module_root):
+        """Copy folders with Glade files (and their images) from a repository"""
+        folders = []
+        for root, dirs, files in os.walk(repo):
+            dirs[:] = [d for d in dirs if d != ".git"]
+            if any(os.path.splitext(f)[1].lower() in UI_EXTENSIONS for f in files):
+                folders.append(root)
+
+        copied = set()
+        for folder in folders:
+            for root, dirs, files in os.walk(folder):
+                dirs[:] = [d for d in dirs if d != ".git"]
+                for file_ in files:
+                    if os.path.splitext(file_)[1].lower() not in KEPT_EXTENSIONS:
+                        continue
+                    rel_path = os.path.relpath(os.path.join(root, file_), repo)
+                    if rel_path in copied:
+                        continue
+                    copied.add(rel_path)
+                    dest = os.path.join(module_root, rel_path)
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    shutil.copyfile(os.path.join(root, file_), dest)
+
+    def filter_ui_files(self, module_root):
+        """Remove Glade files Deckard can't use
+
+        Returns the list of remaining files.
+        """
+        kept = []
+        for root, _, files in os.walk(module_root):
+            for file_ in files:
+                if os.path.splitext(file_)[1].lower() not in UI_EXTENSIONS:
+                    continue
+                path = os.path.join(root, file_)
+                reason = None
+                try:
+                    tree = ET.parse(path)
+                except ET.ParseError:
+                    reason = "is not valid"
+                else:
+                    if tree.getroot().tag != "interface":
+                        reason = "is not valid"
+                    elif tree.find(".//*[@translatable]") is None:
+                        reason = "has nothing translatable"
+                    elif tree.find(".//*[@type-func]") is not None:
+                        # We don't support odd glade files with type-func
+                        # attributes (evolution, I'm looking at you)
+                        reason = "uses type-func"
+                if reason is None:
+                    kept.append(path)
+                else:
+                    self.log("%s %s, removing it..." % (path, reason))
+                    os.remove(path)
+        return kept
+
+    def validate(self, paths):
+        """Remove files which are not loadable or have nothing to display"""
+        for report in self.validator.validate(paths):
+            if report["windows"] == 0:
+                reason = report["error"] or "nothing to display"
+                self.log(
+                    "%s is not displayable (%s), removing it..."
+                    % (report["path"], reason)
+                )
+                os.remove(report["path"])
+
+    def reuse(self, name, entry):
+        """Copy an unchanged module from the previous content folder
+
+        Its preprocessed Glade files are copied too, so that they are not
+        processed again on their first display.
+        """
+        if entry["files"] > 0:
+            module_root = os.path.join(self.work, name)
+            shutil.copytree(os.path.join(self.content, name), module_root)
+            os.makedirs(self.glade_cache, exist_ok=True)
+            for root, _, files in os.walk(module_root):
+                for file_ in files:
+                    if os.path.splitext(file_)[1].lower() not in UI_EXTENSIONS:
+                        continue
+                    with open(os.path.join(root, file_), "rb") as ui:
+                        cached = cache_key(ui.read(), self.mapping) + ".json"
+                    cached_path = os.path.join(
+                        self.content, libdeckard.GLADE_CACHE, cached
+                    )
+                    if os.path.isfile(cached_path):
+                        shutil.copyfile(
+                            cached_path, os.path.join(self.glade_cache, cached)
+                        )
+        for lang in entry["languages"]:
+            mo_path = os.path.join("LANGS", lang, "LC_MESSAGES", name + ".mo")
+            shutil.copyfile(
+                os.path.join(self.content, mo_path), os.path.join(self.work, mo_path)
+            )
+
+    def build_module(self, api_url):
+        """Retrieve and process a single module
+
+        Returns a tuple with the module name and its manifest entry.
+        The entry is None if the module was ignored.
+        """
+        module = get_json(api_url)
+        name = module["name"]
+        # We only want projects translated on Damned-Lies.
+        # Others most likely have no use of Deckard anyway.
+        if module.get("ext_platform") or name in modules_blacklist:
+            return name, None
+
+        start = time.monotonic()
+        commit = self.fetch(name, module["vcs_web"].rstrip("/") + ".git")
+        entry = self.previous.get(name)
+        if (
+            entry is not None
+            and entry["commit"] == commit
+            and entry.get("settings") == self.settings
+        ):
+            self.reuse(name, entry)
+            return name, dict(entry, seconds=time.monotonic() - start, reused=True)
+
+        repo = os.path.join(self.cache, name)
+        module_root = os.path.join(self.work, name)
+        languages = self.build_translations(name, repo)
+        self.copy_ui_folders(repo, module_root)
+        self.validate(self.filter_ui_files(module_root))
+
+        # Remove empty folders
+        for root, _, _ in os.walk(module_root, topdown=False):
+            if not os.listdir(root):
+                os.rmdir(root)
+
+        files = 0
+        for _, _, filenames in os.walk(module_root):
+            files += sum(
+                os.path.splitext(f)[1].lower() in UI_EXTENSIONS for f in filenames
+            )
+        if files == 0:
+            # Is there anything left?
+            shutil.rmtree(module_root, ignore_errors=True)
+
+        entry = {
+            "commit": commit,
+            "settings": self.settings,
+            "files": files,
+            "languages": languages,
+            "seconds": time.monotonic() - start,
+            "reused": False,
+        }
+        return name, entry
+
+    def run(self):
+        """Build the whole content folder and replace the previous one"""
+        shutil.rmtree(self.work, ignore_errors=True)
+        for lang in locales:
+            os.makedirs(os.path.join(self.work, "LANGS", lang, "LC_MESSAGES"))
+        if self.mapping_path is not None:
+            compile_mapping(self.catalogs, self.mapping_path)
+            self.mapping = load_mapping(self.mapping_path)
+
+        start = time.monotonic()
+        manifest = {}
+        modules = self.get_modules()
+        with ThreadPoolExecutor(self.jobs) as pool:
+            futures = {pool.submit(self.build_module, url): url for url in modules}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    name, entry = future.result()
+                except Exception as e:
+                    self.log(
+                        "[%d/%d] %s failed: %s"
+                        % (done, len(modules), futures[future], e)
+                    )
+                    continue
+                if entry is None:
+                    self.log("[%d/%d] %s ignored" % (done, len(modules), name))
+                    continue
+                manifest[name] = entry
+                self.log(
+                    "[%d/%d] %s: %d files, %d locales, %.1fs%s"
+                    % (
+                        done,
+                        len(modules),
+                        name,
+                        entry["files"],
+                        len(entry["languages"]),
+                        entry["seconds"],
+                        " (unchanged)" if entry["reused"] else "",
+                    )
+                )
+
+        # Remember when this was done
+        with open(os.path.join(self.work, "timestamp"), "w") as timestamp:
+            timestamp.write(
+                datetime.datetime.now().astimezone().isoformat(timespec="seconds")
+            )
+        with open(os.path.join(self.work, MANIFEST), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+        # Index the content, so Deckard does not have to explore it
+        libdeckard.write_content_index(self.work)
+
+        # We are done, now replace the old content folder (if any)
+        shutil.rmtree(self.content, ignore_errors=True)
+        os.rename(self.work, self.content)
+        self.log("Content built in %.1fs" % (time.monotonic() - start))
+
+
+def parse():
+    """Argument parsing"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of modules and processes handled simultaneously.",
+    )
+    parser.add_argument(
+        "-f",
+        "--full",
+        action="store_true",
+        help="Process all modules, even those which did not change since "
+        "the previous build.",
+    )
+    parser.add_argument(
+        "-c",
+        "--catalog-path",
+        action="append",
+        default=[],
+        dest="catalog_paths",
+        help="Validate UI files with the specified Glade catalog, like Deckard "
+        "does with its glade_catalog_path setting. "
+        "This option can be given several times.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    for command in ("git", "msgfmt", "broadwayd"):
+        if shutil.which(command) is None:
+            sys.exit("This script requires the %s command. Aborting." % command)
+
+    # The following is necessary for X-less servers
+    broadwayd = subprocess.Popen(["broadwayd", BROADWAY_DISPLAY])
+    try:
+        builder = ContentBuilder(args.jobs, args.full, args.catalog_paths)
+        try:
+            builder.run()
+        finally:
+            builder.validator.close()
+    finally:
+        broadwayd.kill()
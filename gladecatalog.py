@@ -0,0 +1,87 @@
+# Deckard, a Web based Glade Runner
+# Copyright (C) 2013  Nicolas Delvaux <contact@nicolas-delvaux.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Inheritances of custom widgets, as declared by Glade catalogs
+
+Runners replace a custom widget by the standard one it inherits from (see
+GladeRunner._preprocess). Instead of parsing every catalog at each runner
+start, the catalogs are merged once into a small JSON mapping file.
+"""
+
+import os
+import json
+import tempfile
+import xml.etree.ElementTree as ET
+
+
+def read_catalogs(paths):
+    """Returns {widget type: parent type} for the catalogs at paths
+
+    When catalogs disagree, the last one wins. Parents which are themselves
+    custom widgets are followed, up to a type no catalog knows.
+    """
+    parents = {}
+    for path in paths:
+        tree = ET.parse(path)
+        for gclass in tree.findall(".//glade-widget-class"):
+            if gclass.get("parent"):
+                parents[gclass.get("name")] = gclass.get("parent")
+
+    mapping = {}
+    for name, parent in parents.items():
+        seen = {name}
+        while parent in parents and parent not in seen:
+            seen.add(parent)
+            parent = parents[parent]
+        mapping[name] = parent
+    return mapping
+
+
+def compile_mapping(paths, mapping_path):
+    """Merge the catalogs at paths in mapping_path, unless it is up to date
+
+    The mapping is up to date if it was made from the same catalogs and none
+    of them changed since. Missing catalogs are ignored.
+    Returns True if the mapping was written.
+    """
+    paths = [os.path.abspath(path) for path in paths if os.path.isfile(path)]
+    try:
+        mtime = os.stat(mapping_path).st_mtime_ns
+        with open(mapping_path) as mapping_file:
+            catalogs = json.load(mapping_file)["catalogs"]
+        if catalogs == paths and all(
+            os.stat(path).st_mtime_ns < mtime for path in paths
+        ):
+            return False
+    except (OSError, ValueError, KeyError):
+        pass
+
+    content = {"catalogs": paths, "mapping": read_catalogs(paths)}
+    # Several processes may do this at the same time
+    os.makedirs(os.path.dirname(mapping_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(mapping_path))
+    with os.fdopen(fd, "w") as mapping_file:
+        json.dump(content, mapping_file, separators=(",", ":"), sort_keys=True)
+    # Runners may not run as the user who built the content
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, mapping_path)
+    return True
+
+
+def load_mapping(mapping_path):
+    """Returns the mapping written by compile_mapping"""
+    with open(mapping_path) as mapping_file:
+        return json.load(mapping_file)["mapping"]
@@ -21,18 +21,32 @@
 import os
 import re
 import sys
+import json
+import time
+import queue
 import fcntl
+import select
 import locale
 import signal
 import ctypes
+import hashlib
 import builtins
 import argparse
+import tempfile
 import importlib
-from threading import Timer
-from subprocess import Popen
+from contextlib import contextmanager
+from subprocess import Popen, PIPE, DEVNULL
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import xml.etree.ElementTree as ET
 
-import gi
+from gladecatalog import read_catalogs, load_mapping
+
+# Timed for --profile, as this is a noticeable part of the start-up
+_gi_import_start = time.perf_counter()
+gi = importlib.import_module("gi")
+GLib = importlib.import_module("gi.repository.GLib")
+GObject = importlib.import_module("gi.repository.GObject")
+_gi_import_time = time.perf_counter() - _gi_import_start
 
 placeholder_widget = """
 class %(name)s(Gtk.Label):
@@ -45,11 +59,123 @@ class %(name)s(Gtk.Label):
         )
 """
 
+# Bump this when the preprocessing changes, to invalidate cached files
+CACHE_VERSION = 2
+
+# Names of the placeholder widget types defined so far
+placeholder_types = set()
+
+# Name of the window listing the windows to show, see GladeRunner.show
+PICKER_NAME = "Deckard_WindowPicker"
+
 
 class GladeRunnerException(Exception):
     pass
 
 
+def cache_key(content, mapping):
+    """Returns the name of the cached version of a Glade file, see --cache-dir
+
+    content is the Glade file itself and mapping the widget inheritances it is
+    loaded with.
+    """
+    return hashlib.sha256(
+        json.dumps([CACHE_VERSION, mapping], sort_keys=True).encode() + content
+    ).hexdigest()
+
+
+class Profiler:
+    """Time the phases needed to display a file, see --profile
+
+    Phases of the process start-up are reported with the first file only.
+    """
+
+    def __init__(self):
+        self.phases = {"import_gi": _gi_import_time}
+        self.details = {}
+
+    @contextmanager
+    def phase(self, name):
+        """Time a with block, adding to the previous times of this phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def take(self, **details):
+        """Returns the timings of the displayed file and reset"""
+        record = dict(self.details, **details)
+        record["phases"] = self.phases
+        record["seconds"] = sum(self.phases.values())
+        self.phases = {}
+        self.details = {}
+        return record
+
+    def write(self, fd, **details):
+        """Write the timings of the displayed file as a JSON line and reset
+
+        A single write is used, so that lines of several runners sharing the
+        same pipe do not mix.
+        """
+        os.write(fd, (json.dumps(self.take(**details)) + "\n").encode())
+
+
+profiler = Profiler()
+
+
+class CommandChannel:
+    """Commands sent by Deckard on a file descriptor, as one JSON object per line
+
+    Each command has an "action" key, the other keys are its parameters.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.closed = False  # True once the other end is gone
+        self.pending = []  # commands read but not handled yet, see put_back
+        self._buffer = b""
+
+    def read(self):
+        """Return the list of commands received since the last call
+
+        This blocks until some data is available, unless the file descriptor
+        is non-blocking or some commands were put back.
+        Lines which are not JSON objects are skipped.
+        """
+        if self.pending:
+            commands, self.pending = self.pending, []
+            return commands
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        if not data:
+            self.closed = True
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        commands = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                command = json.loads(line)
+            except ValueError:
+                print("Ignoring malformed command %r" % line, file=sys.stderr)
+                continue
+            if isinstance(command, dict):
+                commands.append(command)
+        return commands
+
+    def put_back(self, commands):
+        """Have commands returned again by the next read"""
+        self.pending = commands + self.pending
+
+
+stdin_channel = CommandChannel(0)
+
+
 class GladeRunner:
     """Module to load a Glade file and display all windows in it"""
 
@@ -60,53 +186,102 @@ class GladeRunner:
         lang_path=None,
         language="POSIX",
         suicidal=False,
-        catalog_path=None,
+        catalog_paths=(),
+        cache_dir=None,
+        profile_fd=None,
+        mapping_path=None,
+        window_picker=0,
+        reply_fd=None,
     ):
         """Create the GladeRunner instance"""
 
         # Late import because of potential environment tweaking outside of
         # the class (start_broadwayd)
-        gi.require_version("Gtk", "3.0")
-        builtins.Gtk = importlib.import_module("gi.repository.Gtk")
+        with profiler.phase("import_gtk"):
+            gi.require_version("Gtk", "3.0")
+            builtins.Gtk = importlib.import_module("gi.repository.Gtk")
 
         self.glade_file_path = glade_file_path
         self.lang_path = lang_path
         self.gettext_domain = gettext_domain
         self.builder = Gtk.Builder()
-        self.mapping = dict()  # inheritances parsed from the catalog
+        self.mapping = dict()  # inheritances declared by the catalogs
+        self.cache_dir = cache_dir  # where preprocessed files are stored
         self.windows = {}
+        # Where to write timings, see Profiler
+        self.profile_fd = profile_fd
+        # Above that many windows, show them on demand (0: never), see show
+        self.window_picker = window_picker
+        # Where to tell how each load command went, see on_command
+        self.reply_fd = reply_fd
 
-        if catalog_path is not None:
-            tree = ET.parse(catalog_path)
-            for gclass in tree.findall(".//glade-widget-class"):
-                if gclass.get("parent"):
-                    self.mapping[gclass.get("name")] = gclass.get("parent")
+        with profiler.phase("catalog"):
+            if mapping_path is not None:
+                # Precompiled by gladecatalog.compile_mapping
+                self.mapping = load_mapping(mapping_path)
+            elif catalog_paths:
+                self.mapping = read_catalogs(catalog_paths)
 
         if suicidal:
             # Set STDIN to be non-blocking
             fl = fcntl.fcntl(sys.stdin, fcntl.F_GETFL)
             fcntl.fcntl(sys.stdin, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-            t = Timer(5, self.nde)
-            t.daemon = True
-            t.start()
+            GLib.io_add_watch(
+                stdin_channel.fd,
+                GLib.PRIORITY_DEFAULT,
+                GLib.IOCondition.IN | GLib.IOCondition.HUP,
+                self.on_command,
+            )
+            if stdin_channel.pending:
+                # Received with the first file, the watch won't see them
+                GLib.idle_add(self.on_pending_commands)
 
+        self.set_language(language)
+
+    @classmethod
+    def set_language(cls, language):
+        """Switch the whole process to another locale"""
+        os.environ["LANG"] = language
         locale.setlocale(locale.LC_ALL, language)
+        # GTK may have been initialized before the locale was known
+        Gtk.Widget.set_default_direction(Gtk.get_locale_direction())
 
-    def nde(self):
-        """Near Death Experience
+    def on_command(self, *_):
+        """Handle the commands sent by Deckard on STDIN
 
-        Try to read from stdin. If there is nothing, commit suicide.
+        The only supported action is "load", which replaces the displayed file
+        with the one given in parameters (and profiles it if its "profile"
+        parameter is true). Other actions are ignored.
+        A load command is answered on reply_fd (see reply). If it fails, the
+        runner quits.
+        Deckard keeps the other end of STDIN open for as long as it needs this
+        runner, so quit as soon as it is closed.
         """
-        message = sys.stdin.readlines()
-        if len(message) > 0:
-            # Someone loves me!
-            t = Timer(5, self.nde)
-            t.daemon = True
-            t.start()
-        else:
-            # I'm forever alone, this life is not worth living...
+        for command in stdin_channel.read():
+            if command.pop("action", None) == "load":
+                try:
+                    self.reload(**command)
+                except Exception as exp:
+                    print(exp, file=sys.stderr)
+                    self.reply(str(exp))
+                    Gtk.main_quit()
+                else:
+                    self.reply(None)
+        if stdin_channel.closed:
+            # Deckard deleted the session, or died
             Gtk.main_quit()
-            os._exit(0)
+            return False
+        return True
+
+    def reply(self, error):
+        """Write {"error": error} as a JSON line on reply_fd, if any"""
+        if self.reply_fd is not None:
+            os.write(self.reply_fd, (json.dumps({"error": error}) + "\n").encode())
+
+    def on_pending_commands(self):
+        """Handle the commands which were put back in stdin_channel, once"""
+        self.on_command()
+        return False
 
     def load(self):
         """Process and load the provided glade file
@@ -119,11 +294,37 @@ class GladeRunner:
          - disabling "dangerous" widgets like file choosers
          - giving a window to window-less highest level widgets
          - show a dedicated window to control orphan StackSwitcher widgets
+
+        If a cache directory was given, the processed file is stored there and
+        reused by the next loads of the same file.
         """
+        # The locale has to be set before GTK loads the file
+        locale.bindtextdomain(self.gettext_domain, self.lang_path)
+        locale.textdomain(self.gettext_domain)
 
-        # Parse the Glade file as XML for additional processing
-        tree = ET.parse(self.glade_file_path)
+        with open(self.glade_file_path, "rb") as glade_file:
+            content = glade_file.read()
+        key = cache_key(content, self.mapping)
 
+        with profiler.phase("cache_lookup"):
+            cached = self._load_cached(key)
+        profiler.details["cached"] = cached
+        if not cached:
+            with profiler.phase("parse"):
+                # Parse the Glade file as XML for additional processing
+                tree = ET.ElementTree(ET.fromstring(content))
+            with profiler.phase("preprocess"):
+                self._preprocess(tree)
+            with profiler.phase("builder"):
+                self._load(tree)
+            with profiler.phase("cache_store"):
+                self._store_cached(key)
+
+        with profiler.phase("postprocess"):
+            self._postprocess()
+
+    def _preprocess(self, tree):
+        """Make the ElementTree of a Glade file ready for GtkBuilder"""
         # Substitute templates (if any) for actual objects
         # We can't reliably figure out how these templates are mapped by their
         # true consumers, so we use the 'parent' attribute to substitute them.
@@ -148,13 +349,64 @@ class GladeRunner:
                 if obj.get("class") in self.mapping:
                     obj.set("class", self.mapping[obj.get("class")])
 
-        # The locale has to be set before GTK loads the file
-        locale.bindtextdomain(self.gettext_domain, self.lang_path)
-        locale.textdomain(self.gettext_domain)
+        self._resolve_types(tree)
+
+    def _load_cached(self, key):
+        """Try to load the processed file from the cache
+
+        Returns True on success, False if the file is not cached or unusable.
+        """
+        if self.cache_dir is None:
+            return False
+        try:
+            with open(os.path.join(self.cache_dir, key + ".json")) as cached:
+                entry = json.load(cached)
+        except (OSError, ValueError):
+            return False
+
+        try:
+            if entry["needs_handy"]:
+                import_handy()
+            for name in entry["placeholders"]:
+                if name not in placeholder_types:
+                    define_placeholder(name)
+            self.builder.add_from_string(entry["xml"])
+        except Exception:
+            # Let's process it again, from scratch
+            self.builder = Gtk.Builder()
+            return False
+        self.xml = entry["xml"]
+        return True
 
-        self._load(tree)
+    def _store_cached(self, key):
+        """Save the processed file in the cache, if any"""
+        if self.cache_dir is None:
+            return
+        # Placeholders or libhandy may have been loaded for a previous file
+        classes = {obj.get("class") for obj in ET.fromstring(self.xml).iter("object")}
+        entry = {
+            "xml": self.xml,
+            "placeholders": sorted(classes & placeholder_types),
+            "needs_handy": any(name.startswith("Hdy") for name in classes),
+        }
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, "w") as cached:
+                json.dump(entry, cached)
+            os.replace(tmp_path, os.path.join(self.cache_dir, key + ".json"))
+        except OSError:
+            # The cache is just nice to have
+            pass
 
+    def _postprocess(self):
+        """Make loaded objects safe and displayable"""
+        toplevel = set()  # highest level widgets
+        stacks = set()
+        switched_stacks = set()  # stacks with a StackSwitcher
         for obj in self.builder.get_objects():
+            if hasattr(obj, "get_toplevel"):
+                toplevel.add(obj.get_toplevel())
             # disable FileChooser (it can be a security issue)
             if isinstance(obj, Gtk.FileChooser):
                 obj.set_sensitive(False)
@@ -173,13 +425,12 @@ class GladeRunner:
                 if name is None:
                     name = "gladerunner%d" % len(self.windows)
                 self.windows[name] = obj
+            if isinstance(obj, Gtk.Stack):
+                stacks.add(obj)
+            elif isinstance(obj, Gtk.StackSwitcher):
+                switched_stacks.add(obj.get_stack())
 
         # Wrap all root widgets in a GtkWindow if needed
-        toplevel = set()
-        for obj in self.builder.get_objects():
-            if hasattr(obj, "get_toplevel"):
-                toplevel.add(obj.get_toplevel())
-
         for obj in toplevel:
             if hasattr(obj, "is_toplevel") and obj.is_toplevel():
                 # This is most likely a menu. It is probably embeded
@@ -195,18 +446,13 @@ class GladeRunner:
             self.windows[name] = window
 
         # Check if embedded GtkStack are usable out of the box
-        stack_switcher_to_create = set()
-        for obj in self.builder.get_objects():
-            if isinstance(obj, Gtk.Stack):
-                if len(obj.get_children()) < 2:
-                    # No need for a StackSwitcher
-                    continue
-                for obj2 in self.builder.get_objects():
-                    if isinstance(obj2, Gtk.StackSwitcher) and obj2.get_stack() == obj:
-                        break
-                else:
-                    # We found not matching StackSwitcher for this Stack, we will create one
-                    stack_switcher_to_create.add(obj)
+        # We will create a StackSwitcher for stacks with several children but
+        # without any matching StackSwitcher
+        stack_switcher_to_create = {
+            stack
+            for stack in stacks - switched_stacks
+            if len(stack.get_children()) >= 2
+        }
 
         if stack_switcher_to_create:
             switcher_window = Gtk.Window(title="Deckard: GtkStackSwitcher")
@@ -224,66 +470,235 @@ class GladeRunner:
             self.windows["Deckard_GtkStackSwitcher"] = switcher_window
 
     def _load(self, tree):
-        """Try to load a Glade file from an ElementTree.
+        """Load a Glade file from an ElementTree.
 
-        If an unknown widget is found, try to use a placeholder instead.
+        Widget types must already be resolved (see _resolve_types).
+        GtkBuilder may still find unknown internal children: they are deleted
+        and the file is loaded again.
+        The XML finally loaded is kept in self.xml.
         """
-        try:
-            self.builder.add_from_string(ET.tostring(tree.getroot()).decode())
-        except Exception as e:
-            message = str(e)
-            # Try to detect if we miss a custom widget
-            if "Invalid object type" in message:
-                try:
-                    custom_name = re.search(
-                        ".*Invalid object type '(.*)'.*", message
-                    ).group(1)
-                    if custom_name.startswith("Hdy") and not hasattr(builtins, "Handy"):
-                        # This UI needs libhandy
-                        builtins.Handy = importlib.import_module("gi.repository.Handy")
-                        Handy.init()
-                        self._load(tree)
-                    else:
-                        # Try to replace this unknown widget by a placeholder
-                        # This will fail if this placeholder was already defined
-                        exec(placeholder_widget % {"name": custom_name})
-                        self._load(tree)
-                except:
-                    raise GladeRunnerException(message)
-            # Any unknown internal child?
-            elif message.startswith("Unknown internal child: "):
-                # Just try to delete it.
-                # Not sure if this is the best thing to do, but it allows the
-                # display of some more UI (like in Epiphany)
-                deleted = False
-                for obj in tree.findall(".//object"):
-                    # we can't "findall child" directly because we need
-                    # to remove from the parent
-                    for child in obj.findall("child"):
-                        if child.get("internal-child") == message[24:]:
-                            deleted = True
-                            obj.remove(child)
-                if deleted:
-                    self._load(tree)
-                else:
-                    # No infinite loop please
-                    raise GladeRunnerException(message)
-            else:
+        profiler.details["retries"] = 0
+        while True:
+            self.xml = ET.tostring(tree.getroot()).decode()
+            try:
+                self.builder.add_from_string(self.xml)
+                return
+            except Exception as e:
+                message = str(e)
+            profiler.details["retries"] += 1
+
+            match = re.search(r"Unknown internal child: ([\w-]+)", message)
+            if match is None:
+                raise GladeRunnerException(message)
+            # Just try to delete it.
+            # Not sure if this is the best thing to do, but it allows the
+            # display of some more UI (like in Epiphany)
+            if not self._remove_internal_child(tree, match.group(1)):
+                # No infinite loop please
                 raise GladeRunnerException(message)
+            # Do not keep objects of the failed attempt
+            self.builder = Gtk.Builder()
+
+    def _resolve_types(self, tree):
+        """Make sure that GtkBuilder knows every widget type of the tree
+
+        libhandy is loaded if needed and placeholders are defined for unknown
+        widgets. As these have no internal children, those are deleted.
+        """
+        unknown = set()
+        for name in {obj.get("class") for obj in tree.iter("object")}:
+            if self.builder.get_type_from_name(name) != GObject.TYPE_INVALID:
+                continue
+            if name.startswith("Hdy"):
+                # This UI needs libhandy
+                import_handy()
+                if self.builder.get_type_from_name(name) != GObject.TYPE_INVALID:
+                    continue
+            unknown.add(name)
+
+        for name in unknown:
+            try:
+                define_placeholder(name)
+            except Exception as e:
+                raise GladeRunnerException("Invalid object type '%s': %s" % (name, e))
 
-    def display(self):
-        """Display all windows"""
+        for obj in tree.iter("object"):
+            if obj.get("class") in placeholder_types:
+                for child in obj.findall("child"):
+                    if child.get("internal-child") is not None:
+                        obj.remove(child)
+
+    @classmethod
+    def _remove_internal_child(cls, tree, name):
+        """Delete all internal children with this name from the tree
+
+        Returns True if something was deleted, False otherwise.
+        """
+        deleted = False
+        for obj in tree.iter("object"):
+            # we can't "findall child" directly because we need
+            # to remove from the parent
+            for child in obj.findall("child"):
+                if child.get("internal-child") == name:
+                    deleted = True
+                    obj.remove(child)
+        return deleted
+
+    def reload(
+        self, glade_file_path, gettext_domain, language, lang_path, profile=False
+    ):
+        """Replace the displayed windows by the ones of another Glade file
+
+        The GTK main loop keeps running, so this is a lot faster than
+        starting a new runner.
+        If profile is True, timings are written on profile_fd.
+        """
+        for window in self.windows.values():
+            window.destroy()
+        self.windows = {}
+        self.builder = Gtk.Builder()
+        self.glade_file_path = glade_file_path
+        self.gettext_domain = gettext_domain
+        self.lang_path = lang_path
+        self.set_language(language)
+        self.load()
+        self.show()
+        if profile:
+            self.write_profile()
+
+    def write_profile(self):
+        """Write the timings of the displayed file, if profiling is enabled"""
+        if self.profile_fd is not None:
+            profiler.write(
+                self.profile_fd,
+                module=self.gettext_domain,
+                file=os.path.basename(self.glade_file_path),
+                windows=len(self.windows),
+            )
+
+    def show(self):
+        """Show all windows
+
+        If there are more than window_picker windows, only the main one is
+        shown at first, with a window listing the other ones. These are only
+        shown (and rendered by broadwayd) once picked.
+        """
         if len(self.windows) == 0:
             raise GladeRunnerException(
                 "Nothing to display. Did you load the file first?"
             )
-        else:
-            for name in self.windows:
-                # We don't want any window to be modal in our case, as it won't work well.
-                self.windows[name].set_modal(False)
-                self.windows[name].connect("delete-event", self.close_window)
-                self.windows[name].show_all()
-            Gtk.main()
+        with profiler.phase("show"):
+            if 0 < self.window_picker < len(self.windows):
+                names = self._sorted_windows()
+                self._add_picker(names[1:])
+                self._show_window(names[0])
+                self._show_window(PICKER_NAME)
+                profiler.details["shown"] = 2
+            else:
+                for name in self.windows:
+                    self._show_window(name)
+                profiler.details["shown"] = len(self.windows)
+
+    def _show_window(self, name):
+        """Show a window, or raise it if it is already shown"""
+        window = self.windows[name]
+        if window.get_visible():
+            window.present()
+            return
+        # We don't want any window to be modal in our case, as it won't work well.
+        window.set_modal(False)
+        window.connect("delete-event", self.close_window)
+        window.show_all()
+
+    def _sorted_windows(self):
+        """Returns the names of the windows, the main one first
+
+        Windows of the file come first, in the file order. Then come the ones
+        made by Deckard to hold other widgets.
+        """
+        objects = ET.fromstring(self.xml).findall("object")
+        positions = {obj.get("id"): i for i, obj in enumerate(objects)}
+
+        def rank(name):
+            # Windows made by Deckard are named after the widget they hold
+            made = self.builder.get_object(name) is not self.windows[name]
+            return made, positions.get(name, len(positions))
+
+        return sorted(self.windows, key=rank)
+
+    def _add_picker(self, names):
+        """Create a window with a button to show each of these windows"""
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6, margin=12)
+        box.add(Gtk.Label(label="Other windows of this file:", xalign=0))
+        for name in names:
+            button = Gtk.Button(label=self.windows[name].get_title() or name)
+            button.connect("clicked", lambda _, name: self._show_window(name), name)
+            self.windows[name].connect("destroy", self.on_picked_window_closed, button)
+            box.add(button)
+        scrolled = Gtk.ScrolledWindow(
+            hscrollbar_policy=Gtk.PolicyType.NEVER,
+            propagate_natural_height=True,
+            max_content_height=500,
+        )
+        scrolled.add(box)
+        picker = Gtk.Window(title="Deckard: windows")
+        picker.add(scrolled)
+        Gtk.Buildable.set_name(picker, PICKER_NAME)
+        self.windows[PICKER_NAME] = picker
+
+    @classmethod
+    def on_picked_window_closed(cls, _, button):
+        """Disable the button of a closed window, if the picker is still there"""
+        if button.get_parent() is not None:
+            button.set_sensitive(False)
+
+    def snapshot(self, directory):
+        """Render each window as a PNG image in directory, instead of displaying
+
+        GTK only draws shown windows, so each one is briefly shown.
+        The images are listed in directory/windows.json, the main window first
+        (see _sorted_windows).
+        """
+        import cairo
+
+        index = []
+        with profiler.phase("snapshot"):
+            for number, name in enumerate(self._sorted_windows()):
+                window = self.windows[name]
+                window.set_modal(False)
+                window.show_all()
+                # Let GTK lay the window out
+                deadline = time.monotonic() + 5
+                while Gtk.events_pending() and time.monotonic() < deadline:
+                    Gtk.main_iteration()
+                width = window.get_allocated_width()
+                height = window.get_allocated_height()
+                surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+                window.draw(cairo.Context(surface))
+                image = "%d.png" % number
+                surface.write_to_png(os.path.join(directory, image))
+                window.hide()
+                index.append(
+                    {
+                        "name": name,
+                        "title": window.get_title() or name,
+                        "image": image,
+                        "width": width,
+                        "height": height,
+                    }
+                )
+        with open(os.path.join(directory, "windows.json"), "w") as index_file:
+            json.dump(index, index_file)
+
+    def display(self, profile=True):
+        """Display all windows
+
+        If profile is True, timings are written on profile_fd.
+        """
+        self.show()
+        if profile:
+            self.write_profile()
+        Gtk.main()
 
     @classmethod
     def ignore_link(cls, _):
@@ -301,19 +716,185 @@ class GladeRunner:
         """Close this window and quit if no more windows are displayed"""
         window.destroy()
         del self.windows[Gtk.Buildable.get_name(window)]
-        if len(self.windows) == 0:
+        # Windows not picked yet are not visible
+        if not any(other.get_visible() for other in self.windows.values()):
             Gtk.main_quit()
 
 
+class Validator:
+    """Check if Glade files are loadable and displayable
+
+    Files are loaded in long-lived worker processes (see validate_file), which
+    are replaced if they crash or time out.
+    """
+
+    def __init__(
+        self,
+        workers=2,
+        timeout=30,
+        catalog_paths=(),
+        cache_dir=None,
+        env=None,
+        mapping_path=None,
+    ):
+        self.size = workers
+        self.timeout = timeout
+        self.env = env
+        self._args = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--workers",
+            "0",
+            "--validate",
+        ]
+        for catalog_path in catalog_paths:
+            self._args[2:2] = ["--catalog-path", catalog_path]
+        if mapping_path is not None:
+            self._args[2:2] = ["--mapping-path", mapping_path]
+        if cache_dir is not None:
+            self._args[2:2] = ["--cache-dir", cache_dir]
+        self._workers = queue.Queue()  # idle worker processes
+        for _ in range(workers):
+            self._workers.put(None)  # started when first needed
+
+    def _validate(self, path):
+        """Validate a single file in a worker and returns its report"""
+        start = time.monotonic()
+        process = self._workers.get()
+        try:
+            if process is None or process.poll() is not None:
+                process = Popen(
+                    self._args,
+                    stdin=PIPE,
+                    stdout=PIPE,
+                    stderr=DEVNULL,
+                    env=self.env,
+                    text=True,
+                )
+            try:
+                process.stdin.write(path + "\n")
+                process.stdin.flush()
+            except BrokenPipeError:
+                pass
+            if select.select([process.stdout], [], [], self.timeout)[0]:
+                line = process.stdout.readline()
+                if line:
+                    return json.loads(line)
+                error = "The worker crashed."
+            else:
+                error = "Timed out after %d seconds." % self.timeout
+            # This worker is not usable anymore
+            process.kill()
+            process.wait()
+            process = None
+            return {
+                "path": path,
+                "loadable": False,
+                "windows": 0,
+                "error": error,
+                "seconds": time.monotonic() - start,
+            }
+        finally:
+            self._workers.put(process)
+
+    def validate(self, paths):
+        """Yields the report of each file, as soon as it is ready"""
+        with ThreadPoolExecutor(self.size) as pool:
+            futures = [pool.submit(self._validate, path) for path in paths]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def close(self):
+        """Stop all worker processes"""
+        for _ in range(self.size):
+            process = self._workers.get()
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
+
+
+def validate_file(path, catalog_paths=(), cache_dir=None, mapping_path=None):
+    """Check if a Glade file is loadable and displayable, in this process
+
+    Returns a report like:
+    {'path': path, 'loadable': True, 'windows': 2, 'error': None,
+     'seconds': 0.12}
+    """
+    start = time.monotonic()
+    report = {"path": path, "loadable": False, "windows": 0, "error": None}
+    try:
+        gr = GladeRunner(
+            path,
+            catalog_paths=catalog_paths,
+            cache_dir=cache_dir,
+            mapping_path=mapping_path,
+        )
+        gr.load()
+        report["loadable"] = True
+        report["windows"] = len(gr.windows)
+        for window in gr.windows.values():
+            window.destroy()
+    except Exception as exp:
+        report["error"] = str(exp)
+    report["seconds"] = time.monotonic() - start
+    return report
+
+
+def import_handy():
+    """Make libhandy widgets available"""
+    if not hasattr(builtins, "Handy"):
+        builtins.Handy = importlib.import_module("gi.repository.Handy")
+        Handy.init()
+
+
+def define_placeholder(name):
+    """Register a placeholder widget type for an unknown widget type
+
+    This fails if this placeholder was already defined.
+    """
+    exec(placeholder_widget % {"name": name})
+    placeholder_types.add(name)
+
+
+def preload_gtk():
+    """Import GTK ahead of time, before knowing on which display to run"""
+    with profiler.phase("import_gtk"):
+        gi.require_version("Gtk", "3.0")
+        builtins.Gtk = importlib.import_module("gi.repository.Gtk")
+
+
+def wait_for_display(timeout=5):
+    """Initialize GTK, waiting for the display to accept connections"""
+    deadline = time.monotonic() + timeout
+    with profiler.phase("gtk_init"):
+        while not Gtk.init_check(sys.argv)[0]:
+            if time.monotonic() > deadline:
+                raise GladeRunnerException("Could not connect to the display.")
+            time.sleep(0.02)
+
+
 def start_broadwayd(port):
-    """Start a broadwayd daemon on the specified port"""
+    """Start a broadwayd daemon on the specified port
+
+    The daemon is reaped by the GLib main loop. As there is nothing to display
+    on without it, this process exits with an error if it dies.
+    """
     display = ":%d" % port
     libc = ctypes.CDLL("libc.so.6")
     # Send a SIGTERM to the child when its parent die
     set_pdeathsig = lambda: libc.prctl(1, signal.SIGTERM)
-    Popen(["broadwayd", "--port", str(port), display], preexec_fn=set_pdeathsig)
+    with profiler.phase("broadwayd"):
+        broadwayd = Popen(
+            ["broadwayd", "--port", str(port), display], preexec_fn=set_pdeathsig
+        )
     os.putenv("BROADWAY_DISPLAY", display)
 
+    def on_exit(pid, status):
+        print("broadwayd exited (wait status %d)." % status, file=sys.stderr)
+        os._exit(1)
+
+    GLib.child_watch_add(GLib.PRIORITY_DEFAULT, broadwayd.pid, on_exit)
+
 
 def parse():
     """Argument parsing"""
@@ -330,8 +911,8 @@ def parse():
         "-s",
         "--suicidal",
         action="store_true",
-        help="Try to read from STDIN each 5 seconds. "
-        "If there is nothing to read, exit.",
+        help="Read commands from STDIN (see CommandChannel). "
+        "Exit once STDIN is closed.",
     )
     parser.add_argument(
         "-b",
@@ -345,17 +926,148 @@ def parse():
         "-c",
         "--catalog-path",
         type=lambda p: is_file(parser, p),
-        help="Load the specified Glade catalog.",
+        action="append",
+        default=[],
+        dest="catalog_paths",
+        help="Load the specified Glade catalog. "
+        "This option can be given several times.",
+    )
+    parser.add_argument(
+        "-m",
+        "--mapping-path",
+        type=lambda p: is_file(parser, p),
+        help="Load the widget inheritances of Glade catalogs from the specified "
+        "file, as merged by gladecatalog.compile_mapping, instead of the "
+        "catalogs themselves.",
+    )
+    parser.add_argument(
+        "-C",
+        "--cache-dir",
+        help="Store processed Glade files in the specified directory, "
+        "to load them faster the next time.",
     )
-    parser.add_argument("glade_file_path", type=lambda p: is_file(parser, p))
+    parser.add_argument(
+        "--validate",
+        nargs="*",
+        metavar="FILE",
+        help="Check if the specified files (or the ones listed on STDIN, one "
+        "per line) are loadable and displayable, instead of displaying one. "
+        "A JSON report is printed for each file.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=2,
+        help="Number of worker processes used with --validate. "
+        "With 0, files are loaded in this process.",
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=int,
+        default=30,
+        help="Seconds allowed to load a file with --validate.",
+    )
+    parser.add_argument(
+        "-W",
+        "--window-picker",
+        type=int,
+        default=0,
+        metavar="N",
+        help="If the file has more than N windows, only show the main one at "
+        "first, with a window to show the other ones on demand. "
+        "0 (the default) means always show all windows.",
+    )
+    parser.add_argument(
+        "-S",
+        "--snapshot",
+        metavar="DIR",
+        help="Render each window of the file as a PNG image in DIR, with a "
+        "windows.json index, then exit instead of displaying them.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=int,
+        metavar="FD",
+        dest="profile_fd",
+        help="Write a JSON line with the time spent in each phase on the file "
+        "descriptor FD (eg. 2 for STDERR) once the file is displayed. "
+        'With --suicidal, only loads with a true "profile" parameter are '
+        "profiled.",
+    )
+    parser.add_argument(
+        "--reply-fd",
+        type=int,
+        metavar="FD",
+        help="With --suicidal, write a JSON line on the file descriptor FD "
+        'once each "load" command is handled: {"error": null} on success.',
+    )
+    parser.add_argument(
+        "-p",
+        "--pooled",
+        action="store_true",
+        help='Import GTK, then wait for a "load" command on STDIN giving '
+        "the positional arguments and the broadwayd port before going on.",
+    )
+    parser.add_argument("glade_file_path", type=lambda p: is_file(parser, p), nargs="?")
     parser.add_argument("gettext_domain", default="foobar", nargs="?")
     parser.add_argument("language", default="POSIX", nargs="?")
     parser.add_argument("lang_path", default=None, nargs="?")
-    return parser.parse_args()
+    args = parser.parse_args()
+    # With --suicidal, the "profile" parameter of load commands tells it
+    args.profile = not args.suicidal
+
+    if args.pooled:
+        preload_gtk()
+        command = {}
+        commands = []
+        while command.get("action") != "load":
+            if len(commands) > 0:
+                command = commands.pop(0)
+                continue
+            if stdin_channel.closed:
+                # Nobody will ever need us
+                sys.exit()
+            commands = stdin_channel.read()
+        # The next ones are handled once the file is displayed
+        stdin_channel.put_back(commands)
+        del command["action"]
+        vars(args).update(command)
+        is_file(parser, args.glade_file_path)
+        os.environ["LANG"] = args.language
+    elif args.glade_file_path is None and args.validate is None:
+        parser.error("the glade_file_path argument is required.")
+    return args
 
 
 if __name__ == "__main__":
     args = parse()
+    if args.validate is not None:
+        # Only reports are written on STDOUT, anything else goes to STDERR
+        output = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        paths = args.validate or (line.rstrip("\n") for line in sys.stdin)
+        if args.workers == 0:
+            reports = (
+                validate_file(
+                    path, args.catalog_paths, args.cache_dir, args.mapping_path
+                )
+                for path in paths
+            )
+        else:
+            validator = Validator(
+                args.workers,
+                args.timeout,
+                args.catalog_paths,
+                args.cache_dir,
+                mapping_path=args.mapping_path,
+            )
+            reports = validator.validate(paths)
+        for report in reports:
+            print(json.dumps(report), file=output, flush=True)
+        sys.exit()
+
     if args.with_broadwayd is not None:
         start_broadwayd(args.with_broadwayd)
     gr = GladeRunner(
@@ -364,11 +1076,21 @@ if __name__ == "__main__":
         args.lang_path,
         args.language,
         args.suicidal,
-        args.catalog_path,
+        args.catalog_paths,
+        args.cache_dir,
+        args.profile_fd,
+        args.mapping_path,
+        args.window_picker,
+        args.reply_fd,
     )
 
     try:
+        if args.with_broadwayd is not None:
+            wait_for_display()
         gr.load()
-        gr.display()
+        if args.snapshot is not None:
+            gr.snapshot(args.snapshot)
+            sys.exit()
+        gr.display(args.profile)
     except GladeRunnerException as exp:
         sys.exit(exp)
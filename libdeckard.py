@@ -18,16 +18,58 @@
 
 import os
 import re
+import io
+import json
 import locale
 import shutil
+import select
+import signal
+import socket
+import struct
+import bisect
+import resource
+import heapq
+import hashlib
 import tempfile
-import urllib.request
+import time
+import random
+import weakref
+import traceback
+import urllib.parse
 from uuid import uuid4
-from threading import Lock, Timer
-from collections import OrderedDict
-from subprocess import Popen, PIPE, STDOUT, check_output, CalledProcessError
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Condition, Event, Lock, Thread, get_ident
+from collections import OrderedDict, deque
+from http.client import HTTPConnection, HTTPSConnection, RemoteDisconnected
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from subprocess import Popen, PIPE, STDOUT, DEVNULL, TimeoutExpired
+from subprocess import check_output, CalledProcessError
 
 from languages import locale_language_mapping
+from sessionstore import MemorySessionStore
+from gladecatalog import compile_mapping
+
+# Prebuilt content structure, found at the root of the content folder
+CONTENT_INDEX = "index.json"
+# Glade files processed by gladerunner, also in the content folder
+GLADE_CACHE = "GLADE_CACHE"
+# Merged Glade catalogs, in the GLADE_CACHE folder
+GLADE_MAPPING = "catalogs.json"
+# Windows rendered as images by gladerunner, also in the content folder
+SNAPSHOT_CACHE = "SNAPSHOT_CACHE"
+# Bump this when the rendering changes, to invalidate cached snapshots
+SNAPSHOT_VERSION = 1
+# Seconds given to a runner to render a file as images
+SNAPSHOT_TIMEOUT = 30
+# Seconds given to a displayed runner to load another file
+RELOAD_TIMEOUT = 30
+
+# Environment of the runners, rendering through broadwayd
+RUNNER_ENV = {
+    "GDK_BACKEND": "broadway",
+    "UBUNTU_MENUPROXY": "",
+    "LIBOVERLAY_SCROLLBAR": "0",
+}
 
 
 class DeckardException(Exception):
@@ -37,93 +79,1249 @@ class DeckardException(Exception):
         Exception.__init__(self, "%s\n\n%s" % (short, log))
 
 
+class BusyException(DeckardException):
+    """There is no room for one more session or runner right now"""
+
+
+class QueuedException(DeckardException):
+    """The request has to wait for its turn, see AdmissionQueue"""
+
+    def __init__(self, ticket, position, eta):
+        self.ticket = ticket
+        self.position = position
+        self.eta = eta  # in seconds, None if unknown
+        DeckardException.__init__(
+            self,
+            "Please wait for your turn.",
+            "You are number %d in the waiting queue." % (position + 1),
+        )
+
+
+class Histogram:
+    """Distribution of observed values, as a Prometheus histogram"""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets  # upper bounds, in increasing order
+        self._counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self._sum = 0
+        self._lock = Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of a with block, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = [
+            "# HELP %s %s" % (self.name, self.description),
+            "# TYPE %s histogram" % self.name,
+        ]
+        cumulated = 0
+        for bound, count in zip(self.buckets + ["+Inf"], counts):
+            cumulated += count
+            lines.append('%s_bucket{le="%s"} %d' % (self.name, bound, cumulated))
+        lines.append("%s_sum %s" % (self.name, repr(float(total))))
+        lines.append("%s_count %d" % (self.name, cumulated))
+        return lines
+
+
+class Counter:
+    """Number of events by label value, as a Prometheus counter"""
+
+    def __init__(self, name, description, label):
+        self.name = name
+        self.description = description
+        self.label = label
+        self._counts = {}
+        self._lock = Lock()
+
+    def inc(self, value):
+        with self._lock:
+            self._counts[value] = self._counts.get(value, 0) + 1
+
+    def render(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.description),
+            "# TYPE %s counter" % self.name,
+        ]
+        with self._lock:
+            for value, count in sorted(self._counts.items()):
+                # Label values are escaped like in the text format specification
+                value = (
+                    value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                )
+                lines.append('%s{%s="%s"} %d' % (self.name, self.label, value, count))
+        return lines
+
+
+class Metrics:
+    """
+    Instrumentation of Deckard, in the Prometheus text format.
+    Figures are for the current process only.
+    Gauges are measured by a function, when the metrics are rendered.
+    """
+
+    def __init__(self):
+        seconds = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+        lock_seconds = [0.00001, 0.0001, 0.001, 0.01, 0.1, 1, 10]
+        self.spawn = Histogram(
+            "deckard_spawn_seconds", "Time to answer spawn requests.", seconds
+        )
+        self.po_compile = Histogram(
+            "deckard_po_compile_seconds",
+            "Time to check and compile a PO file (msgfmt).",
+            seconds,
+        )
+        self.po_download = Histogram(
+            "deckard_po_download_seconds", "Time to download a PO file.", seconds
+        )
+        self.po_download_size = Histogram(
+            "deckard_po_download_bytes",
+            "Size of the downloaded PO files.",
+            [10000, 50000, 100000, 250000, 500000, 1000000, 2500000],
+        )
+        self.snapshot = Histogram(
+            "deckard_snapshot_seconds",
+            "Time to render a file as images, when it was not cached.",
+            seconds,
+        )
+        self.lock_wait = Histogram(
+            "deckard_lock_wait_seconds",
+            "Time spent waiting for the sessions registry lock.",
+            lock_seconds,
+        )
+        self.lock_hold = Histogram(
+            "deckard_lock_hold_seconds",
+            "Time the sessions registry lock is held.",
+            lock_seconds,
+        )
+        self.errors = Counter(
+            "deckard_errors_total", "Errors returned to the users.", "type"
+        )
+        self._gauges = []  # [(name, description, function)]
+
+    def gauge(self, name, description, function):
+        """Report the value returned by function()"""
+        self._gauges.append((name, description, function))
+
+    def render(self):
+        """Returns all the metrics, in the Prometheus text format"""
+        lines = []
+        for metric in (
+            self.spawn,
+            self.po_compile,
+            self.po_download,
+            self.po_download_size,
+            self.snapshot,
+            self.lock_wait,
+            self.lock_hold,
+            self.errors,
+        ):
+            lines.extend(metric.render())
+        for name, description, function in self._gauges:
+            lines.append("# HELP %s %s" % (name, description))
+            lines.append("# TYPE %s gauge" % name)
+            lines.append("%s %s" % (name, repr(float(function()))))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class TimedLock:
+    """
+    A Lock whose wait and hold times are measured (see Metrics).
+    It can be used with a Condition.
+    """
+
+    def __init__(self, wait_histogram, hold_histogram):
+        self._lock = Lock()
+        self._wait = wait_histogram
+        self._hold = hold_histogram
+        self._owner = None
+        self._acquired = 0
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        if not self._lock.acquire(blocking, timeout):
+            return False
+        self._acquired = time.perf_counter()
+        self._owner = get_ident()
+        self._wait.observe(self._acquired - start)
+        return True
+
+    def release(self):
+        held = time.perf_counter() - self._acquired
+        self._owner = None
+        self._lock.release()
+        self._hold.observe(held)
+
+    def _is_owned(self):
+        """Used by Condition"""
+        return self._owner == get_ident()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *_):
+        self.release()
+
+
+class ProcessSupervisor:
+    """
+    Reap child processes as soon as they exit.
+    Each watched process has a callback, which is called with its Popen object
+    from the supervisor thread once the process is reaped.
+    Exits are noticed through pidfds, so a single thread watches all processes.
+    """
+
+    def __init__(self):
+        self._watched = {}  # {pid: (pidfd, process, callback)}
+        self._pids = {}  # {pidfd: pid}
+        self._lock = Lock()
+        self._epoll = select.epoll()
+        Thread(target=self._loop, daemon=True).start()
+
+    def watch(self, process, callback):
+        """Call callback(process) once process exited
+
+        If the process is already watched, its callback is replaced.
+        """
+        with self._lock:
+            if process.pid in self._watched:
+                pidfd = self._watched[process.pid][0]
+                self._watched[process.pid] = (pidfd, process, callback)
+                return
+            if process.returncode is None:
+                try:
+                    pidfd = os.pidfd_open(process.pid)
+                except ProcessLookupError:
+                    pass  # reaped in the meantime
+                else:
+                    self._watched[process.pid] = (pidfd, process, callback)
+                    self._pids[pidfd] = process.pid
+                    self._epoll.register(pidfd, select.EPOLLIN)
+                    return
+        # The process is already gone
+        callback(process)
+
+    def _loop(self):
+        while True:
+            for pidfd, _ in self._epoll.poll():
+                with self._lock:
+                    self._epoll.unregister(pidfd)
+                    _, process, callback = self._watched.pop(self._pids.pop(pidfd))
+                os.close(pidfd)
+                process.wait()  # it exited, so this does not block
+                try:
+                    callback(process)
+                except Exception:
+                    traceback.print_exc()
+
+
+class RunnerResources:
+    """
+    Measure and limit the resources used by runners.
+    A runner is counted with its children, that is with its broadwayd.
+    If cgroup is the path of a delegated cgroup v2 folder, each runner is put
+    in its own child cgroup, which gives exact figures and caps its memory to
+    max_memory bytes and its CPU to max_cpu CPUs. Otherwise, they are read from
+    /proc and only the memory can be capped, with RLIMIT_DATA.
+    Runners can be spawned while they use less than memory_budget bytes and
+    cpu_budget CPUs. Limits and budgets set to 0 are not enforced.
+    """
+
+    # Usage figures are measured again after this many seconds
+    sample_interval = 1
+
+    def __init__(
+        self, memory_budget=0, cpu_budget=0, max_memory=0, max_cpu=0, cgroup=""
+    ):
+        self.memory_budget = memory_budget
+        self.cpu_budget = cpu_budget
+        self.max_memory = max_memory
+        self.max_cpu = max_cpu
+        self.cgroup = cgroup if os.path.isdir(cgroup) else None
+        if self.cgroup is not None:
+            try:
+                # Let child cgroups have their own limits
+                with open(
+                    os.path.join(self.cgroup, "cgroup.subtree_control"), "w"
+                ) as f:
+                    f.write("+memory +cpu")
+            except OSError:
+                pass  # already enabled, or the cgroup is not delegated
+        self._runners = {}  # {pid: child cgroup path, or None}
+        self._stale = []  # child cgroups not removed yet
+        self._cpu = {}  # {pid: (CPU seconds, time of the measure)}
+        self._usage = (0, 0.0)  # (memory in bytes, CPUs)
+        self._sampled = 0
+        self._lock = Lock()
+
+    def attach(self, process):
+        """Apply the limits to a runner, which was just started"""
+        path = None
+        if self.cgroup is not None:
+            path = os.path.join(self.cgroup, "runner-%d" % process.pid)
+            try:
+                os.mkdir(path)
+                if self.max_memory > 0:
+                    self._write(path, "memory.max", str(self.max_memory))
+                if self.max_cpu > 0:
+                    self._write(path, "cpu.max", "%d 100000" % (self.max_cpu * 100000))
+                self._write(path, "cgroup.procs", str(process.pid))
+            except OSError:
+                traceback.print_exc()
+                self._remove_cgroup(path)
+                path = None
+        if path is None and self.max_memory > 0:
+            try:
+                limit = (self.max_memory, self.max_memory)
+                resource.prlimit(process.pid, resource.RLIMIT_DATA, limit)
+            except OSError:
+                pass  # it already exited
+        with self._lock:
+            self._runners[process.pid] = path
+
+    def detach(self, process):
+        """Forget a runner, which exited"""
+        with self._lock:
+            self._sampled = 0  # measure again without it
+            path = self._runners.pop(process.pid, None)
+            self._cpu.pop(process.pid, None)
+            if path is not None:
+                self._stale.append(path)
+            stale, self._stale = self._stale, []
+        for path in stale:
+            self._remove_cgroup(path)
+
+    def _remove_cgroup(self, path):
+        """Kill what is left in a child cgroup and remove it"""
+        try:
+            self._write(path, "cgroup.kill", "1")
+        except OSError:
+            pass  # empty, or an old kernel
+        try:
+            os.rmdir(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # The processes are still dying, try again later
+            with self._lock:
+                self._stale.append(path)
+
+    def _write(self, path, name, value):
+        with open(os.path.join(path, name), "w") as f:
+            f.write(value)
+
+    def _measure_cgroup(self, path):
+        """Returns the memory (in bytes) and CPU time (in seconds) of a cgroup"""
+        with open(os.path.join(path, "memory.current")) as f:
+            memory = int(f.read())
+        with open(os.path.join(path, "cpu.stat")) as f:
+            for line in f:
+                if line.startswith("usage_usec "):
+                    return memory, int(line.split()[1]) / 1000000
+        return memory, 0.0
+
+    def _measure_processes(self, pids):
+        """Returns the memory (in bytes) and CPU time (in seconds) of processes
+
+        Memory is the resident set size.
+        """
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        clock_ticks = os.sysconf("SC_CLK_TCK")
+        memory, cpu = 0, 0.0
+        for pid in pids:
+            try:
+                with open("/proc/%d/statm" % pid) as f:
+                    memory += int(f.read().split()[1]) * page_size
+                with open("/proc/%d/stat" % pid) as f:
+                    # The process name may contain spaces and parentheses
+                    fields = f.read().rsplit(")", 1)[1].split()
+                cpu += (int(fields[11]) + int(fields[12])) / clock_ticks
+            except (OSError, IndexError, ValueError):
+                pass  # it exited in the meantime
+        return memory, cpu
+
+    def _children(self):
+        """Returns the children of every process, as {pid: [child pid]}"""
+        children = {}
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            try:
+                with open("/proc/%s/stat" % name) as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(name))
+        return children
+
+    def _descendants(self, pid, children):
+        """Returns pid with all its descendant processes"""
+        found = []
+        pending = [pid]
+        while len(pending) > 0:
+            pid = pending.pop()
+            found.append(pid)
+            pending.extend(children.get(pid, []))
+        return found
+
+    def usage(self):
+        """Returns the memory (in bytes) and CPUs used by all runners
+
+        CPUs are averaged since the previous measure, and figures are at most
+        sample_interval seconds old.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._sampled < self.sample_interval:
+                return self._usage
+            runners = dict(self._runners)
+            self._sampled = now
+
+            memory, cpus = 0, 0.0
+            children = None
+            for pid, path in runners.items():
+                try:
+                    if path is not None:
+                        runner_memory, cpu = self._measure_cgroup(path)
+                    else:
+                        if children is None:
+                            children = self._children()
+                        runner_memory, cpu = self._measure_processes(
+                            self._descendants(pid, children)
+                        )
+                except (OSError, ValueError):
+                    continue  # it exited in the meantime
+                memory += runner_memory
+                if pid in self._cpu:
+                    last_cpu, last_time = self._cpu[pid]
+                    cpus += max(cpu - last_cpu, 0) / (now - last_time)
+                self._cpu[pid] = (cpu, now)
+            self._usage = (memory, cpus)
+            return self._usage
+
+    def admit(self):
+        """Check that one more runner fits in the budgets
+
+        One more runner is expected to use as much memory as the others in
+        average.
+        """
+        if self.memory_budget <= 0 and self.cpu_budget <= 0:
+            return
+        memory, cpus = self.usage()
+        with self._lock:
+            count = len(self._runners)
+        expected = memory / count if count > 0 else 0
+        if self.memory_budget > 0 and memory + expected > self.memory_budget:
+            raise BusyException(
+                "The server is too busy!",
+                "Runners already use %d MB of memory out of %d MB.\n"
+                "You may want to retry in a few minutes."
+                % (memory // 1000000, self.memory_budget // 1000000),
+            )
+        if self.cpu_budget > 0 and cpus >= self.cpu_budget:
+            raise BusyException(
+                "The server is too busy!",
+                "Runners already use %.1f CPUs out of %.1f.\n"
+                "You may want to retry in a few minutes." % (cpus, self.cpu_budget),
+            )
+
+
+class AdmissionQueue:
+    """
+    Users waiting for room, first come first served.
+    A waiting user is identified by a ticket. It has to ask again at least
+    every timeout seconds to keep its place. At most size users can wait.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._tickets = OrderedDict()  # {ticket: time of the last request}
+        # When the last rooms were made, to estimate the waiting time
+        self._freed = deque(maxlen=20)
+        self._lock = Lock()
+
+    def _purge(self):
+        """Forget the users who gave up
+
+        The lock must be held."""
+        limit = time.monotonic() - self.timeout
+        for ticket in list(self._tickets):
+            if self._tickets[ticket] < limit:
+                del self._tickets[ticket]
+
+    def ahead(self, ticket):
+        """Returns how many users are waiting before ticket"""
+        with self._lock:
+            self._purge()
+            if ticket in self._tickets:
+                return list(self._tickets).index(ticket)
+            return len(self._tickets)
+
+    def join(self, ticket):
+        """Wait in the queue, or keep waiting
+
+        Returns the position of ticket, starting at 0.
+        """
+        with self._lock:
+            self._purge()
+            if ticket not in self._tickets and len(self._tickets) >= self.size:
+                raise BusyException(
+                    "Too many users!",
+                    "Too many users are already waiting.\n"
+                    "You may want to retry in a few minutes.",
+                )
+            self._tickets[ticket] = time.monotonic()
+            return list(self._tickets).index(ticket)
+
+    def leave(self, ticket):
+        """Stop waiting, once admitted"""
+        with self._lock:
+            self._tickets.pop(ticket, None)
+
+    def room_made(self):
+        """Tell that a session or a runner stopped"""
+        with self._lock:
+            self._freed.append(time.monotonic())
+
+    def eta(self, position):
+        """Returns the expected wait at position in seconds, None if unknown
+
+        Room is expected to be made as often as it was lately.
+        """
+        with self._lock:
+            if len(self._freed) < 2:
+                return None
+            interval = (self._freed[-1] - self._freed[0]) / (len(self._freed) - 1)
+            return round(interval * (position + 1))
+
+
+class RunnerProfiles:
+    """
+    Timings written by runners started with --profile, aggregated for each
+    module and file (see gladerunner.Profiler).
+    All runners share the write end of a pipe, which is read by a thread.
+    """
+
+    def __init__(self):
+        read_fd, self.fd = os.pipe()  # runners are given self.fd
+        # {(module, file): [count, seconds, max seconds, {phase: seconds}]}
+        self._stats = {}
+        self._lock = Lock()
+        Thread(target=self._loop, args=(read_fd,), daemon=True).start()
+
+    def _loop(self, read_fd):
+        buffer = b""
+        while True:
+            *lines, buffer = (buffer + os.read(read_fd, 65536)).split(b"\n")
+            for line in lines:
+                try:
+                    self.add(json.loads(line))
+                except (ValueError, KeyError):
+                    traceback.print_exc()
+
+    def add(self, record):
+        """Account the timings of one displayed file"""
+        with self._lock:
+            stats = self._stats.setdefault(
+                (record["module"], record["file"]), [0, 0, 0, {}]
+            )
+            stats[0] += 1
+            stats[1] += record["seconds"]
+            stats[2] = max(stats[2], record["seconds"])
+            for phase, seconds in record["phases"].items():
+                stats[3][phase] = stats[3].get(phase, 0) + seconds
+
+    def report(self):
+        """Returns the average timings of each file, the slowest first
+
+        Each file is described by a dictionary like:
+        {'module': 'gedit', 'file': 'gedit-window.ui', 'count': 3,
+         'seconds': 0.8, 'max_seconds': 1.5,
+         'phases': {'builder': 0.5, 'show': 0.2, ...}}
+        """
+        report = []
+        with self._lock:
+            for (module, file), stats in self._stats.items():
+                count, seconds, max_seconds, phases = stats
+                report.append(
+                    {
+                        "module": module,
+                        "file": file,
+                        "count": count,
+                        "seconds": seconds / count,
+                        "max_seconds": max_seconds,
+                        "phases": {
+                            phase: total / count for phase, total in phases.items()
+                        },
+                    }
+                )
+        return sorted(report, key=lambda item: item["seconds"], reverse=True)
+
+
+class RunnerPool:
+    """
+    Pool of gladerunner processes started in advance.
+    Pooled runners have already imported GTK and are waiting on their STDIN
+    for the file to display, which saves most of the start-up time of a spawn.
+    A runner exits as soon as its STDIN is closed, that is once its Popen
+    object is gone (or Deckard itself).
+    Runners are limited and accounted by resources (see RunnerResources).
+    Runners are given the widget inheritances declared by the catalogs (paths
+    of Glade catalogs), merged in cache_dir (see catalog_args).
+    If profile_fd is not None, runners write their timings on it when asked
+    to (see RunnerProfiles).
+    Files with more than window_picker windows are shown a window at a time
+    (see GladeRunner.show).
+    """
+
+    def __init__(
+        self,
+        gladerunner,
+        catalogs,
+        cache_dir,
+        supervisor,
+        resources,
+        size=2,
+        profile_fd=None,
+        window_picker=0,
+    ):
+        self.gladerunner = gladerunner
+        self.catalogs = catalogs
+        self.mapping_path = os.path.join(cache_dir, GLADE_MAPPING)
+        self.cache_dir = cache_dir
+        self.size = size
+        self.profile_fd = profile_fd
+        self.window_picker = window_picker
+        self.supervisor = supervisor
+        self.resources = resources
+        self._runners = deque()  # idle runners, the oldest first
+        self._lock = Lock()
+        self._filling = False  # True while a thread refills the pool
+        self.fill()
+
+    def _start_runner(self):
+        """Launch a gladerunner instance in pooled mode"""
+        args = [self.gladerunner, "--suicidal", "--pooled"]
+        args.extend(("--cache-dir", self.cache_dir))
+        args.extend(("--window-picker", str(self.window_picker)))
+        pass_fds = ()
+        if self.profile_fd is not None:
+            args.extend(("--profile", str(self.profile_fd)))
+            pass_fds = (self.profile_fd,)
+
+        args.extend(self.catalog_args())
+
+        read_fd, reply_fd = os.pipe()
+        args.extend(("--reply-fd", str(reply_fd)))
+        try:
+            runner = Popen(
+                args, stdin=PIPE, env=RUNNER_ENV, pass_fds=pass_fds + (reply_fd,)
+            )
+        finally:
+            os.close(reply_fd)
+        # Answers to the load commands, see Session.spawn_runner
+        runner.replies = os.fdopen(read_fd, "rb", buffering=0)
+        self.resources.attach(runner)
+        self.supervisor.watch(runner, self._forget)
+        return runner
+
+    def catalog_args(self):
+        """Returns the options of a runner, to use the Glade catalogs
+
+        The merged catalogs are written again if they are outdated or missing,
+        eg. once the content folder was rebuilt. If they can't be written,
+        runners read the catalogs themselves.
+        """
+        if len(self.catalogs) == 0:
+            return []
+        try:
+            compile_mapping(self.catalogs, self.mapping_path)
+            return ["--mapping-path", self.mapping_path]
+        except OSError:
+            traceback.print_exc()
+        args = []
+        for path in self.catalogs:
+            if os.path.isfile(path):
+                args.extend(("--catalog-path", path))
+        return args
+
+    def _forget(self, runner):
+        """Remove a runner which died while waiting from the pool"""
+        self.resources.detach(runner)
+        with self._lock:
+            if runner in self._runners:
+                self._runners.remove(runner)
+
+    def fill(self):
+        """Start runners until the pool is full"""
+        with self._lock:
+            while len(self._runners) < self.size:
+                self._runners.append(self._start_runner())
+
+    def _refill(self):
+        """Fill the pool from another thread, unless one already does it"""
+        with self._lock:
+            if self._filling or len(self._runners) >= self.size:
+                return
+            self._filling = True
+        Thread(target=self._refill_loop, daemon=True).start()
+
+    def _refill_loop(self):
+        """Start runners one at a time, without blocking acquire meanwhile"""
+        while True:
+            with self._lock:
+                if len(self._runners) >= self.size:
+                    self._filling = False
+                    return
+            try:
+                runner = self._start_runner()
+            except Exception:
+                traceback.print_exc()
+                with self._lock:
+                    self._filling = False
+                return
+            with self._lock:
+                self._runners.append(runner)
+
+    def acquire(self, on_exit):
+        """Take a runner out of the pool.
+
+        A new runner is started if the pool is empty.
+        The pool is then refilled in the background, so the next caller won't
+        have to wait.
+        on_exit(runner) is called by the supervisor once the runner exited.
+        """
+        runner = None
+        with self._lock:
+            if len(self._runners) > 0:
+                runner = self._runners.popleft()
+        if runner is None:
+            runner = self._start_runner()
+
+        def on_runner_exit(runner):
+            self.resources.detach(runner)
+            on_exit(runner)
+
+        self.supervisor.watch(runner, on_runner_exit)
+        self._refill()
+        return runner
+
+    def __del__(self):
+        """Kill all idle runners"""
+        for runner in self._runners:
+            if runner.poll() is None:
+                runner.kill()
+
+
+class MoCache:
+    """
+    Compiled PO files, shared between sessions.
+    Entries are identified by the SHA-256 of the PO file and by the module it
+    is compiled for. They are read-only, counted when used by a session and
+    deleted when no session uses them, the least recently used first, once the
+    cache is bigger than max_size bytes.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        # {key: [lang_root, lang, size, references]}, the least recently used first
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def acquire(self, po_path, module, digest):
+        """Get the compiled version of a PO file, compiling it if needed
+
+        The caller must release the returned key once it does not need the
+        files anymore.
+        Returns a tuple with the key, the language root path and the language
+        of the PO file.
+        """
+        key = "%s:%s" % (module, digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[3] += 1
+                self._entries.move_to_end(key)
+                return key, entry[0], entry[1]
+
+        lang = detect_po_language(po_path)
+        lang_root = tempfile.mkdtemp(prefix="deckard_")
+        mo_path = os.path.join(lang_root, "LANGS", lang, "LC_MESSAGES", module + ".mo")
+        os.makedirs(os.path.dirname(mo_path))
+        try:
+            compile_po(po_path, mo_path)
+        except DeckardException:
+            shutil.rmtree(lang_root)
+            raise
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # Someone compiled the same file in the meantime
+                shutil.rmtree(lang_root)
+                entry[3] += 1
+                self._entries.move_to_end(key)
+                return key, entry[0], entry[1]
+            size = os.path.getsize(mo_path)
+            self._entries[key] = [lang_root, lang, size, 1]
+            self.size += size
+            self._evict()
+        return key, lang_root, lang
+
+    def release(self, key):
+        """Tell that a session does not use this entry anymore"""
+        with self._lock:
+            self._entries[key][3] -= 1
+            self._evict()
+
+    def _evict(self):
+        """Delete unused entries until the cache fits in max_size
+
+        The lock must be held."""
+        for key in list(self._entries):
+            if self.size <= self.max_size:
+                break
+            lang_root, _, size, references = self._entries[key]
+            if references == 0:
+                shutil.rmtree(lang_root)
+                self.size -= size
+                del self._entries[key]
+
+    def __del__(self):
+        """Delete all entries"""
+        for entry in self._entries.values():
+            shutil.rmtree(entry[0], ignore_errors=True)
+
+
+class SnapshotCache:
+    """
+    Windows of Glade files rendered as PNG images (see gladerunner --snapshot).
+    Each entry is a folder named after its key, with the images and their
+    windows.json index. The least recently used entries are deleted once the
+    cache is bigger than max_size bytes. Using an entry updates its mtime, so
+    that the order survives restarts and is shared by Deckard processes.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        # {key: size}, the least recently used first
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        entries = []
+        # The folder is only made for the first render (see make_dir)
+        for key in os.listdir(path) if os.path.isdir(path) else ():
+            entry_path = os.path.join(path, key)
+            if key.startswith("."):
+                # Left behind by a render which did not finish
+                shutil.rmtree(entry_path, ignore_errors=True)
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_path, name))
+                for name in os.listdir(entry_path)
+            )
+            entries.append((os.path.getmtime(entry_path), key, size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self.size += size
+
+    def get(self, key):
+        """Returns the index of the images of key, or None if it is not cached"""
+        entry_path = os.path.join(self.path, key)
+        try:
+            with open(os.path.join(entry_path, "windows.json")) as index:
+                windows = json.load(index)
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            # Maybe deleted by another process
+            with self._lock:
+                self.size -= self._entries.pop(key, 0)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return windows
+
+    def image_path(self, key, image):
+        """Returns the path of an image of the key entry"""
+        return os.path.join(self.path, key, image)
+
+    def make_dir(self):
+        """Returns a temporary folder where to render a new entry"""
+        if not os.path.isdir(self.path):
+            # New, or removed with the content folder it was in
+            with self._lock:
+                self._entries.clear()
+                self.size = 0
+            os.makedirs(self.path, exist_ok=True)
+        return tempfile.mkdtemp(prefix=".", dir=self.path)
+
+    def add(self, key, render_dir):
+        """Make the images rendered in render_dir the entry of key"""
+        size = sum(
+            os.path.getsize(os.path.join(render_dir, name))
+            for name in os.listdir(render_dir)
+        )
+        os.chmod(render_dir, 0o755)
+        try:
+            os.rename(render_dir, os.path.join(self.path, key))
+        except OSError:
+            # Someone rendered the same file in the meantime
+            shutil.rmtree(render_dir)
+            return
+        with self._lock:
+            self._entries[key] = size
+            self.size += size
+            while self.size > self.max_size and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                shutil.rmtree(os.path.join(self.path, old_key), ignore_errors=True)
+                self.size -= old_size
+
+
+class PoDownloader:
+    """
+    Download PO files from a list of mirrors.
+    All mirrors are asked at the same time and the first good answer wins.
+    Connections are kept alive for the next downloads, and the files recently
+    downloaded are revalidated instead of being downloaded again, as long as the
+    cache is not bigger than max_cache_size bytes.
+    """
+
+    chunk_size = 65536
+
+    def __init__(self, urls, max_size, max_cache_size=10000000, timeout=10):
+        # URL sorted by priority, with a %s for the file name
+        self.urls = urls
+        self.max_size = max_size  # of a downloaded file
+        self.max_cache_size = max_cache_size
+        self.cache_size = 0
+        self.timeout = timeout
+        # {url: (etag, last_modified, data)}, the least recently used first
+        self._cache = OrderedDict()
+        self._connections = {}  # idle connections, by (scheme, host)
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4 * max(len(urls), 1))
+
+    def download(self, name):
+        """Returns the content of the name file
+
+        If every mirror fails, the error of the last one to answer is raised.
+        """
+        if len(self.urls) == 0:
+            raise DeckardException(
+                "Operation not supported",
+                "The PO download feature is not configured on this instance.",
+            )
+        with metrics.po_download.time():
+            data = self._download(name)
+        metrics.po_download_size.observe(len(data))
+        return data
+
+    def _download(self, name):
+        """Race the mirrors for the name file"""
+        cancelled = Event()
+        futures = [
+            self._executor.submit(self._fetch, url % name, cancelled)
+            for url in self.urls
+        ]
+        error = None
+        try:
+            for future in as_completed(futures):
+                try:
+                    return future.result()
+                except DeckardException as e:
+                    # Too big on this mirror, maybe not on the others
+                    error = e
+                except Exception as e:
+                    # Most likely a '404: not found' error
+                    error = DeckardException("Enable to retrieve the file", str(e))
+        finally:
+            # Stop the slower downloads
+            cancelled.set()
+        raise error
+
+    def _get_connection(self, scheme, host):
+        with self._lock:
+            idle = self._connections.get((scheme, host))
+            if idle:
+                return idle.pop()
+        if scheme == "https":
+            return HTTPSConnection(host, timeout=self.timeout)
+        elif scheme == "http":
+            return HTTPConnection(host, timeout=self.timeout)
+        raise ValueError("Unsupported URL scheme: %s" % scheme)
+
+    def _release_connection(self, scheme, host, connection):
+        with self._lock:
+            self._connections.setdefault((scheme, host), []).append(connection)
+
+    def _request(self, connection, path, headers):
+        try:
+            connection.request("GET", path, headers=headers)
+            return connection.getresponse()
+        except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The server closed the idle connection, open a new one
+            connection.close()
+            connection.request("GET", path, headers=headers)
+            return connection.getresponse()
+
+    def _fetch(self, url, cancelled):
+        """Download one file, returns its content
+
+        The download is interrupted when cancelled is set.
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = {}
+        with self._lock:
+            cached = self._cache.get(url)
+        if cached is not None:
+            if cached[0] is not None:
+                headers["If-None-Match"] = cached[0]
+            if cached[1] is not None:
+                headers["If-Modified-Since"] = cached[1]
+
+        connection = self._get_connection(parts.scheme, parts.netloc)
+        try:
+            response = self._request(connection, path, headers)
+            if response.status == 304 and cached is not None:
+                response.read()
+                data = cached[2]
+            elif response.status != 200:
+                raise OSError("HTTP Error %d: %s" % (response.status, response.reason))
+            else:
+                data = self._read(response, url, cancelled)
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release_connection(parts.scheme, parts.netloc, connection)
+
+        etag = response.getheader("ETag")
+        last_modified = response.getheader("Last-Modified")
+        if response.status == 304:
+            # The validators may be omitted when the file did not change
+            etag = etag or cached[0]
+            last_modified = last_modified or cached[1]
+        self._store(url, etag, last_modified, data)
+        return data
+
+    def _read(self, response, url, cancelled):
+        """Read a response by chunks, without going over max_size bytes"""
+        # response.length is None if the response is chunked
+        if response.length is not None and response.length > self.max_size:
+            raise DeckardException(
+                "File too big",
+                'The "%s" file is %d long and this app '
+                "will not retrieve a file bigger than "
+                "%d bytes." % (url, response.length, self.max_size),
+            )
+        chunks = []
+        size = 0
+        while True:
+            if cancelled.is_set():
+                raise OSError("Download cancelled")
+            chunk = response.read(self.chunk_size)
+            if not chunk:
+                return b"".join(chunks)
+            size += len(chunk)
+            if size > self.max_size:
+                raise DeckardException(
+                    "File too big",
+                    'The "%s" file is longer than %d bytes and this app will not '
+                    "retrieve a bigger file." % (url, self.max_size),
+                )
+            chunks.append(chunk)
+
+    def _store(self, url, etag, last_modified, data):
+        """Keep a downloaded file in the cache, if it can be revalidated"""
+        with self._lock:
+            if url in self._cache:
+                self.cache_size -= len(self._cache.pop(url)[2])
+            if etag is None and last_modified is None:
+                return
+            self._cache[url] = (etag, last_modified, data)
+            self.cache_size += len(data)
+            while self.cache_size > self.max_cache_size:
+                self.cache_size -= len(self._cache.popitem(last=False)[1][2])
+
+
 class Session:
     """
     This represents a Deckard session for one user.
-    It manages its gladerunner instance (both launch and keep-alive) and custom
-    PO files.
+    It manages its gladerunner instance and custom PO files.
     Everything is cleaned-up when the session is deleted.
     """
 
     def __init__(
         self,
         uuid,
-        gladerunner,
+        runner_pool,
+        mo_cache,
         content_root,
         max_custom_po,
-        max_po_download_size,
-        glade_catalog,
-        po_urls,
+        po_downloader,
+        session_store,
+        on_runner_exit,
     ):
         self.port = 0
         self.uuid = uuid  # unique id to avoid session spoofing
         self.process = None
-        self.custom_po = OrderedDict()  # {po_name: (module, root_path, lang)}
-        self.removable = False  # can the manager delete this Session?
-        self.gladerunner = gladerunner
+        # {po_name: (module, root_path, lang, mo_cache_key)}
+        self.custom_po = OrderedDict()
+        # The session is deleted once this time.time() value is reached,
+        # unless the lease is renewed before (see SessionStore)
+        self.deadline = 0
+        # Held during the slow operations on this session (spawn, PO upload)
+        self.lock = Lock()
+        self.users = 0  # requests using this session, see SessionsManager
+        self.last_used = time.time()  # end of the last request
+        self.changed = Condition()  # notified after each request, see watch()
+        self.runner_pool = runner_pool
+        self.mo_cache = mo_cache
         self.content_root = content_root
         self.max_custom_po = max_custom_po
-        self.max_po_download_size = max_po_download_size
-        self.glade_catalog = glade_catalog
-        # URL sorted by priority
-        # If one URL does not work, the next one will be tried
-        self.po_urls = po_urls
-
-    def spawn_runner(self, module, module_file, language, port):
-        """Launch a gladerunner instance.
-
-        If a running process is attached to this session, it will be replaced.
+        self.po_downloader = po_downloader
+        self.session_store = session_store
+        # Called with (session, process) when a runner exited by itself
+        self.on_runner_exit = on_runner_exit
+        self.runner_error = None  # why the last runner stopped, if it crashed
+
+    def spawn_runner(self, module, module_file, language, port, profile=False):
+        """Display a file through the gladerunner instance of this session.
+
+        If a running process is attached to this session, it is asked to load
+        the file in place. Otherwise, a runner is taken from the pool.
+        If profile is True, the runner writes its timings for this file (see
+        RunnerProfiles).
+        Returns True if the running process was reused, False otherwise.
         """
+        if port != self.port:
+            self._stop_runner()
         self.port = port
-        env = {
-            "GDK_BACKEND": "broadway",
-            "UBUNTU_MENUPROXY": "",
-            "LIBOVERLAY_SCROLLBAR": "0",
+        self.runner_error = None
+
+        lang_root, language, _ = self.find_translation(module, language)
+        params = {
+            "glade_file_path": os.path.join(self.content_root, module, module_file),
+            "gettext_domain": module,
+            "language": language,
+            "lang_path": lang_root,
+            "profile": profile,
         }
+        if self._send_command("load", **params):
+            error = self._wait_reply()
+            if error is None:
+                return True
+            # The runner quits, it can't be reused
+            self._stop_runner()
+            self.runner_error = error
+            raise DeckardException("Could not display this file.", error)
+
+        # No usable runner, hand the file over to a pooled one
+        self._stop_runner()
+        session = weakref.ref(self)  # the supervisor must not keep us alive
+
+        def on_exit(process):
+            alive = session()
+            if alive is not None:
+                alive.on_runner_exit(alive, process)
+
+        self.process = self.runner_pool.acquire(on_exit)
+        if not self._send_command("load", with_broadwayd=port, **params):
+            raise DeckardException(
+                "Could not start the runner.",
+                "The runner process died right away.",
+            )
+        return False
 
-        if self.process is not None and self.process.poll() is None:
-            self.process.kill()
+    def find_translation(self, module, language):
+        """Returns where runners find the translation of module in language
 
+        language is either a locale or the name of a custom PO file.
+        Returns a tuple with the language root path, the locale to use and the
+        MoCache key of the custom PO file (None for the content translations).
+        """
         if language in self.custom_po:
             if self.custom_po[language][0] != module:
                 raise DeckardException(
                     '"%s" does not exist' % language,
                     "No such file was registered for the %s module." % module,
                 )
-            lang_root = os.path.join(self.custom_po[language][1], "LANGS")
+            _, lang_root, po_lang, key = self.custom_po[language]
             # This locale has to be available on your system
-            language = "%s.UTF-8" % self.custom_po[language][2]
-        else:
-            if language != "POSIX":
-                language = "%s.UTF-8" % language
-            lang_root = os.path.join(self.content_root, "LANGS")
-
-        env["LANG"] = language
-
-        # Build the gladerunner command line
-        args = [
-            self.gladerunner,
-            "--suicidal",
-            "--with-broadwayd",
-            str(port),
-            os.path.join(self.content_root, module, module_file),
-            module,
-            language,
-            lang_root,
-        ]
+            return os.path.join(lang_root, "LANGS"), "%s.UTF-8" % po_lang, key
+        if language != "POSIX":
+            language = "%s.UTF-8" % language
+        return os.path.join(self.content_root, "LANGS"), language, None
+
+    def _stop_runner(self):
+        """Kill the runner, if any"""
+        # Forget it first, so its exit is not taken as a crash
+        process, self.process = self.process, None
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def _send_command(self, action, **params):
+        """Send a command to the runner (see gladerunner.CommandChannel)
+
+        Returns True if the command was sent, False if it wasn't (eg. if there
+        is no process)."""
+        process = self.process
+        if process is None or process.poll() is not None:
+            return False
+        params["action"] = action
+        try:
+            process.stdin.write(json.dumps(params).encode() + b"\n")
+            process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            # The process was killed in the meantime
+            return False
+        return True
 
-        # Should we use a Glade catalog?
-        if os.path.isfile(self.glade_catalog):
-            args.extend(("--catalog-path", self.glade_catalog))
+    def _wait_reply(self):
+        """Wait for the runner to handle the last load command
 
-        # Launch it!
-        self.process = Popen(args, stdin=PIPE, env=env)
+        Returns None if it succeeded, the error otherwise.
+        """
+        replies = self.process.replies
+        ready, _, _ = select.select([replies], [], [], RELOAD_TIMEOUT)
+        if not ready:
+            return "The file took more than %d seconds to load." % RELOAD_TIMEOUT
+        line = replies.readline()
+        if not line:
+            return "The runner died while loading the file."
+        return json.loads(line)["error"]
 
     def store_po(self, name, module, fd=None):
         """Store a custom PO file
 
-        If fd is None, try to download name from self.po_urls.
-        Each url of the list will be tried until the file is found.
+        If fd is None, download name from the PO mirrors (see PoDownloader).
         If a PO file with the same name is already attached to this session,
         it will be replaced.
         Returns a dictionary, associating all relevant modules with a list of
@@ -134,148 +1332,99 @@ class Session:
             raise DeckardException(
                 "This is not a PO file", "%s is not a PO file." % name
             )
-        lang_root = tempfile.mkdtemp(prefix="deckard_")
-        po_path = os.path.join(lang_root, "file.po")
-        po = open(po_path, "bw")
-        if fd is not None:
-            # The file was sent by the user
-            for line in fd:
-                po.write(line)
-            po.close()
-            fd.close()
-        elif len(self.po_urls) > 0:
+        if fd is None:
             # Let's try to download 'name'
-            response = None
-            error = None
-            for url in self.po_urls:
-                try:
-                    response = urllib.request.urlopen(url % name)
-                    break
-                except Exception as e:
-                    error = str(e)
-
-            if response is None:
-                # Most likely a '404: not found' error
-                raise DeckardException("Enable to retrieve the file", error)
+            fd = io.BytesIO(self.po_downloader.download(name))
 
-            res_len = response.length
-            if res_len > self.max_po_download_size:
-                response.close()
-                raise DeckardException(
-                    "File too big",
-                    'The "%s" file is %d long and this app '
-                    "will not retrieve a file bigger than "
-                    "%d bytes." % (name, res_len, self.max_po_download_size),
-                )
+        self._add_po(name, module, fd, self.session_store.shared)
+        self.session_store.update(self.uuid, custom_po=self._po_records())
 
-            # Let's finally download this file!
-            po.write(response.read(res_len))
-            response.close()
-            po.close()
-        else:
-            raise DeckardException(
-                "Operation not supported",
-                "The PO download feature is not configured on this instance.",
-            )
+        res = {}
+        for item in self.custom_po:
+            if self.custom_po[item][0] not in res:
+                res[self.custom_po[item][0]] = [item]
+            else:
+                res[self.custom_po[item][0]].append(item)
+        return res
 
-        # Try to guess the language of this PO file, default is 'en_US'
-        # This is good to know to later set proper environment variables and so
-        # load the right GTK translation and reverse the interface if necessary
-        po_lang = "en_US"
-        with open(po_path, encoding="utf8") as po:
-            # Give up if we find nothing in the 50 first lines
-            for _ in range(50):
-                line = po.readline()
-                match = re.match(r'^"Language: (.+)\\n"$', line)
-                if match:
-                    po_lang = match.group(1)
-                    # The encoding is often wrong, so strip it
-                    po_lang = locale.normalize(po_lang).rsplit(".")[0]
-                    # Test if the detected locale is available on the system
-                    try:
-                        locale.setlocale(locale.LC_ALL, "%s.UTF-8" % po_lang)
-                    except:
-                        # Fallback to a known locale
-                        po_lang = "en_US"
-                    finally:
-                        # Go back to the default locale
-                        locale.setlocale(locale.LC_ALL, "")
-                    break
+    def _add_po(self, name, module, fd, share):
+        """Compile a PO file and attach it as the newest one
 
-        # create necessary directories
-        mo_path = os.path.join(lang_root, "LANGS", po_lang, "LC_MESSAGES")
-        os.makedirs(mo_path)
+        If share is True, the file is also put in the session store.
+        """
+        po_fd, po_path = tempfile.mkstemp(prefix="deckard_", suffix=".po")
+        digest = hashlib.sha256()
+        with os.fdopen(po_fd, "bw") as po:
+            for line in fd:
+                po.write(line)
+                digest.update(line)
+        fd.close()
 
         try:
-            check_output(
-                [
-                    "/usr/bin/msgfmt",
-                    "--check",
-                    "--output-file",
-                    os.path.join(mo_path, module) + ".mo",
-                    po_path,
-                ],
-                stderr=STDOUT,
-            )
-        except CalledProcessError as e:
-            shutil.rmtree(lang_root)
-            # We don't need to expose the file name in the error message
-            log = e.output.decode("unicode_escape").replace("%s:" % po_path, "")
-            raise DeckardException("Error while building the .mo", log)
+            key, lang_root, po_lang = self.mo_cache.acquire(
+                po_path, module, digest.hexdigest()
+            )
+            if share:
+                with open(po_path, "rb") as po:
+                    self.session_store.put_po(digest.hexdigest(), po.read())
+        finally:
+            os.remove(po_path)
 
         if name in self.custom_po:
-            shutil.rmtree(self.custom_po[name][1])
+            self.mo_cache.release(self.custom_po[name][3])
             del self.custom_po[name]  # drop to re-add at the end of the queue
         elif len(self.custom_po) >= self.max_custom_po:
-            # delete the oldest
-            shutil.rmtree(self.custom_po.popitem(last=False)[1][1])
-
-        self.custom_po[name] = (module, lang_root, po_lang)
-
-        res = {}
-        for item in self.custom_po:
-            if self.custom_po[item][0] not in res:
-                res[self.custom_po[item][0]] = [item]
-            else:
-                res[self.custom_po[item][0]].append(item)
-        return res
+            # forget the oldest
+            self.mo_cache.release(self.custom_po.popitem(last=False)[1][3])
 
-    def keep_process_alive(self):
-        """Beg the runner (if any) to stay alive
+        self.custom_po[name] = (module, lang_root, po_lang, key)
 
-        Returns True if the message was sent, False if it wasn't (eg. if there
-        is no process)."""
-        if self.process is not None and self.process.poll() is None:
-            self.process.stdin.write(b"Please stay alive!")
-            self.process.stdin.flush()
-            return True
-        return False
+    def _po_records(self):
+        """Returns the custom PO files, as kept by the session store"""
+        return [
+            [name, module, key.rsplit(":", 1)[1]]
+            for name, (module, _, _, key) in self.custom_po.items()
+        ]
 
-    def is_removable(self):
-        """State if this Session is removable.
+    def sync_po(self, records):
+        """Attach the custom PO files of the session store
 
-        Returns True if no running process is attached to this Session and
-        if no PO file is stored.
-        It also returns True if this Session was tagged as removable.
-        Otherwise, this function will return False.
+        They differ when PO files were stored by another Deckard process.
         """
-        if self.removable:
-            return True
-        elif self.process is None or self.process.poll() is not None:
-            if len(self.custom_po) == 0:
-                return True
-        return False
+        if records == self._po_records():
+            return
+        names = set(record[0] for record in records)
+        for name in list(self.custom_po):
+            if name not in names:
+                self.mo_cache.release(self.custom_po.pop(name)[3])
+        for name, module, digest in records:
+            if name in self.custom_po and self.custom_po[name][3] == "%s:%s" % (
+                module,
+                digest,
+            ):
+                self.custom_po.move_to_end(name)
+                continue
+            data = self.session_store.get_po(digest)
+            if data is not None:
+                self._add_po(name, module, io.BytesIO(data), False)
+
+    def renew_lease(self, duration):
+        """Keep this session for at least duration more seconds"""
+        self.deadline = max(self.deadline, time.time() + duration)
 
     def __del__(self):
-        """Kill the process if it is running and delete any custom PO files"""
-        if self.process is not None and self.process.poll() is None:
-            self.process.kill()
+        """Kill the process if it is running and release any custom PO files"""
+        self._stop_runner()
         for name in self.custom_po:
-            shutil.rmtree(self.custom_po[name][1])
+            self.mo_cache.release(self.custom_po[name][3])
 
 
 class SessionsManager:
-    """Helper to manage all Deckard sessions."""
+    """
+    Helper to manage all Deckard sessions.
+    Sessions are registered in session_store: Deckard processes sharing it
+    serve the same sessions. Each one runs the runners it spawns.
+    """
 
     def __init__(
         self,
@@ -285,8 +1434,26 @@ class SessionsManager:
         first_port=2019,
         max_custom_po_per_session=4,
         max_po_download_size=1500000,
-        glade_catalog="",
+        glade_catalogs=[],
         po_urls=[],
+        runner_pool_size=2,
+        max_mo_cache_size=50000000,
+        session_ttl=10,
+        session_grace=10,
+        session_store=None,
+        runners_memory_budget=0,
+        runners_cpu_budget=0,
+        runner_max_memory=0,
+        runner_max_cpu=0,
+        runner_cgroup="",
+        max_queue=20,
+        preempt_idle_time=0,
+        runner_profile_rate=0,
+        runner_window_picker=0,
+        snapshot_cache_size=0,
+        max_snapshot_renders=2,
+        max_event_streams=16,
+        max_event_streams_per_session=2,
     ):
         self.gladerunner = gladerunner
         self.content_root = content_root
@@ -294,11 +1461,106 @@ class SessionsManager:
         self.first_port = first_port
         self.max_custom_po_per_session = max_custom_po_per_session
         self.max_po_download_size = max_po_download_size
-        self.glade_catalog = glade_catalog
+        self.glade_catalogs = glade_catalogs
         self.po_urls = po_urls
-        self.sessions = {}  # Sessions, by UUID
-        self._lock = Lock()  # allows to only manipulate one session at a time
-        self._cleanup_loop_running = False
+        self.po_downloader = PoDownloader(po_urls, max_po_download_size)
+        self.supervisor = ProcessSupervisor()
+        self.resources = RunnerResources(
+            runners_memory_budget,
+            runners_cpu_budget,
+            runner_max_memory,
+            runner_max_cpu,
+            runner_cgroup,
+        )
+        # Share of the spawns which are profiled
+        self.runner_profile_rate = runner_profile_rate
+        self.profiles = RunnerProfiles() if runner_profile_rate > 0 else None
+        self.runner_pool = RunnerPool(
+            gladerunner,
+            glade_catalogs,
+            os.path.join(content_root, GLADE_CACHE),
+            self.supervisor,
+            self.resources,
+            runner_pool_size,
+            self.profiles.fd if self.profiles is not None else None,
+            runner_window_picker,
+        )
+        self.mo_cache = MoCache(max_mo_cache_size)
+        # Files rendered as images, see snapshot
+        self.snapshots = None
+        if snapshot_cache_size > 0:
+            self.snapshots = SnapshotCache(
+                os.path.join(content_root, SNAPSHOT_CACHE), snapshot_cache_size
+            )
+        self._snapshot_renders = BoundedSemaphore(max(max_snapshot_renders, 1))
+        self._digests = {}  # {path: (mtime, size, digest)}, see _digest
+        if session_store is None:
+            session_store = MemorySessionStore()
+        self.session_store = session_store
+        # Ports are reserved per host, runners are owned per process
+        self.host = socket.gethostname()
+        self.owner = "%s:%d:%s" % (self.host, os.getpid(), uuid4().hex[:8])
+        self.sessions = {}  # Sessions used by this process, by UUID
+        # Only held to look up, create or delete sessions, never during I/O.
+        # Each session has its own lock for the rest.
+        self._lock = TimedLock(metrics.lock_wait, metrics.lock_hold)
+        # Sessions are deleted session_ttl seconds after their last request.
+        # New ones are given session_grace more seconds, to start their runner.
+        self.session_ttl = session_ttl
+        self.session_grace = session_grace
+        # Users wait there when there is no room, see _admit
+        self.queue = AdmissionQueue(max_queue, session_ttl)
+        # Runners of sessions without requests for this many seconds can be
+        # stopped to make room, 0 to never do it
+        self.preempt_idle_time = preempt_idle_time
+        # Each event stream holds a request, see watch
+        self.max_event_streams = max_event_streams
+        self.max_event_streams_per_session = max_event_streams_per_session
+        self._event_streams = {}  # number of open event streams, by UUID
+        self._event_streams_total = 0
+        # Heap of (deadline, uuid), see _reaper_loop
+        self._deadlines = []
+        self._reaper_wakeup = Condition(self._lock)
+        Thread(target=self._reaper_loop, daemon=True).start()
+        self._content = None  # (content folder version, content structure)
+
+        metrics.gauge("deckard_sessions", "Sessions.", self.users_count)
+        metrics.gauge(
+            "deckard_runners",
+            "Runners displaying a file for a session.",
+            lambda: self._count_local(lambda session: session.process is not None),
+        )
+        metrics.gauge(
+            "deckard_free_ports",
+            "Ports not used by the runners of this process.",
+            lambda: self.max_users
+            - self._count_local(lambda session: session.port != 0),
+        )
+        metrics.gauge(
+            "deckard_runners_memory_bytes",
+            "Memory used by all runners, including the pooled ones.",
+            lambda: self.resources.usage()[0],
+        )
+        metrics.gauge(
+            "deckard_runners_cpus",
+            "CPUs used by all runners, including the pooled ones.",
+            lambda: self.resources.usage()[1],
+        )
+        metrics.gauge(
+            "deckard_queue_length",
+            "Users waiting for room.",
+            lambda: self.queue.ahead(None),
+        )
+        metrics.gauge(
+            "deckard_event_streams",
+            "Session event streams open on this process.",
+            lambda: self._event_streams_total,
+        )
+
+    def _count_local(self, predicate):
+        """Returns the number of sessions of this process matching predicate"""
+        with self._lock:
+            return len([s for s in self.sessions.values() if predicate(s)])
 
     def _get_session(self, uuid):
         """Returns the Session object from an UUID.
@@ -309,100 +1571,438 @@ class SessionsManager:
         else:
             return None
 
-    def _create_session(self):
-        """Create a new session an returns its uuid
+    def _create_session(self, ticket, leave=True):
+        """Register a new session an returns its uuid
 
         Raise an exception if we don't have room for one more session.
+        leave is given to _admit.
         """
-        if len(self.sessions) >= self.max_users:
-            raise DeckardException(
-                "Too many users!",
-                "For performance purposes, this "
-                "application is currently limited to %d "
-                "simultaneous sessions.\n"
-                "You may want to retry in a few minutes." % self.max_users,
-            )
         uuid = str(uuid4())
-        self.sessions[uuid] = Session(
-            uuid,
-            self.gladerunner,
-            self.content_root,
-            self.max_custom_po_per_session,
-            self.max_po_download_size,
-            self.glade_catalog,
-            self.po_urls,
-        )
-        if not self._cleanup_loop_running:
-            self._cleanup_loop(init=True)  # Restart the cleanup loop
-            self._cleanup_loop_running = True
+        deadline = time.time() + self.session_ttl + self.session_grace
+
+        def create():
+            if self.session_store.create(uuid, self.owner, deadline, self.max_users):
+                return
+            # Maybe some sessions were left behind by a dead process
+            self.session_store.expire(time.time())
+            if not self.session_store.create(
+                uuid, self.owner, deadline, self.max_users
+            ):
+                raise BusyException(
+                    "Too many users!",
+                    "For performance purposes, this "
+                    "application is currently limited to %d "
+                    "simultaneous sessions.\n"
+                    "You may want to retry in a few minutes." % self.max_users,
+                )
+
+        self._admit(ticket, create, leave=leave)
         return uuid
 
-    def _find_free_port(self):
-        """Returns a free port ready to be used by a session.
+    def _admit(self, ticket, take_room, admitted=False, leave=True):
+        """Call take_room() in turn with the users waiting for room
 
-        Checked ports are between first_port and (first_port + max_users - 1).
+        take_room raises a BusyException if there is no room. Then, an idle
+        runner may be stopped to make some (see _preempt). Otherwise, the
+        caller has to wait in the queue: a QueuedException is raised with its
+        ticket, to be given back by its next attempt.
+        admitted tells that the caller already got its turn for this request.
+        Unless leave is False, the caller stops waiting once admitted. Else it
+        keeps its place, for the next step of its request.
         """
-        for port in range(self.first_port, self.first_port + self.max_users):
-            try_next = False
-            for uuid in self.sessions:
-                if self.sessions[uuid].port == port:
-                    try_next = True
-                    break
-            if not try_next:
-                return port
-
-        # No free port!
-        # This should never if you managed to create a session
-        raise DeckardException(
-            "Could not find a free port.",
-            "This should never happen.\nPlease report this bug.",
-        )
+        if admitted or self.queue.ahead(ticket) == 0:
+            for attempt in range(2):
+                try:
+                    take_room()
+                except BusyException:
+                    if attempt > 0 or not self._preempt():
+                        break
+                else:
+                    if ticket is not None and leave:
+                        self.queue.leave(ticket)
+                    return
+        if ticket is None:
+            ticket = str(uuid4())
+        position = self.queue.join(ticket)
+        raise QueuedException(ticket, position, self.queue.eta(position))
+
+    def _preempt(self):
+        """Stop the runner of the least recently used session, if it is idle
+
+        Sessions keep their PO files, so a new runner can be spawned later on.
+        Returns True if a runner was stopped.
+        """
+        if self.preempt_idle_time <= 0:
+            return False
+        limit = time.time() - self.preempt_idle_time
+        with self._lock:
+            idle = [
+                session
+                for session in self.sessions.values()
+                if session.users == 0
+                and session.process is not None
+                and session.last_used < limit
+            ]
+        for session in sorted(idle, key=lambda session: session.last_used):
+            if not session.lock.acquire(blocking=False):
+                continue  # used right now
+            try:
+                if session.process is None:
+                    continue
+                session._stop_runner()
+                self._release_port(session)
+                session.runner_error = (
+                    "The display was stopped, as it was not used for a while "
+                    "and other users were waiting."
+                )
+            finally:
+                session.lock.release()
+            self.session_store.update(
+                session.uuid, runner=False, runner_error=session.runner_error
+            )
+            with session.changed:
+                session.changed.notify_all()
+            self.queue.room_made()
+            return True
+        return False
 
-    def spawn_runner(self, uuid, module, module_file, language):
-        """Ask a session to launch a gladerunner instance.
+    def _hold_session(self, uuid):
+        """Returns the local Session object of uuid, counting one more user
 
-        If a running process is attached to this session, it will be replaced.
-        Returns a tuple with the session uuid and the port of the launched
-        instance.
+        It is created if this process did not use this session yet.
         """
         with self._lock:
-            # get or create the session
             session = self._get_session(uuid)
             if session is None:
-                uuid = self._create_session()
-                session = self._get_session(uuid)
-            else:
-                session._removable = False
+                session = Session(
+                    uuid,
+                    self.runner_pool,
+                    self.mo_cache,
+                    self.content_root,
+                    self.max_custom_po_per_session,
+                    self.po_downloader,
+                    self.session_store,
+                    self._on_runner_exit,
+                )
+                self.sessions[uuid] = session
+                session.renew_lease(self.session_ttl + self.session_grace)
+                heapq.heappush(self._deadlines, (session.deadline, uuid))
+                if self._deadlines[0][1] == uuid:
+                    self._reaper_wakeup.notify()
+            session.users += 1
+        return session
 
-            if session.port == 0:
-                port = self._find_free_port()
-            else:
-                port = session.port  # Reuse the same port
+    def _claim_port(self, session):
+        """Reserve a port of this host for the runner of session, if needed
 
-            session.spawn_runner(module, module_file, language, port)
+        Checked ports are between first_port and (first_port + max_users - 1).
+        """
+        if session.port != 0:
+            return
+        port = self.session_store.claim_port(
+            session.uuid, self.host, self.first_port, self.max_users
+        )
+        if port is None:
+            raise BusyException(
+                "Could not find a free port.",
+                "All the ports of this host are used by other sessions.\n"
+                "You may want to retry in a few minutes.",
+            )
+        session.port = port
+
+    def _release_port(self, session):
+        """Give back the port of session, its runner must be stopped"""
+        if session.port != 0:
+            self.session_store.release_port(session.uuid, self.host, session.port)
+            session.port = 0
+
+    @contextmanager
+    def _use_session(self, uuid, ticket=None, leave=True):
+        """Get or create a session and lock it for the caller.
+
+        The registry lock is only held to find the session. Until the caller
+        is done, the session can't be deleted by the reaper.
+        ticket is the place of the caller in the queue, if it had to wait.
+        leave is given to _admit, when a session is created.
+        """
+        record = None
+        if uuid is not None:
+            record = self.session_store.get(uuid)
+        if record is None:
+            uuid = self._create_session(ticket, leave)
+        session = self._hold_session(uuid)
+        try:
+            with session.lock:
+                if record is not None:
+                    session.sync_po(record["custom_po"])
+                yield session
+        finally:
+            with self._lock:
+                session.users -= 1
+                session.last_used = time.time()
+                session.renew_lease(self.session_ttl)
+            self.session_store.renew(uuid, session.deadline)
+            with session.changed:
+                session.changed.notify_all()
+
+    def spawn_runner(self, uuid, module, module_file, language, ticket=None):
+        """Ask a session to launch a gladerunner instance.
 
-            return uuid, port
+        If a running process is attached to this session, it will load the
+        file in place.
+        If there is no room for the session or its runner, a QueuedException
+        is raised: the caller has to try again later, with its ticket.
+        Returns a tuple with the session uuid, the port of the instance and
+        whether the running process was reused.
+        """
+        # Users keep their place in the queue until their runner is admitted
+        with metrics.spawn.time(), self._use_session(
+            uuid, ticket, leave=False
+        ) as session:
+            if session.process is None or session.process.poll() is not None:
+                # A new runner is needed
+                def take_room():
+                    self.resources.admit()
+                    self._claim_port(session)
+
+                # A session created by this call already got its turn
+                admitted = session.uuid != uuid
+                try:
+                    self._admit(ticket or session.uuid, take_room, admitted)
+                except QueuedException:
+                    if admitted:
+                        # The user is not told about it, the next attempt
+                        # would create another one
+                        self.session_store.delete(session.uuid)
+                    raise
+            port = session.port
+            profile = random.random() < self.runner_profile_rate
+            try:
+                reused = session.spawn_runner(
+                    module, module_file, language, port, profile
+                )
+            except DeckardException:
+                if session.process is None:
+                    # The runner was stopped
+                    self._release_port(session)
+                    self.session_store.update(
+                        session.uuid, runner=False, runner_error=session.runner_error
+                    )
+                    self.queue.room_made()
+                raise
+            # Runners of other processes stop once they see they lost it
+            self.session_store.update(
+                session.uuid, owner=self.owner, runner=True, runner_error=None
+            )
+            return session.uuid, port, reused
 
-    def store_po(self, uuid, name, module, fd=None):
+    def store_po(self, uuid, name, module, fd=None, ticket=None):
         """Ask a session to store a PO file.
 
-        If fd is None, try to download name from session.po_urls.
+        If fd is None, try to download name from the PO mirrors.
         If a PO file with the same name is already attached to this session,
         it will be replaced.
+        If there is no room for a new session, a QueuedException is raised:
+        the caller has to try again later, with its ticket.
         Returns a tuple with the session uuid and a dictionary, associating all
         relevant modules with a list of stored PO files for it on this session,
         from the oldest to the newest.
         """
+        with self._use_session(uuid, ticket) as session:
+            return session.uuid, session.store_po(name, module, fd)
+
+    def snapshot(self, uuid, module, module_file, language):
+        """Returns the windows of a file, rendered as images
+
+        The file is rendered by a gladerunner instance, unless it is in the
+        snapshot cache. No session is needed, except to use one of its custom
+        PO files: then, language is the name of this file.
+        Returns a tuple with the cache key and the list of windows, like
+        {"name": ..., "title": ..., "image": ..., "width": ..., "height": ...}.
+        Images are found with self.snapshots.image_path(key, image).
+        """
+        if self.snapshots is None:
+            raise DeckardException(
+                "Snapshots are disabled.",
+                "This instance does not render files as images.",
+            )
+        content_root = os.path.realpath(self.content_root)
+        glade_file_path = os.path.realpath(
+            os.path.join(content_root, module, module_file)
+        )
+        if not glade_file_path.startswith(content_root + os.sep) or not os.path.isfile(
+            glade_file_path
+        ):
+            raise DeckardException(
+                '"%s" does not exist' % module_file,
+                "No such file in the %s module." % module,
+            )
+
+        if uuid is not None and self.session_store.get(uuid) is not None:
+            # The custom PO file can't be forgotten while it is rendered
+            with self._use_session(uuid) as session:
+                if language not in session.custom_po:
+                    self._check_language(language)
+                translation = session.find_translation(module, language)
+                return self._snapshot(glade_file_path, module, language, translation)
+        self._check_language(language)
+        locale_name = language if language == "POSIX" else "%s.UTF-8" % language
+        translation = (os.path.join(self.content_root, "LANGS"), locale_name, None)
+        return self._snapshot(glade_file_path, module, language, translation)
+
+    def _check_language(self, language):
+        """Raise an exception if language is not a locale of the content"""
+        if language == "POSIX":
+            return
+        if language not in locale_language_mapping or not os.path.isdir(
+            os.path.join(self.content_root, "LANGS", language)
+        ):
+            raise DeckardException(
+                '"%s" does not exist' % language,
+                "No such language is available.",
+            )
+
+    def _snapshot(self, glade_file_path, module, language, translation):
+        """Returns the key and the windows of a file, rendering it if needed
+
+        The key is made of everything the images depend on: the Glade file,
+        the translation and the Glade catalogs.
+        """
+        lang_root, locale_name, po_key = translation
+        if po_key is None:
+            # Content translations change with each content update
+            po_key = self._digest(
+                os.path.join(lang_root, language, "LC_MESSAGES", module + ".mo")
+            )
+        key = hashlib.sha256(
+            json.dumps(
+                [
+                    SNAPSHOT_VERSION,
+                    module,
+                    self._digest(glade_file_path),
+                    locale_name,
+                    po_key,
+                    [self._digest(path) for path in self.runner_pool.catalogs],
+                ]
+            ).encode()
+        ).hexdigest()
+
+        windows = self.snapshots.get(key)
+        if windows is None:
+            with metrics.snapshot.time():
+                self._render(key, glade_file_path, module, lang_root, locale_name)
+            windows = self.snapshots.get(key)
+            if windows is None:
+                raise DeckardException(
+                    "Could not render this file.",
+                    "The images were removed from the cache right away.",
+                )
+        return key, windows
+
+    def _digest(self, path):
+        """Returns the SHA-256 digest of a file, "" if it does not exist
+
+        Digests are kept for as long as the file mtime and size don't change.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return ""
+        cached = self._digests.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        self._digests[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        return digest.hexdigest()
+
+    def _render(self, key, glade_file_path, module, lang_root, locale_name):
+        """Render a file in the snapshot cache, with a short-lived runner
+
+        The runner needs its own broadwayd, so it takes a port and some room
+        like the runner of a session, for as long as it renders.
+        """
+        with self._snapshot_renders:
+            self.resources.admit()
+            owner = "snapshot-%s" % uuid4()
+            port = self.session_store.claim_port(
+                owner, self.host, self.first_port, self.max_users
+            )
+            if port is None:
+                raise BusyException(
+                    "Could not find a free port.",
+                    "All the ports of this host are used by other sessions.\n"
+                    "You may want to retry in a few minutes.",
+                )
+            render_dir = self.snapshots.make_dir()
+            try:
+                args = [self.gladerunner, "--snapshot", render_dir]
+                args.extend(("--with-broadwayd", str(port)))
+                args.extend(("--cache-dir", self.runner_pool.cache_dir))
+                args.extend(self.runner_pool.catalog_args())
+                args.extend((glade_file_path, module, locale_name, lang_root))
+                process = Popen(
+                    args, stdin=DEVNULL, stdout=DEVNULL, stderr=PIPE, env=RUNNER_ENV
+                )
+                self.resources.attach(process)
+                try:
+                    _, errors = process.communicate(timeout=SNAPSHOT_TIMEOUT)
+                except TimeoutExpired:
+                    process.kill()
+                    process.communicate()
+                    raise DeckardException(
+                        "Could not render this file.",
+                        "It took more than %d seconds." % SNAPSHOT_TIMEOUT,
+                    )
+                finally:
+                    self.resources.detach(process)
+                if process.returncode != 0:
+                    raise DeckardException(
+                        "Could not render this file.",
+                        errors.decode(errors="replace").strip()[-2000:],
+                    )
+                self.snapshots.add(key, render_dir)
+            finally:
+                shutil.rmtree(render_dir, ignore_errors=True)
+                self.session_store.release_port(owner, self.host, port)
+
+    def _on_runner_exit(self, session, process):
+        """Called by the supervisor when the runner of a session exited
+
+        Its port is freed right away, and the reason of a crash is kept to be
+        reported to the user.
+        """
         with self._lock:
-            # get or create the session
-            session = self._get_session(uuid)
-            if session is None:
-                uuid = self._create_session()
-                session = self._get_session(uuid)
-            else:
-                session.removable = False
-                session.keep_process_alive()  # if any
-            return uuid, session.store_po(name, module, fd)
+            if session.process is not process:
+                # Killed on purpose
+                return
+            session.process = None
+            if process.returncode < 0:
+                session.runner_error = "The runner crashed (killed by %s)." % (
+                    signal.Signals(-process.returncode).name
+                )
+            elif process.returncode > 0:
+                session.runner_error = "The runner failed (exit status %d)." % (
+                    process.returncode
+                )
+        # A request using the session keeps the port for its next runner
+        if session.lock.acquire(blocking=False):
+            try:
+                self._release_port(session)
+            finally:
+                session.lock.release()
+        self.session_store.update(
+            session.uuid, runner=False, runner_error=session.runner_error
+        )
+        self.queue.room_made()
+        with session.changed:
+            session.changed.notify_all()
+
+    def users_count(self):
+        """Returns the number of sessions, for all Deckard processes"""
+        return self.session_store.count()
 
     def keep_alive(self, uuid):
         """Keep the uuid session alive a bit more.
@@ -410,79 +2010,915 @@ class SessionsManager:
         Returns False in case of problem (the session is already dead?),
         True otherwise.
         """
-        with self._lock:
-            session = self._get_session(uuid)
-            if session is not None:
-                session.removable = False
-                session.keep_process_alive()  # if any
-                return True
-            return False
+        return self.session_store.renew(uuid, time.time() + self.session_ttl)
 
-    def _cleanup_loop(self, timer=5, init=False):
-        """Delete garbage sessions regularly.
+    def session_state(self, uuid):
+        """Returns the state of the uuid session, as sent to its page
 
-        If init is True, do not acquire lock in this iteration."""
-        if not init:
-            self._lock.acquire()
+        That is the number of users and whether the runner is running.
+        Returns None if the session does not exist.
+        """
+        record = self.session_store.get(uuid)
+        if record is None:
+            return None
+        return {
+            "status": "ok",
+            "users_count": str(self.users_count()),
+            "runner": record["runner"],
+            "runner_error": record["runner_error"],
+        }
+
+    def _open_event_stream(self, uuid):
+        """Count one more event stream for the uuid session
+
+        Returns False if there are already max_event_streams in this process
+        or max_event_streams_per_session for this session (0: no limit).
+        """
+        with self._lock:
+            if 0 < self.max_event_streams <= self._event_streams_total:
+                return False
+            streams = self._event_streams.get(uuid, 0)
+            if 0 < self.max_event_streams_per_session <= streams:
+                return False
+            self._event_streams[uuid] = streams + 1
+            self._event_streams_total += 1
+            return True
+
+    def _close_event_stream(self, uuid):
+        """Forget an event stream counted by _open_event_stream"""
+        with self._lock:
+            self._event_streams_total -= 1
+            self._event_streams[uuid] -= 1
+            if self._event_streams[uuid] == 0:
+                del self._event_streams[uuid]
+
+    def watch(self, uuid, interval=2):
+        """Follow the uuid session, for as long as the caller iterates.
+
+        The session is kept alive in the meantime, so the caller doesn't have
+        to send keep-alives.
+        A dictionary is yielded when the state of the session changes (see
+        session_state). Otherwise, None is yielded every interval seconds,
+        which lets the caller notice that its client is gone.
+        Once the session is deleted, an error is yielded and the iteration
+        stops.
+        As each stream holds a request, their number is limited (see
+        _open_event_stream). Above the limits, {"status": "poll"} is yielded
+        and the iteration stops: the client has to call keep_alive itself.
+        """
+        if uuid is None:
+            yield {"status": "error", "message": "disconnected"}
+            return
+        if not self._open_event_stream(uuid):
+            yield {"status": "poll"}
+            return
         try:
-            for uuid in list(self.sessions.keys()):
-                if not init and self.sessions[uuid].is_removable():
+            last_state = None
+            while self.keep_alive(uuid):
+                state = self.session_state(uuid)
+                if state is None:
+                    break
+                yield state if state != last_state else None
+                last_state = state
+                with self._lock:
+                    session = self._get_session(uuid)
+                if session is None:
+                    # Served by another process, which can't notify us
+                    time.sleep(interval)
+                else:
+                    with session.changed:
+                        session.changed.wait(interval)
+            yield {"status": "error", "message": "disconnected"}
+        finally:
+            self._close_event_stream(uuid)
+
+    def _reaper_loop(self):
+        """Delete the sessions whose lease expired, forever.
+
+        The heap is not updated when a lease is renewed: an outdated entry is
+        pushed again with the new deadline when it pops up.
+        The session store is checked before deleting a session, since other
+        processes may have renewed it. The local copy of a session is also
+        dropped once it is deleted from the store.
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                if len(self._deadlines) == 0:
+                    self._reaper_wakeup.wait()
+                    continue
+                elif self._deadlines[0][0] > now:
+                    self._reaper_wakeup.wait(self._deadlines[0][0] - now)
+                    continue
+                _, uuid = heapq.heappop(self._deadlines)
+                session = self.sessions[uuid]
+                busy = session.users > 0
+
+            try:
+                if busy:
+                    # A request is using this session right now
+                    self.session_store.renew(uuid, now + self.session_ttl)
+                record = self.session_store.get(uuid)
+                if record is not None and record["deadline"] <= now:
+                    self.session_store.delete(uuid)
+                    record = None
+            except Exception:
+                # The store is unreachable, try again later
+                traceback.print_exc()
+                record = {"deadline": now + self.session_ttl, "owner": self.owner}
+
+            if record is not None and record["owner"] != self.owner:
+                # Another process runs it now
+                if session.lock.acquire(blocking=False):
+                    try:
+                        session._stop_runner()
+                        self._release_port(session)
+                    finally:
+                        session.lock.release()
+
+            with self._lock:
+                if record is None:
                     del self.sessions[uuid]
+                    self.queue.room_made()
                 else:
-                    # This session may be deleted next time (if no keep_alive)
-                    self.sessions[uuid].removable = True
+                    session.deadline = record["deadline"]
+                    heapq.heappush(self._deadlines, (session.deadline, uuid))
+            # Deleted sessions stop their runner once they are not referenced
+            del session
 
-            if len(self.sessions) > 0:
-                Timer(timer, self._cleanup_loop, (timer,)).start()
-            else:
-                # Break the loop when there is no more sessions
-                self._cleanup_loop_running = False
-        finally:
-            if not init:
-                self._lock.release()
+    def _content_version(self):
+        """Identify the current state of the content folder.
+
+        build-gnome-content.py writes a new timestamp file and swaps the whole
+        folder, so both are looked at.
+        """
+        version = []
+        for path in (self.content_root, os.path.join(self.content_root, "timestamp")):
+            try:
+                stat = os.stat(path)
+                version.append((stat.st_ino, stat.st_mtime_ns))
+            except FileNotFoundError:
+                version.append(None)
+        return tuple(version)
 
     def get_displayable_content(self):
-        """Build the content structure by exploring self.content_root
+        """Returns the content structure of self.content_root
 
-        The returned structure is as below:
-        {'LANG': {'locale1_code': 'locale1_name_in_the_relative_locale',
-                  'locale2_code': 'locale2_name_in_the_relative_locale'},
-         'MODULES': {'module1': ['file1.ui', 'file2.glade'],
-                     'module2': ['file1.xml', 'path/in/module/file2.ui']}
-        }
+        The structure is only built again if the content folder changed.
+        It is read from the content index when there is one (see
+        write_content_index), otherwise the folder is explored.
         """
-        content = {"LANGS": {}, "MODULES": {}}
+        version = self._content_version()
+        if self._content is None or self._content[0] != version:
+            index_path = os.path.join(self.content_root, CONTENT_INDEX)
+            if os.path.isfile(index_path):
+                with open(index_path, encoding="utf8") as index:
+                    content = json.load(index)
+            else:
+                content = scan_content(self.content_root)
+            self._content = (version, content)
+        return self._content[1]
+
+
+class PoMessage:
+    """An entry of a PO file"""
+
+    def __init__(self, line, flags):
+        self.line = line  # where the entry starts, for error messages
+        self.flags = flags
+        self.msgctxt = None
+        self.msgid = None
+        self.msgid_plural = None
+        self.msgstr = []  # one translation per plural form
+
+    def is_header(self):
+        return self.msgctxt is None and self.msgid == b""
+
+
+class PoCompiler:
+    """
+    Compile a PO file into a MO file, like "msgfmt --check" does.
+    The PO file is read as a stream, and the errors are logged in the format of
+    msgfmt, without the file name.
+    """
+
+    keyword = re.compile(rb"^(msgctxt|msgid_plural|msgid|msgstr)(?:\[(\d+)\])?\s*(.*)$")
+    string = re.compile(rb'\s*"((?:[^"\\]|\\.)*)"')
+    escape = re.compile(rb"\\([0-7]{1,3}|x[0-9a-fA-F]+|.)", re.S)
+    escapes = {
+        b"n": b"\n",
+        b"t": b"\t",
+        b"b": b"\b",
+        b"r": b"\r",
+        b"f": b"\f",
+        b"v": b"\v",
+        b"a": b"\a",
+        b"\\": b"\\",
+        b'"': b'"',
+        b"'": b"'",
+        b"?": b"?",
+    }
+    # ISO C 99 <inttypes.h> directives need a MO file revision 1
+    system_dependent = re.compile(rb"%[-+ #0'I0-9.*$]*<PRI")
+    # Header fields checked by msgfmt, with their value in a PO template
+    header_fields = (
+        ("Project-Id-Version", "PACKAGE VERSION"),
+        ("PO-Revision-Date", "YEAR-MO-DA"),
+        ("Last-Translator", "FULL NAME"),
+        ("Language-Team", "LANGUAGE"),
+        ("MIME-Version", None),
+        ("Content-Type", "text/plain; charset=CHARSET"),
+        ("Content-Transfer-Encoding", "ENCODING"),
+        ("Language", None),
+    )
+
+    def __init__(self):
+        self.messages = []
+        self.log = []
+        self.errors = 0
+        self._seen = {}  # (msgctxt, msgid) -> first line
+
+    def error(self, line, message):
+        self.log.append("%d: %s" % (line, message))
+        self.errors += 1
+
+    def warning(self, line, message):
+        self.log.append("%d: warning: %s" % (line, message))
+
+    def is_system_dependent(self):
+        """Tell if msgfmt is needed to write the MO file"""
+        return any(
+            self.system_dependent.search(string)
+            for message in self.messages
+            if "c-format" in message.flags
+            for string in [message.msgid] + message.msgstr
+        )
 
-        for lang in os.listdir(os.path.join(self.content_root, "LANGS")):
-            if lang in locale_language_mapping:
-                content["LANGS"][lang] = locale_language_mapping[lang]
-        for item in os.listdir(self.content_root):
-            if (
-                not os.path.isdir(os.path.join(self.content_root, item))
-                or item == "LANGS"
+    def _unescape(self, line, data):
+        """Returns the content of the quoted PO strings of a line, joined"""
+        strings = []
+        position = 0
+        while position < len(data) or not strings:
+            match = self.string.match(data, position)
+            if match is None:
+                self.error(line, "syntax error")
+                return b""
+            strings.append(match.group(1))
+            position = match.end()
+
+        def replace(escape):
+            sequence = escape.group(1)
+            if sequence in self.escapes:
+                return self.escapes[sequence]
+            if sequence[:1] == b"x":
+                return bytes([int(sequence[1:], 16) & 0xFF])
+            if sequence[:1].isdigit():
+                return bytes([int(sequence, 8) & 0xFF])
+            self.error(line, "invalid control sequence")
+            return b""
+
+        # Each string is unescaped on its own, eg. "\1" "2" is not "\12"
+        return b"".join(self.escape.sub(replace, string) for string in strings)
+
+    def _add(self, message):
+        if message is None:
+            return
+        if not message.msgstr:
+            self.error(message.line, "missing 'msgstr' section")
+            return
+        # Don't emit untranslated entries, nor fuzzy ones except the header
+        if message.msgstr[0] == b"":
+            return
+        if "fuzzy" in message.flags and not message.is_header():
+            return
+        key = (message.msgctxt, message.msgid)
+        if key in self._seen:
+            self.error(message.line, "duplicate message definition...")
+            self.error(
+                self._seen[key], "...this is the location of the first definition"
+            )
+            return
+        self._seen[key] = message.line
+        self.messages.append(message)
+
+    def parse(self, po_file):
+        """Read the messages of a PO file opened in binary mode"""
+        flags = set()
+        message = None
+        field = None  # the field continuation lines append to
+
+        for number, line in enumerate(po_file, 1):
+            if number == 1 and line.startswith(b"\xef\xbb\xbf"):
+                # UTF-8 byte order mark
+                line = line[3:]
+            line = line.strip()
+            if not line or line.startswith(b"#~"):
+                # Obsolete entries are ignored
+                continue
+            if line.startswith(b"#"):
+                if line.startswith(b"#,"):
+                    flags.update(flag.strip().decode() for flag in line[2:].split(b","))
+                continue
+            if line.startswith(b'"'):
+                if field is None:
+                    self.error(number, "syntax error")
+                elif field == "msgstr":
+                    message.msgstr[-1] += self._unescape(number, line)
+                else:
+                    value = getattr(message, field) + self._unescape(number, line)
+                    setattr(message, field, value)
+                continue
+
+            match = self.keyword.match(line)
+            if match is None:
+                self.error(number, "syntax error")
+                field = None
+                continue
+            field, index, value = match.groups()
+            field = field.decode()
+            value = self._unescape(number, value)
+            if field == "msgctxt" or (
+                field == "msgid" and (message is None or message.msgid is not None)
             ):
+                self._add(message)
+                message = PoMessage(number, flags)
+                flags = set()
+
+            if field in ("msgctxt", "msgid"):
+                setattr(message, field, value)
+            elif message is None or message.msgid is None:
+                self.error(number, "syntax error")
+                field = None
+            elif field == "msgid_plural":
+                if message.msgstr or message.msgid_plural is not None:
+                    self.error(number, "syntax error")
+                    field = None
+                else:
+                    message.msgid_plural = value
+            elif (index is None) != (message.msgid_plural is None):
+                self.error(number, "syntax error")
+                field = None
+            elif index is None and message.msgstr:
+                self.error(number, "syntax error")
+                field = None
+            else:
+                if index is not None and int(index) != len(message.msgstr):
+                    self.error(number, "plural form has wrong index")
+                message.msgstr.append(value)
+        self._add(message)
+
+    def check(self):
+        """Run the checks of "msgfmt --check" on the parsed messages"""
+        header = None
+        fields = ""
+        nplurals = None
+        for message in self.messages:
+            if message.is_header():
+                header = message
+                break
+        if header is not None:
+            fields = header.msgstr[0].decode("utf8", "replace")
+            self._check_header(header, fields)
+            match = re.search(r"^Plural-Forms:(.*)$", fields, re.M)
+            if match is not None:
+                value = re.search(r"nplurals\s*=\s*([0-9]+)", match.group(1))
+                if value is None or int(value.group(1)) == 0:
+                    self.error(header.line, "invalid nplurals value")
+                else:
+                    nplurals = int(value.group(1))
+                if not re.search(r"plural\s*=\s*[^;\s]", match.group(1)):
+                    self.error(header.line, "invalid plural expression")
+
+        plural_error = False
+        for message in self.messages:
+            if message.is_header():
                 continue
-            content["MODULES"][item] = []
-
-        modules_to_ignore = set()
-        for module in content["MODULES"]:
-            mod_root = os.path.join(self.content_root, module)
-            ui_found = False
-            for root, _, files in os.walk(mod_root):
-                for file_ in files:
-                    _, ext = os.path.splitext(file_)
-                    ext = ext.lower()
-                    if ext == ".ui" or ext == ".xml" or ext == ".glade":
-                        ui_found = True
-                        rel_path = os.path.join(root, file_).split(mod_root)[1]
-                        rel_path = rel_path[1:]  # strip the leading '/'
-                        content["MODULES"][module].append(rel_path)
-            if not ui_found:
-                # Nothing is displayable in this folder, ignore it
-                modules_to_ignore.add(module)
-
-        # Finally, filter empty modules
-        for module in modules_to_ignore:
-            del content["MODULES"][module]
-
-        return content
+            if message.msgid_plural is not None:
+                if nplurals is None:
+                    if not plural_error and "Plural-Forms:" not in fields:
+                        self.error(
+                            message.line,
+                            "message catalog has plural form translations, but "
+                            'lacks a header entry with "Plural-Forms: '
+                            'nplurals=INTEGER; plural=EXPRESSION;"',
+                        )
+                        plural_error = True
+                elif len(message.msgstr) < nplurals:
+                    self.error(
+                        message.line,
+                        "nplurals = %d, but this message has only %d plural forms"
+                        % (nplurals, len(message.msgstr)),
+                    )
+                elif len(message.msgstr) > nplurals:
+                    self.error(
+                        message.line,
+                        "nplurals = %d, but this message has %d plural forms"
+                        % (nplurals, len(message.msgstr)),
+                    )
+            self._check_newlines(message)
+            if "c-format" in message.flags:
+                self._check_format(message, "C", c_format_arguments)
+            if "python-format" in message.flags:
+                self._check_format(message, "Python", python_format_arguments)
+
+    def _check_header(self, header, fields):
+        initial = []
+        for name, template in self.header_fields:
+            match = re.search(r"(^|.)%s:[ \t]*(.*)$" % re.escape(name), fields, re.M)
+            if match is None:
+                self.warning(header.line, "header field '%s' missing in header" % name)
+            elif match.group(1) != "":
+                self.warning(
+                    header.line,
+                    "header field '%s' should start at beginning of line" % name,
+                )
+            elif template is not None and match.group(2).startswith(template):
+                initial.append(name)
+        if len(initial) == 1:
+            self.warning(
+                header.line,
+                "header field '%s' still has the initial default value" % initial[0],
+            )
+        elif initial:
+            self.warning(
+                header.line, "some header fields still have the initial default value"
+            )
+
+    def _check_newlines(self, message):
+        """The translations must begin and end with a newline like the msgid"""
+        for position, test in (("begin", bytes.startswith), ("end", bytes.endswith)):
+            expected = test(message.msgid, b"\n")
+            if message.msgid_plural is None:
+                if test(message.msgstr[0], b"\n") != expected:
+                    self.error(
+                        message.line,
+                        "'msgid' and 'msgstr' entries do not both %s with '\\n'"
+                        % position,
+                    )
+                continue
+            if test(message.msgid_plural, b"\n") != expected:
+                self.error(
+                    message.line,
+                    "'msgid' and 'msgid_plural' entries do not both %s with '\\n'"
+                    % position,
+                )
+            for index, msgstr in enumerate(message.msgstr):
+                if test(msgstr, b"\n") != expected:
+                    self.error(
+                        message.line,
+                        "'msgid' and 'msgstr[%d]' entries do not both %s with '\\n'"
+                        % (index, position),
+                    )
+
+    def _check_format(self, message, language, parse):
+        """The translations must expect the same arguments as the msgid"""
+        try:
+            expected = parse(message.msgid_plural or message.msgid)
+        except ValueError:
+            # msgfmt doesn't check translations of invalid format strings
+            return
+        for index, msgstr in enumerate(message.msgstr):
+            if message.msgid_plural is None:
+                name = "msgstr"
+            else:
+                name = "msgstr[%d]" % index
+            try:
+                arguments = parse(msgstr)
+            except ValueError as e:
+                self.error(
+                    message.line,
+                    "'%s' is not a valid %s format string, unlike 'msgid'. "
+                    "Reason: %s" % (name, language, e),
+                )
+                continue
+            # A plural form may omit arguments, like "one file" for "%d files"
+            reason = compare_format_arguments(
+                expected, arguments, name, message.msgid_plural is None
+            )
+            if reason is not None:
+                self.error(message.line, reason)
+
+    def write(self, mo_file):
+        """Write the messages in a MO file, like GNU msgfmt does"""
+        entries = []
+        for message in self.messages:
+            key = message.msgid
+            if message.msgctxt is not None:
+                key = message.msgctxt + b"\x04" + key
+            original = key
+            if message.msgid_plural is not None:
+                original += b"\x00" + message.msgid_plural
+            entries.append((key, original, b"\x00".join(message.msgstr)))
+        entries.sort()
+        write_mo(entries, mo_file)
+
+
+_system_locales = None  # see system_locales
+_system_locales_lock = Lock()
+
+
+def system_locales():
+    """Returns the UTF-8 locales available on the system, eg. {"fr_FR"}
+
+    They are listed once with "locale -a". Unlike locale.setlocale, this
+    doesn't change the locale of the whole process under the other threads.
+    """
+    global _system_locales
+    with _system_locales_lock:
+        if _system_locales is None:
+            try:
+                output = check_output(["locale", "-a"], stderr=DEVNULL).decode()
+            except (OSError, CalledProcessError, UnicodeDecodeError):
+                traceback.print_exc()
+                output = ""
+            names = set()
+            for name in output.split():
+                # eg. "fr_FR.utf8", but not "sr_RS.utf8@latin"
+                base, _, codeset = name.partition(".")
+                if codeset.lower() in ("utf8", "utf-8"):
+                    names.add(base)
+            _system_locales = frozenset(names)
+        return _system_locales
+
+
+def detect_po_language(po_path):
+    """Try to guess the language of a PO file, default is 'en_US'
+
+    This is good to know to later set proper environment variables and so
+    load the right GTK translation and reverse the interface if necessary.
+    """
+    po_lang = "en_US"
+    with open(po_path, encoding="utf8") as po:
+        # Give up if we find nothing in the 50 first lines
+        for _ in range(50):
+            line = po.readline()
+            match = re.match(r'^"Language: (.+)\\n"$', line)
+            if match:
+                po_lang = match.group(1)
+                # The encoding is often wrong, so strip it
+                po_lang = locale.normalize(po_lang).rsplit(".")[0]
+                # Test if the detected locale is available on the system
+                if po_lang not in system_locales():
+                    # Fallback to a known locale
+                    po_lang = "en_US"
+                break
+    return po_lang
+
+
+def compile_po(po_path, mo_path):
+    """Compile a PO file, checking it on the way"""
+    with metrics.po_compile.time():
+        _compile_po(po_path, mo_path)
+
+
+def _compile_po(po_path, mo_path):
+    compiler = PoCompiler()
+    with open(po_path, "rb") as po_file:
+        compiler.parse(po_file)
+    if compiler.is_system_dependent():
+        # Leave the MO format revision 1 to msgfmt
+        return _compile_po_msgfmt(po_path, mo_path)
+    compiler.check()
+    if compiler.errors:
+        compiler.log.append(
+            "msgfmt: found %d fatal error%s"
+            % (compiler.errors, "s" if compiler.errors > 1 else "")
+        )
+        raise DeckardException(
+            "Error while building the .mo", "\n".join(compiler.log) + "\n"
+        )
+    with open(mo_path, "wb") as mo_file:
+        compiler.write(mo_file)
+
+
+def _compile_po_msgfmt(po_path, mo_path):
+    """Compile a PO file with GNU msgfmt"""
+    try:
+        check_output(
+            ["/usr/bin/msgfmt", "--check", "--output-file", mo_path, po_path],
+            stderr=STDOUT,
+        )
+    except CalledProcessError as e:
+        # We don't need to expose the file name in the error message
+        log = e.output.decode("unicode_escape").replace("%s:" % po_path, "")
+        raise DeckardException("Error while building the .mo", log)
+
+
+def _format_reason(directive, conversion):
+    if conversion == "":
+        return "The string ends in the middle of a directive."
+    return (
+        "In the directive number %d, the character '%s' is not a valid conversion "
+        "specifier." % (directive, conversion)
+    )
+
+
+def c_format_arguments(string):
+    """Returns the arguments of a C format string as {number: type}
+
+    A ValueError is raised with the reason if the format string is invalid.
+    """
+    directive = re.compile(
+        rb"%(?:([1-9][0-9]*)\$)?[-+ #0'I]*(\*(?:[1-9][0-9]*\$)?|[0-9]+)?"
+        rb"(?:\.(\*(?:[1-9][0-9]*\$)?|[0-9]*))?(hh|h|ll|l|L|q|j|z|Z|t)?(.?)",
+        re.S,
+    )
+    types = (
+        ("di", "int"),
+        ("ouxX", "unsigned int"),
+        ("eEfFgGaA", "double"),
+        ("c", "char"),
+        ("s", "string"),
+        ("p", "pointer"),
+        ("n", "count pointer"),
+        ("C", "wide char"),
+        ("S", "wide string"),
+    )
+    arguments = {}
+    numbered = unnumbered = 0
+    count = 0
+
+    def add(number, type_):
+        nonlocal numbered, unnumbered
+        if number is None:
+            unnumbered += 1
+            number = unnumbered
+        else:
+            numbered += 1
+            number = int(number.strip(b"*$"))
+        if numbered and unnumbered:
+            raise ValueError(
+                "The string refers to arguments both through absolute argument "
+                "numbers and through unnumbered argument specifications."
+            )
+        if arguments.setdefault(number, type_) != type_:
+            raise ValueError(
+                "The string refers to argument number %d in incompatible ways." % number
+            )
+
+    position = string.find(b"%")
+    while position != -1:
+        match = directive.match(string, position)
+        position = string.find(b"%", match.end())
+        number, width, precision, size, conversion = match.groups()
+        if match.group(0) == b"%%":
+            continue
+        count += 1
+        conversion = conversion.decode("latin1")
+        if conversion == "m":
+            # strerror(errno), there is no argument
+            continue
+        for conversions, type_ in types:
+            if conversion and conversion in conversions:
+                break
+        else:
+            raise ValueError(_format_reason(count, conversion))
+        for star in (width, precision):
+            if star is not None and star.startswith(b"*"):
+                add(star if star != b"*" else None, "int")
+        if size is not None:
+            type_ = "%s %s" % (size.decode(), type_)
+        add(number, type_)
+
+    for number in range(1, max(arguments, default=0) + 1):
+        if number not in arguments:
+            raise ValueError(
+                "The string refers to argument number %d but ignores argument "
+                "number %d." % (max(arguments), number)
+            )
+    return arguments
+
+
+def python_format_arguments(string):
+    """Returns the arguments of a Python format string
+
+    They are given as {name: type} for a mapping, or {number: type} for a
+    tuple. A ValueError is raised with the reason if the format string is
+    invalid.
+    """
+    directive = re.compile(
+        rb"%(?:\(([^)]*)\))?[-+ #0]*(\*|[0-9]+)?(?:\.(\*|[0-9]*))?[hlL]?(.?)", re.S
+    )
+    types = (
+        ("diouxX", "integer"),
+        ("eEfFgG", "float"),
+        ("c", "character"),
+        ("sra", "string"),
+    )
+    named = {}
+    unnamed = {}
+    count = 0
+
+    position = string.find(b"%")
+    while position != -1:
+        match = directive.match(string, position)
+        position = string.find(b"%", match.end())
+        name, width, precision, conversion = match.groups()
+        if match.group(0) == b"%%":
+            continue
+        count += 1
+        conversion = conversion.decode("latin1")
+        for conversions, type_ in types:
+            if conversion and conversion in conversions:
+                break
+        else:
+            raise ValueError(_format_reason(count, conversion))
+        if name is None:
+            for star in (width, precision):
+                if star == b"*":
+                    unnamed[len(unnamed) + 1] = "integer"
+            unnamed[len(unnamed) + 1] = type_
+        elif b"*" in (width, precision):
+            raise ValueError(
+                "The string refers to a width or precision of '*' in the directive "
+                "number %d, but the arguments are named." % count
+            )
+        elif named.setdefault(name.decode("utf8", "replace"), type_) != type_:
+            raise ValueError(
+                "The string refers to the argument named '%s' in incompatible ways."
+                % name.decode("utf8", "replace")
+            )
+        if named and unnamed:
+            raise ValueError(
+                "The string mixes named and unnamed argument specifications."
+            )
+    return named or unnamed
+
+
+def compare_format_arguments(expected, arguments, name, strict):
+    """Returns why the arguments of a translation don't match the msgid ones
+
+    Unless strict is True, the translation may omit arguments. None is
+    returned if the arguments match.
+    """
+    if expected and arguments:
+        expects_tuple = isinstance(next(iter(expected)), int)
+        if expects_tuple != isinstance(next(iter(arguments)), int):
+            return (
+                "format specifications in 'msgid' expect a %s, those in '%s' "
+                "expect a %s"
+                % (
+                    "tuple" if expects_tuple else "mapping",
+                    name,
+                    "mapping" if expects_tuple else "tuple",
+                )
+            )
+    unexpected = [argument for argument in arguments if argument not in expected]
+    missing = [argument for argument in expected if argument not in arguments]
+    if unexpected or (strict and missing):
+        if isinstance((unexpected or missing)[0], int):
+            return (
+                "number of format specifications in 'msgid' and '%s' does not match"
+                % name
+            )
+        if unexpected:
+            return (
+                "a format specification for argument '%s', as in '%s', doesn't "
+                "exist in 'msgid'" % (unexpected[0], name)
+            )
+        return "a format specification for argument '%s' doesn't exist in '%s'" % (
+            missing[0],
+            name,
+        )
+    for argument in arguments:
+        if arguments[argument] != expected[argument]:
+            return (
+                "format specifications in 'msgid' and '%s' for argument %s are not "
+                "the same" % (name, argument)
+            )
+    return None
+
+
+def _next_prime(seed):
+    """The hash table size computation of gettext"""
+    seed |= 1
+    while True:
+        divisor = 3
+        square = divisor * divisor
+        while square < seed and seed % divisor != 0:
+            divisor += 1
+            square += 4 * divisor
+            divisor += 1
+        if seed % divisor != 0:
+            return seed
+        seed += 2
+
+
+def _hash_string(string):
+    """The hashpjw function of gettext"""
+    value = 0
+    for byte in string:
+        value = ((value << 4) + byte) & 0xFFFFFFFF
+        high = value & 0xF0000000
+        if high:
+            value ^= high >> 24
+            value ^= high
+    return value
+
+
+def write_mo(entries, mo_file):
+    """Write a MO file with its hash table, like GNU msgfmt does
+
+    entries is a sorted list of (key, original, translation), the key being the
+    original without its plural form.
+    """
+    count = len(entries)
+    hash_size = max(_next_prime(count * 4 // 3), 3)
+    originals_offset = 28
+    translations_offset = originals_offset + 8 * count
+    hash_offset = translations_offset + 8 * count
+
+    hash_table = [0] * hash_size
+    for index, (key, _, _) in enumerate(entries):
+        value = _hash_string(key)
+        position = value % hash_size
+        increment = 1 + value % (hash_size - 2)
+        while hash_table[position] != 0:
+            if position >= hash_size - increment:
+                position -= hash_size - increment
+            else:
+                position += increment
+        hash_table[position] = index + 1
+
+    offset = hash_offset + 4 * hash_size
+    tables = []
+    for column in (1, 2):
+        for entry in entries:
+            tables.extend((len(entry[column]), offset))
+            offset += len(entry[column]) + 1
+
+    mo_file.write(
+        struct.pack(
+            "=7I",
+            0x950412DE,  # magic number
+            0,  # revision
+            count,
+            originals_offset,
+            translations_offset,
+            hash_size,
+            hash_offset,
+        )
+    )
+    mo_file.write(struct.pack("=%dI" % len(tables), *tables))
+    mo_file.write(struct.pack("=%dI" % hash_size, *hash_table))
+    for column in (1, 2):
+        for entry in entries:
+            mo_file.write(entry[column] + b"\x00")
+
+
+def scan_content(content_root):
+    """Build the content structure by exploring content_root
+
+    The returned structure is as below:
+    {'LANG': {'locale1_code': 'locale1_name_in_the_relative_locale',
+              'locale2_code': 'locale2_name_in_the_relative_locale'},
+     'MODULES': {'module1': ['file1.ui', 'file2.glade'],
+                 'module2': ['file1.xml', 'path/in/module/file2.ui']}
+    }
+    """
+    content = {"LANGS": {}, "MODULES": {}}
+
+    for lang in os.listdir(os.path.join(content_root, "LANGS")):
+        if lang in locale_language_mapping:
+            content["LANGS"][lang] = locale_language_mapping[lang]
+    for item in os.listdir(content_root):
+        if not os.path.isdir(os.path.join(content_root, item)) or item in {
+            "LANGS",
+            GLADE_CACHE,
+            SNAPSHOT_CACHE,
+        }:
+            continue
+        content["MODULES"][item] = []
+
+    modules_to_ignore = set()
+    for module in content["MODULES"]:
+        mod_root = os.path.join(content_root, module)
+        ui_found = False
+        for root, _, files in os.walk(mod_root):
+            for file_ in files:
+                _, ext = os.path.splitext(file_)
+                ext = ext.lower()
+                if ext == ".ui" or ext == ".xml" or ext == ".glade":
+                    ui_found = True
+                    rel_path = os.path.join(root, file_).split(mod_root)[1]
+                    rel_path = rel_path[1:]  # strip the leading '/'
+                    content["MODULES"][module].append(rel_path)
+        if not ui_found:
+            # Nothing is displayable in this folder, ignore it
+            modules_to_ignore.add(module)
+
+    # Finally, filter empty modules
+    for module in modules_to_ignore:
+        del content["MODULES"][module]
+
+    return content
+
+
+def write_content_index(content_root):
+    """Save the content structure of content_root in its content index
+
+    This is meant to be run when the content folder is built, so Deckard does
+    not have to explore it.
+    """
+    with open(os.path.join(content_root, CONTENT_INDEX), "w", encoding="utf8") as index:
+        json.dump(scan_content(content_root), index)
@@ -16,8 +16,10 @@
  */
  
 var session = '';
-var process_running = false;
-var keep_alive_loop;
+var session_events = null;
+var keep_alive_loop = null;  // when the server has no room for session_events
+var runner_error = null;
+var queue_ticket = '';  // our place in the waiting queue of the server, if any
 var stored_po = {};
 var upload_button = document.getElementById('upload_button');
 var upload_spinner = document.getElementById('upload_spinner');
@@ -169,7 +171,9 @@ function upload_po(remote_file_name) {
     if (session != '') {
         // Attach to the current session
         data.append('session', session);
-        clearInterval(keep_alive_loop);
+    }
+    if (queue_ticket != '') {
+        data.append('ticket', queue_ticket);
     }
 
     upload_spinner.style.display = 'block';
@@ -178,10 +182,30 @@ function upload_po(remote_file_name) {
     current_ui_selector.disabled = true;
     module_selector.disabled = true;
     locale_selector.disabled = true;
-    xml_http_post('#', data, upload_po_return);
+    xml_http_post('#', data, function(req) {
+        upload_po_return(req, remote_file_name);
+    });
 }
 
-function upload_po_return(req) {
+function wait_in_queue(res, retry) {
+    // No room on the server for now, ask again in a while to keep our place
+    queue_ticket = res['ticket'];
+    var message = 'Waiting for a free slot: number '+res['position']+' in the queue';
+    if (res['eta'] != null) {
+        message += ', about '+Math.max(res['eta'], 1)+' s left';
+    }
+    document.getElementById('user_count').innerHTML = message;
+    setTimeout(retry, 2000);
+}
+
+function upload_po_return(req, remote_file_name) {
+    if (req.status == 200) {
+        res = JSON.parse(req.responseText);
+        if (res['status'] == 'queued') {
+            wait_in_queue(res, function() { upload_po(remote_file_name); });
+            return;
+        }
+    }
 
     upload_spinner.style.display = 'none';
     upload_button.disabled = false;
@@ -196,6 +220,7 @@ function upload_po_return(req) {
         return;
     }
 
+    queue_ticket = '';
     res = JSON.parse(req.responseText);
     if (res['status'] == 'ok') {
         session = res['session'];
@@ -205,7 +230,7 @@ function upload_po_return(req) {
             locale_selector.selectedIndex = locale_selector.length - 1;  // focus the last item
         }
 
-        keep_alive_loop = setInterval(keep_alive, 2000);
+        listen_session();
         if (param_display == '1') {
             // The 'display' parameter should only affect the initial loading
             param_display = '0';
@@ -235,16 +260,29 @@ function spawn() {
     if (session != '') {
         // Attach to the current session
         data += '&session=' + session;
-        clearInterval(keep_alive_loop);
+    }
+    if (queue_ticket != '') {
+        data += '&ticket=' + queue_ticket;
     }
     xml_http_post('#', data, spawn_return);
 }
 
 function spawn_return(req) {
     res = JSON.parse(req.responseText);
+    if (res['status'] == 'queued') {
+        wait_in_queue(res, spawn);
+        return;
+    }
+    queue_ticket = '';
     if (res['status'] == 'ok') {
         session = res['session'];
-        keep_alive_loop = setInterval(keep_alive, 2000);
+        listen_session();
+        // change the '/' before the port by a ':' if you did not configure a proxy to redirect runner ports on port 80
+        var runner_url = window.location.origin+'/'+res['port']+'/';
+        if (res['reused'] && iframe.src == runner_url) {
+            // The runner loaded the new file in place, the iframe is already connected to it
+            return;
+        }
         function update_iframe() {
             iframe.onload = function() {
                 // Allow scrolling with the mouse wheel in the iframe by hot-patching the broadwayd JS.
@@ -254,18 +292,12 @@ function spawn_return(req) {
                 // Inhibit the annoying alert on closing (strangely, it only seemed to affect Chromium)
                 iframe.contentWindow.alert = function(msg) {};
             }
-            // change the '/' before the port by a ':' if you did not configure a proxy to redirect runner ports on port 80
-            iframe.src = window.location.origin+'/'+res['port']+'/';
+            iframe.src = runner_url;
         }
         iframe.src = 'resources/waiting.html';
         // Wait for the remote process to be fully started
-        if (process_running) {
-            setTimeout(update_iframe, 700);
-        } else {
-            // Wait a bit more if we don't replace a running process (cold start)
-            setTimeout(update_iframe, 1700);
-        }
-        process_running = true;
+        // Runners are pre-started on the server, so there is no cold start to wait for.
+        setTimeout(update_iframe, 700);
         return;
     } else if (res['status'] == 'error') {
         abort_session();
@@ -277,29 +309,70 @@ function spawn_return(req) {
     alert('An error occured:\n\n' + req.responseText);
 }
 
+function listen_session() {
+    // The server pushes the state of the session on this stream,
+    // and keeps the session alive for as long as it is open.
+    if (session_events && session_events.session == session) {
+        return;
+    }
+    if (keep_alive_loop && keep_alive_loop.session == session) {
+        return;
+    }
+    stop_listening();
+    session_events = new EventSource('?action=events&session=' + session);
+    session_events.session = session;
+    session_events.onmessage = function(event) {
+        session_state(JSON.parse(event.data));
+    };
+}
+
+function stop_listening() {
+    if (session_events) {
+        session_events.close();
+        session_events = null;
+    }
+    if (keep_alive_loop) {
+        clearInterval(keep_alive_loop.id);
+        keep_alive_loop = null;
+    }
+}
+
 function keep_alive() {
     var data = 'action=keep_alive&session='+session;
-    xml_http_post('#', data, keep_alive_return);
+    xml_http_post('#', data, function(req) {
+        if (req.status == 200) {
+            session_state(JSON.parse(req.responseText));
+        }
+    });
 }
 
-function keep_alive_return(req) {
-    var res = JSON.parse(req.responseText)
- 
+function session_state(res) {
+    if (res['status'] == 'poll') {
+        // Too many streams on the server, ask for the state instead
+        stop_listening();
+        keep_alive_loop = {session: session, id: setInterval(keep_alive, 2000)};
+        return;
+    }
+
     if (res['status'] == 'ok') {
         document.getElementById('user_count').innerHTML = 'Users online: '+res['users_count'];
-        return;
-    } else if (res['status'] == 'error') {
-        clearInterval(keep_alive_loop);
-        abort_session();
+        if (res['runner_error'] != runner_error) {
+            runner_error = res['runner_error'];
+            if (runner_error) {
+                // The runner died on its own, the next spawn will start a new one
+                iframe.src = 'about:blank';
+                alert(runner_error);
+            }
+        }
         return;
     }
-
-    alert('An error occured:\n\n' + req.responseText);
+    // The session is dead
+    abort_session();
 }
 
 function abort_session() {
+    stop_listening();
     session = '';
-    process_running = false;
     locale_selector.length = language_count;
     document.getElementById('user_count').innerHTML = 'disconnected';
     stored_po = {};
@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+
+# Deckard, a Web based Glade Runner
+# Copyright (C) 2013  Nicolas Delvaux <contact@nicolas-delvaux.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Session registries shared between Deckard processes
+
+A session store knows which sessions exist, which Deckard process owns each of
+them (and its runner), the ports they use and their PO files. Every Deckard
+process using the same store serves the same sessions.
+
+Run this module to serve a store over HTTP, for Deckard processes on several
+hosts (see HttpSessionStore).
+"""
+
+import json
+import base64
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from http.client import HTTPConnection, RemoteDisconnected
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+
+class SessionStore:
+    """
+    Base class of the session stores.
+    Sessions are returned as dictionaries like:
+    {'uuid': uuid, 'owner': 'host:pid:id', 'deadline': 1600000000.0,
+     'runner': True, 'runner_error': None,
+     'custom_po': [[po_name, module, digest], ...]}
+    Deadlines are UNIX timestamps, since processes don't share a monotonic
+    clock.
+    Each method is atomic.
+    """
+
+    # False if only one process can use this store
+    shared = True
+    # Methods available through HttpSessionStore
+    methods = {
+        "create",
+        "get",
+        "renew",
+        "update",
+        "delete",
+        "count",
+        "expire",
+        "claim_port",
+        "release_port",
+        "put_po",
+        "get_po",
+    }
+    # Fields which can be changed by update
+    fields = {"owner", "runner", "runner_error", "custom_po"}
+
+    def create(self, uuid, owner, deadline, max_sessions):
+        """Register a new session
+
+        Returns False if there are already max_sessions sessions.
+        """
+        raise NotImplementedError
+
+    def get(self, uuid):
+        """Returns the session, or None if it does not exist"""
+        raise NotImplementedError
+
+    def renew(self, uuid, deadline):
+        """Keep the session until deadline at least
+
+        Returns False if the session does not exist.
+        """
+        raise NotImplementedError
+
+    def update(self, uuid, **fields):
+        """Change the owner, runner, runner_error or custom_po of a session
+
+        Returns False if the session does not exist.
+        """
+        raise NotImplementedError
+
+    def _check_fields(self, fields):
+        """Raise a ValueError if update can't change one of fields"""
+        unknown = set(fields) - self.fields
+        if unknown:
+            raise ValueError("Unknown fields: %s" % ", ".join(sorted(unknown)))
+
+    def delete(self, uuid):
+        """Forget a session"""
+        raise NotImplementedError
+
+    def count(self):
+        """Returns the number of sessions"""
+        raise NotImplementedError
+
+    def expire(self, before):
+        """Forget the sessions whose deadline is before the given time
+
+        This is for sessions whose owner died, owners delete their expired
+        sessions themselves. Returns the number of forgotten sessions.
+        """
+        raise NotImplementedError
+
+    def claim_port(self, uuid, host, first_port, count):
+        """Reserve a port of host for a session
+
+        The port is taken between first_port and first_port + count - 1.
+        It stays reserved until it is released, even if the session is taken
+        over by another process, or until the session is deleted.
+        Returns None if all ports are taken.
+        """
+        raise NotImplementedError
+
+    def release_port(self, uuid, host, port):
+        """Give back a port reserved by a session"""
+        raise NotImplementedError
+
+    def put_po(self, digest, data):
+        """Store the content of a PO file, identified by its SHA-256
+
+        PO files are deleted when no session uses them anymore.
+        """
+        raise NotImplementedError
+
+    def get_po(self, digest):
+        """Returns the content of a PO file, or None if it is unknown"""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions of a single Deckard process, which is the default"""
+
+    shared = False
+
+    def __init__(self):
+        self._sessions = {}
+        self._ports = {}  # {(host, port): uuid}
+        self._po = {}  # {digest: data}
+        self._lock = threading.Lock()
+
+    def create(self, uuid, owner, deadline, max_sessions):
+        with self._lock:
+            if len(self._sessions) >= max_sessions:
+                return False
+            self._sessions[uuid] = {
+                "uuid": uuid,
+                "owner": owner,
+                "deadline": deadline,
+                "runner": False,
+                "runner_error": None,
+                "custom_po": [],
+            }
+            return True
+
+    def get(self, uuid):
+        with self._lock:
+            session = self._sessions.get(uuid)
+            return dict(session) if session is not None else None
+
+    def renew(self, uuid, deadline):
+        with self._lock:
+            if uuid not in self._sessions:
+                return False
+            session = self._sessions[uuid]
+            session["deadline"] = max(session["deadline"], deadline)
+            return True
+
+    def update(self, uuid, **fields):
+        self._check_fields(fields)
+        with self._lock:
+            if uuid not in self._sessions:
+                return False
+            self._sessions[uuid].update(fields)
+            self._collect_po()
+            return True
+
+    def delete(self, uuid):
+        with self._lock:
+            self._delete(uuid)
+
+    def _delete(self, uuid):
+        self._sessions.pop(uuid, None)
+        for key in [key for key in self._ports if self._ports[key] == uuid]:
+            del self._ports[key]
+        self._collect_po()
+
+    def _collect_po(self):
+        """Delete the PO files no session uses"""
+        used = {
+            digest
+            for session in self._sessions.values()
+            for _, _, digest in session["custom_po"]
+        }
+        for digest in set(self._po) - used:
+            del self._po[digest]
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def expire(self, before):
+        with self._lock:
+            expired = [
+                uuid
+                for uuid, session in self._sessions.items()
+                if session["deadline"] < before
+            ]
+            for uuid in expired:
+                self._delete(uuid)
+            return len(expired)
+
+    def claim_port(self, uuid, host, first_port, count):
+        with self._lock:
+            for port in range(first_port, first_port + count):
+                if (host, port) not in self._ports:
+                    self._ports[(host, port)] = uuid
+                    return port
+            return None
+
+    def release_port(self, uuid, host, port):
+        with self._lock:
+            if self._ports.get((host, port)) == uuid:
+                del self._ports[(host, port)]
+
+    def put_po(self, digest, data):
+        with self._lock:
+            self._po[digest] = data
+
+    def get_po(self, digest):
+        with self._lock:
+            return self._po.get(digest)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Sessions stored in a SQLite database.
+    All Deckard processes of a host can share it, SQLite locks the file for
+    each transaction.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            uuid TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            deadline REAL NOT NULL,
+            runner INTEGER NOT NULL DEFAULT 0,
+            runner_error TEXT,
+            custom_po TEXT NOT NULL DEFAULT '[]'
+        );
+        CREATE TABLE IF NOT EXISTS ports (
+            host TEXT NOT NULL,
+            port INTEGER NOT NULL,
+            uuid TEXT NOT NULL,
+            PRIMARY KEY (host, port)
+        );
+        CREATE TABLE IF NOT EXISTS po (
+            digest TEXT PRIMARY KEY,
+            data BLOB NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()  # one connection per thread
+        self._connection().executescript(self.schema)
+
+    def _connection(self):
+        """Returns the database connection of the current thread"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        """Run queries in an exclusive transaction"""
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _collect_po(self, db):
+        """Delete the PO files no session uses"""
+        used = set()
+        for (custom_po,) in db.execute("SELECT custom_po FROM sessions"):
+            used.update(digest for _, _, digest in json.loads(custom_po))
+        for (digest,) in db.execute("SELECT digest FROM po").fetchall():
+            if digest not in used:
+                db.execute("DELETE FROM po WHERE digest = ?", (digest,))
+
+    def create(self, uuid, owner, deadline, max_sessions):
+        with self._transaction() as db:
+            (count,) = db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+            if count >= max_sessions:
+                return False
+            db.execute(
+                "INSERT INTO sessions (uuid, owner, deadline) VALUES (?, ?, ?)",
+                (uuid, owner, deadline),
+            )
+            return True
+
+    def get(self, uuid):
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT owner, deadline, runner, runner_error, custom_po "
+                "FROM sessions WHERE uuid = ?",
+                (uuid,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "uuid": uuid,
+            "owner": row[0],
+            "deadline": row[1],
+            "runner": bool(row[2]),
+            "runner_error": row[3],
+            "custom_po": json.loads(row[4]),
+        }
+
+    def renew(self, uuid, deadline):
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE sessions SET deadline = MAX(deadline, ?) WHERE uuid = ?",
+                (deadline, uuid),
+            )
+            return cursor.rowcount > 0
+
+    def update(self, uuid, **fields):
+        # Field names are part of the query
+        self._check_fields(fields)
+        if "custom_po" in fields:
+            fields["custom_po"] = json.dumps(fields["custom_po"])
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE sessions SET %s WHERE uuid = ?"
+                % ", ".join("%s = ?" % field for field in fields),
+                (*fields.values(), uuid),
+            )
+            if "custom_po" in fields:
+                self._collect_po(db)
+            return cursor.rowcount > 0
+
+    def delete(self, uuid):
+        with self._transaction() as db:
+            db.execute("DELETE FROM sessions WHERE uuid = ?", (uuid,))
+            db.execute("DELETE FROM ports WHERE uuid = ?", (uuid,))
+            self._collect_po(db)
+
+    def count(self):
+        with self._transaction() as db:
+            return db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def expire(self, before):
+        with self._transaction() as db:
+            cursor = db.execute("DELETE FROM sessions WHERE deadline < ?", (before,))
+            if cursor.rowcount > 0:
+                db.execute(
+                    "DELETE FROM ports WHERE uuid NOT IN (SELECT uuid FROM sessions)"
+                )
+                self._collect_po(db)
+            return cursor.rowcount
+
+    def claim_port(self, uuid, host, first_port, count):
+        with self._transaction() as db:
+            taken = {
+                port
+                for (port,) in db.execute(
+                    "SELECT port FROM ports WHERE host = ?", (host,)
+                )
+            }
+            for port in range(first_port, first_port + count):
+                if port not in taken:
+                    db.execute(
+                        "INSERT INTO ports (host, port, uuid) VALUES (?, ?, ?)",
+                        (host, port, uuid),
+                    )
+                    return port
+            return None
+
+    def release_port(self, uuid, host, port):
+        with self._transaction() as db:
+            db.execute(
+                "DELETE FROM ports WHERE host = ? AND port = ? AND uuid = ?",
+                (host, port, uuid),
+            )
+
+    def put_po(self, digest, data):
+        with self._transaction() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO po (digest, data) VALUES (?, ?)",
+                (digest, data),
+            )
+
+    def get_po(self, digest):
+        with self._transaction() as db:
+            row = db.execute("SELECT data FROM po WHERE digest = ?", (digest,))
+            row = row.fetchone()
+        return bytes(row[0]) if row is not None else None
+
+
+class HttpSessionStore(SessionStore):
+    """
+    Client of a session store served over HTTP by this module, so Deckard
+    processes on several hosts can share it.
+    Each method is a POST request to /method_name, with its arguments in a
+    JSON object. The JSON answer holds the result in its "result" key.
+    """
+
+    def __init__(self, url, timeout=10):
+        parts = urlsplit(url)
+        self.host = parts.netloc
+        self.path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()  # one kept-alive connection per thread
+
+    def _call(self, method, **arguments):
+        body = json.dumps(arguments).encode()
+        headers = {"Content-Type": "application/json"}
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = HTTPConnection(self.host, timeout=self.timeout)
+            self._local.connection = connection
+        try:
+            connection.request("POST", "%s/%s" % (self.path, method), body, headers)
+            response = connection.getresponse()
+        except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The server closed the idle connection, open a new one
+            connection.close()
+            connection.request("POST", "%s/%s" % (self.path, method), body, headers)
+            response = connection.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise OSError(
+                "Session store error %d: %s" % (response.status, data.decode())
+            )
+        return json.loads(data)["result"]
+
+    def create(self, uuid, owner, deadline, max_sessions):
+        return self._call(
+            "create",
+            uuid=uuid,
+            owner=owner,
+            deadline=deadline,
+            max_sessions=max_sessions,
+        )
+
+    def get(self, uuid):
+        return self._call("get", uuid=uuid)
+
+    def renew(self, uuid, deadline):
+        return self._call("renew", uuid=uuid, deadline=deadline)
+
+    def update(self, uuid, **fields):
+        return self._call("update", uuid=uuid, **fields)
+
+    def delete(self, uuid):
+        return self._call("delete", uuid=uuid)
+
+    def count(self):
+        return self._call("count")
+
+    def expire(self, before):
+        return self._call("expire", before=before)
+
+    def claim_port(self, uuid, host, first_port, count):
+        return self._call(
+            "claim_port", uuid=uuid, host=host, first_port=first_port, count=count
+        )
+
+    def release_port(self, uuid, host, port):
+        return self._call("release_port", uuid=uuid, host=host, port=port)
+
+    def put_po(self, digest, data):
+        return self._call("put_po", digest=digest, data=base64.b64encode(data).decode())
+
+    def get_po(self, digest):
+        data = self._call("get_po", digest=digest)
+        return base64.b64decode(data) if data is not None else None
+
+
+class SessionStoreHandler(BaseHTTPRequestHandler):
+    """Serve the store of the server to HttpSessionStore clients"""
+
+    protocol_version = "HTTP/1.1"  # keep connections alive
+
+    def do_POST(self):
+        method = self.path.rstrip("/").rsplit("/", 1)[-1]
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            if method not in SessionStore.methods:
+                raise ValueError("Unknown method: %s" % method)
+            arguments = json.loads(self.rfile.read(length))
+            if method == "put_po":
+                arguments["data"] = base64.b64decode(arguments["data"])
+            result = getattr(self.server.store, method)(**arguments)
+            if method == "get_po" and result is not None:
+                result = base64.b64encode(result).decode()
+            status, body = 200, json.dumps({"result": result}).encode()
+        except Exception as e:
+            status, body = 400, str(e).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        """Don't log every request"""
+
+
+def serve(store, address):
+    """Serve store over HTTP on address, a (host, port) tuple, forever"""
+    server = ThreadingHTTPServer(address, SessionStoreHandler)
+    server.daemon_threads = True
+    server.store = store
+    server.serve_forever()
+
+
+def open_store(location):
+    """Returns the session store described by location
+
+    location is "memory" (or empty), "sqlite:PATH" or an http:// URL.
+    """
+    if location in ("", "memory"):
+        return MemorySessionStore()
+    elif location.startswith("sqlite:"):
+        return SqliteSessionStore(location[len("sqlite:") :])
+    elif location.startswith("http://"):
+        return HttpSessionStore(location)
+    raise ValueError("Unknown session store: %s" % location)
+
+
+def parse():
+    """Argument parsing"""
+    parser = argparse.ArgumentParser(
+        description="Serve a Deckard session store over HTTP."
+    )
+    parser.add_argument(
+        "-l",
+        "--listen",
+        default="127.0.0.1:8090",
+        help="Address to listen on, as HOST:PORT (default: 127.0.0.1:8090).",
+    )
+    parser.add_argument(
+        "-d",
+        "--database",
+        help="Keep the sessions in this SQLite database, instead of in memory.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse()
+    host, port = args.listen.rsplit(":", 1)
+    if args.database is not None:
+        store = SqliteSessionStore(args.database)
+    else:
+        store = MemorySessionStore()
+    serve(store, (host, int(port)))
@@ -0,0 +1,697 @@
+# Deckard, a Web based Glade Runner
+# Copyright (C) 2013  Nicolas Delvaux <contact@nicolas-delvaux.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of libdeckard, without GTK
+
+Runners are replaced by benchmarks/stub_runner.py.
+"""
+
+import io
+import os
+import sys
+import time
+import shutil
+import gettext
+import resource
+import subprocess
+import tempfile
+import unittest
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import libdeckard
+from libdeckard import BusyException, DeckardException, QueuedException
+from libdeckard import MoCache, PoDownloader, RunnerPool, SessionsManager
+
+
+def make_content(path):
+    """Create a content folder with a single module"""
+    os.makedirs(os.path.join(path, "LANGS", "fr", "LC_MESSAGES"))
+    os.makedirs(os.path.join(path, "module"))
+    with open(os.path.join(path, "module", "window.ui"), "w") as ui:
+        ui.write('<interface><object class="GtkWindow"/></interface>\n')
+
+
+PO = b"""msgid ""
+msgstr ""
+"Content-Type: text/plain; charset=UTF-8\\n"
+"Language: fr\\n"
+
+msgid "Window"
+msgstr "Fen\xc3\xaatre"
+"""
+
+
+def make_runner(path, startup_delay=0, load_delay=0.01):
+    """Write a script starting a stub runner, returns its path"""
+    with open(path, "w") as script:
+        script.write(
+            '#!/bin/sh\nexec %s %s --startup-delay %s --load-delay %s --memory 0 "$@"\n'
+            % (
+                sys.executable,
+                os.path.join(ROOT, "benchmarks", "stub_runner.py"),
+                startup_delay,
+                load_delay,
+            )
+        )
+    os.chmod(path, 0o755)
+    return path
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    """
+    PO mirrors: /ok/ serves PO, /big/ a file bigger than the limit and
+    /missing/ nothing. Files of /ok/ can be revalidated with their ETag.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        mirror = self.path.split("/")[1]
+        if mirror == "ok" and self.headers.get("If-None-Match") == '"po"':
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = {"ok": PO, "big": b"#" * 200000}.get(mirror)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", '"po"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *_):
+        """Don't log every request"""
+
+
+HEADER = b"""msgid ""
+msgstr ""
+"Project-Id-Version: deckard\\n"
+"PO-Revision-Date: 2020-01-01 00:00+0000\\n"
+"Last-Translator: Deckard\\n"
+"Language-Team: French\\n"
+"MIME-Version: 1.0\\n"
+"Content-Type: text/plain; charset=UTF-8\\n"
+"Content-Transfer-Encoding: 8bit\\n"
+"Language: fr\\n"
+"Plural-Forms: nplurals=2; plural=(n > 1);\\n"
+"""
+
+
+class PoCompilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix="deckard_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def parse(self, po):
+        compiler = libdeckard.PoCompiler()
+        compiler.parse(io.BytesIO(po))
+        compiler.check()
+        return compiler
+
+    def translations(self, po):
+        """Compile po, returns its translations as read by gettext"""
+        compiler = self.parse(po)
+        self.assertEqual(compiler.log, [])
+        mo = io.BytesIO()
+        compiler.write(mo)
+        mo.seek(0)
+        return gettext.GNUTranslations(mo)
+
+    def compile(self, po):
+        """Compile po with compile_po, returns the MO file content"""
+        po_path = os.path.join(self.work, "file.po")
+        mo_path = os.path.join(self.work, "file.mo")
+        with open(po_path, "wb") as po_file:
+            po_file.write(po)
+        libdeckard.compile_po(po_path, mo_path)
+        with open(mo_path, "rb") as mo_file:
+            return mo_file.read()
+
+    def test_strings(self):
+        translations = self.translations(
+            HEADER
+            + b'msgid "One" "line"\n'
+            + b'msgstr "Une" " ligne"\n'
+            + b'\nmsgid "Two lines"\n'
+            + b'msgstr ""\n"Deux " "lignes"\n'
+            + b'\nmsgid "Escapes"\n'
+            + b'msgstr "\\1" "2\\t"\n'
+        )
+        self.assertEqual(translations.gettext("Oneline"), "Une ligne")
+        self.assertEqual(translations.gettext("Two lines"), "Deux lignes")
+        self.assertEqual(translations.gettext("Escapes"), "\x012\t")
+
+        compiler = self.parse(HEADER + b'msgid "a"\nmsgstr "b" c\n')
+        self.assertEqual(compiler.log, ["13: syntax error"])
+
+    def test_byte_order_mark(self):
+        translations = self.translations(
+            b"\xef\xbb\xbf" + HEADER + b'msgid "Window"\nmsgstr "Fen\xc3\xaatre"\n'
+        )
+        self.assertEqual(translations.gettext("Window"), "Fen\u00eatre")
+
+    def test_plurals_and_contexts(self):
+        translations = self.translations(
+            HEADER
+            + b'msgctxt "menu"\nmsgid "File"\nmsgstr "Fichier"\n'
+            + b'\nmsgid "File"\nmsgstr "Dossier"\n'
+            + b'\nmsgctxt "menu"\nmsgid "%d file"\nmsgid_plural "%d files"\n'
+            + b'msgstr[0] "%d fichier"\nmsgstr[1] "%d fichiers"\n'
+        )
+        self.assertEqual(translations.pgettext("menu", "File"), "Fichier")
+        self.assertEqual(translations.gettext("File"), "Dossier")
+        self.assertEqual(
+            translations.npgettext("menu", "%d file", "%d files", 1), "%d fichier"
+        )
+        self.assertEqual(
+            translations.npgettext("menu", "%d file", "%d files", 2), "%d fichiers"
+        )
+
+        compiler = self.parse(
+            HEADER
+            + b'msgid "%d file"\nmsgid_plural "%d files"\n'
+            + b'msgstr[0] "%d fichier"\n'
+        )
+        self.assertEqual(
+            compiler.log, ["12: nplurals = 2, but this message has only 1 plural forms"]
+        )
+
+    def test_fuzzy_entries(self):
+        translations = self.translations(
+            b"#, fuzzy\n"
+            + HEADER
+            + b'\n#, fuzzy\nmsgid "Window"\nmsgstr "Fen\xc3\xaatre"\n'
+            + b'\nmsgid "File"\nmsgstr "Fichier"\n'
+        )
+        # The fuzzy header is kept, unlike the other fuzzy entries
+        self.assertEqual(translations.info()["language"], "fr")
+        self.assertEqual(translations.gettext("Window"), "Window")
+        self.assertEqual(translations.gettext("File"), "Fichier")
+
+    def test_format_errors(self):
+        compiler = self.parse(
+            HEADER
+            + b'#, c-format\nmsgid "%d files"\nmsgstr "%s fichiers"\n'
+            + b'\n#, python-format\nmsgid "%(name)s"\nmsgstr "%(nom)s"\n'
+            + b'\n#, c-format\nmsgid "%d%%"\nmsgstr "%d %y"\n'
+            + b'\nmsgid "Line\\n"\nmsgstr "Ligne"\n'
+        )
+        self.assertEqual(
+            compiler.log,
+            [
+                "13: format specifications in 'msgid' and 'msgstr' for argument 1 "
+                "are not the same",
+                "17: a format specification for argument 'nom', as in 'msgstr', "
+                "doesn't exist in 'msgid'",
+                "21: 'msgstr' is not a valid C format string, unlike 'msgid'. "
+                "Reason: In the directive number 2, the character 'y' is not a valid "
+                "conversion specifier.",
+                "24: 'msgid' and 'msgstr' entries do not both end with '\\n'",
+            ],
+        )
+        with self.assertRaisesRegex(DeckardException, "found 1 fatal error"):
+            self.compile(HEADER + b'msgid "Line\\n"\nmsgstr "Ligne"\n')
+
+    @unittest.skipUnless(os.path.exists("/usr/bin/msgfmt"), "msgfmt is missing")
+    def test_same_mo_as_msgfmt(self):
+        po = (
+            HEADER
+            + b'msgctxt "menu"\nmsgid "File"\nmsgstr "Fichier"\n'
+            + b'\nmsgid "Window"\nmsgstr "Fen\xc3\xaatre"\n'
+            + b'\nmsgid "%d file"\nmsgid_plural "%d files"\n'
+            + b'msgstr[0] "%d fichier"\nmsgstr[1] "%d fichiers"\n'
+            + b'\nmsgid "Untranslated"\nmsgstr ""\n'
+        )
+        mo = self.compile(po)
+        mo_path = os.path.join(self.work, "file.mo")
+        libdeckard._compile_po_msgfmt(os.path.join(self.work, "file.po"), mo_path)
+        with open(mo_path, "rb") as mo_file:
+            self.assertEqual(mo, mo_file.read())
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_histogram(self):
+        histogram = libdeckard.Histogram("deckard_test_seconds", "Test.", [0.1, 1])
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual(
+            histogram.render(),
+            [
+                "# HELP deckard_test_seconds Test.",
+                "# TYPE deckard_test_seconds histogram",
+                'deckard_test_seconds_bucket{le="0.1"} 2',
+                'deckard_test_seconds_bucket{le="1"} 3',
+                'deckard_test_seconds_bucket{le="+Inf"} 4',
+                "deckard_test_seconds_sum 2.65",
+                "deckard_test_seconds_count 4",
+            ],
+        )
+
+    def test_counter(self):
+        counter = libdeckard.Counter("deckard_test_total", "Test.", "type")
+        for value in ("OSError", "BusyException", "OSError", 'a "b"\\\n'):
+            counter.inc(value)
+        self.assertEqual(
+            counter.render(),
+            [
+                "# HELP deckard_test_total Test.",
+                "# TYPE deckard_test_total counter",
+                'deckard_test_total{type="BusyException"} 1',
+                'deckard_test_total{type="OSError"} 2',
+                'deckard_test_total{type="a \\"b\\"\\\\\\n"} 1',
+            ],
+        )
+
+
+class MoCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix="deckard_test_")
+        self.po_path = os.path.join(self.work, "fr.po")
+        with open(self.po_path, "wb") as po:
+            po.write(PO)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_references(self):
+        cache = MoCache(0)
+        key, lang_root, lang = cache.acquire(self.po_path, "module", "digest")
+        self.assertTrue(
+            os.path.isfile(
+                os.path.join(lang_root, "LANGS", lang, "LC_MESSAGES", "module.mo")
+            )
+        )
+        # Used entries are kept, even above the size limit
+        self.assertEqual(
+            cache.acquire(self.po_path, "module", "digest"), (key, lang_root, lang)
+        )
+        self.assertGreater(cache.size, 0)
+        cache.release(key)
+        self.assertTrue(os.path.isdir(lang_root))
+        cache.release(key)
+        self.assertFalse(os.path.isdir(lang_root))
+        self.assertEqual(cache.size, 0)
+
+        # Another module is another entry
+        other = cache.acquire(self.po_path, "other", "digest")
+        self.assertNotEqual(other[0], key)
+        cache.release(other[0])
+
+    def test_eviction(self):
+        cache = MoCache(1000000)
+        key, lang_root, _ = cache.acquire(self.po_path, "module", "a")
+        size = cache.size
+        cache.release(key)
+        cache.max_size = size * 2
+
+        roots = {}
+        for digest in ("a", "b", "c"):
+            key, roots[digest], _ = cache.acquire(self.po_path, "module", digest)
+        # Unused entries are kept while the cache fits
+        self.assertEqual(roots["a"], lang_root)
+        self.assertEqual(cache.size, size * 3)
+        cache.release("module:c")
+        self.assertFalse(os.path.isdir(roots["c"]))
+        cache.release("module:b")
+        self.assertTrue(os.path.isdir(roots["b"]))
+        cache.release("module:a")
+        self.assertEqual(cache.size, size * 2)
+
+        # The least recently used one goes first
+        cache.acquire(self.po_path, "module", "b")
+        cache.release("module:b")
+        key, roots["d"], _ = cache.acquire(self.po_path, "module", "d")
+        self.assertFalse(os.path.isdir(roots["a"]))
+        self.assertTrue(os.path.isdir(roots["b"]))
+        self.assertEqual(cache.size, size * 2)
+        cache.release(key)
+
+
+class RunnerResourcesTestCase(unittest.TestCase):
+    def test_memory_budget_without_cgroup(self):
+        resources = libdeckard.RunnerResources(10**12, 0, 2**30)
+        resources.sample_interval = 0
+        self.assertIsNone(resources.cgroup)
+        resources.admit()
+
+        process = subprocess.Popen(
+            [sys.executable, "-c", "import time; print(flush=True); time.sleep(30)"],
+            stdout=subprocess.PIPE,
+        )
+        try:
+            resources.attach(process)
+            process.stdout.readline()  # it started
+            limit = resource.prlimit(process.pid, resource.RLIMIT_DATA)
+            self.assertEqual(limit, (2**30, 2**30))
+            memory, _ = resources.usage()
+            self.assertGreater(memory, 0)
+
+            # One more runner is expected to use as much memory as this one
+            resources.memory_budget = memory * 3
+            resources.admit()
+            resources.memory_budget = memory * 1.5
+            with self.assertRaisesRegex(BusyException, "MB of memory"):
+                resources.admit()
+
+            resources.detach(process)
+            self.assertEqual(resources.usage(), (0, 0.0))
+            resources.admit()
+        finally:
+            process.kill()
+            process.communicate()
+
+
+class DetectPoLanguageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix="deckard_test_")
+        self.locales = libdeckard._system_locales
+        libdeckard._system_locales = frozenset({"fr_FR"})
+
+    def tearDown(self):
+        libdeckard._system_locales = self.locales
+        shutil.rmtree(self.work)
+
+    def detect(self, language):
+        path = os.path.join(self.work, "file.po")
+        with open(path, "wb") as po:
+            po.write(PO.replace(b"Language: fr", b"Language: " + language))
+        return libdeckard.detect_po_language(path)
+
+    def test_available_languages(self):
+        current = libdeckard.locale.setlocale(libdeckard.locale.LC_ALL)
+        self.assertEqual(self.detect(b"fr"), "fr_FR")
+        self.assertEqual(self.detect(b"fr_FR.ISO-8859-1"), "fr_FR")
+        self.assertEqual(self.detect(b"de"), "en_US")
+        # The locale of the process is left alone
+        self.assertEqual(libdeckard.locale.setlocale(libdeckard.locale.LC_ALL), current)
+
+
+class PoDownloaderTestCase(unittest.TestCase):
+    def setUp(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), MirrorHandler)
+        server.daemon_threads = True
+        server.requests = []
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+
+    def mirrors(self, *names):
+        return [
+            "http://127.0.0.1:%d/%s/%%s" % (self.server.server_port, name)
+            for name in names
+        ]
+
+    def test_first_good_answer_wins(self):
+        downloader = PoDownloader(self.mirrors("missing", "ok"), 100000)
+        self.assertEqual(downloader.download("fr.po"), PO)
+
+    def test_file_too_big_on_a_mirror_only(self):
+        downloader = PoDownloader(self.mirrors("big", "ok"), 100000)
+        self.assertEqual(downloader.download("fr.po"), PO)
+
+    def test_errors(self):
+        downloader = PoDownloader(self.mirrors("missing", "big"), 100000)
+        with self.assertRaises(DeckardException):
+            downloader.download("fr.po")
+        downloader = PoDownloader(self.mirrors("big"), 100000)
+        with self.assertRaisesRegex(DeckardException, "File too big"):
+            downloader.download("fr.po")
+        with self.assertRaises(DeckardException):
+            PoDownloader([], 100000).download("fr.po")
+
+    def test_cached_files_are_revalidated(self):
+        downloader = PoDownloader(self.mirrors("ok"), 100000)
+        self.assertEqual(downloader.download("fr.po"), PO)
+        self.assertEqual(downloader.download("fr.po"), PO)
+        self.assertEqual(
+            self.server.requests, [("/ok/fr.po", None), ("/ok/fr.po", '"po"')]
+        )
+        self.assertEqual(downloader.cache_size, len(PO))
+
+
+CATALOG = """<glade-catalog name="test">
+  <glade-widget-classes>
+    <glade-widget-class name="TestButton" parent="GtkButton"/>
+  </glade-widget-classes>
+</glade-catalog>
+"""
+
+
+class RunnerPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix="deckard_test_")
+        self.catalog = os.path.join(self.work, "test.xml")
+        with open(self.catalog, "w") as catalog:
+            catalog.write(CATALOG)
+        self.cache_dir = os.path.join(self.work, "content", libdeckard.GLADE_CACHE)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def make_pool(self, catalogs):
+        return RunnerPool(
+            "gladerunner.py",
+            catalogs,
+            self.cache_dir,
+            libdeckard.ProcessSupervisor(),
+            libdeckard.RunnerResources(0, 0, 0, 0, ""),
+            size=0,
+        )
+
+    def test_pool_refilled_in_background(self):
+        pool = RunnerPool(
+            make_runner(os.path.join(self.work, "runner.sh")),
+            [],
+            self.cache_dir,
+            libdeckard.ProcessSupervisor(),
+            libdeckard.RunnerResources(0, 0, 0, 0, ""),
+            size=2,
+        )
+        self.assertEqual(len(pool._runners), 2)
+        runners = [pool.acquire(lambda runner: None) for i in range(3)]
+        self.assertEqual(len(set(runners)), 3)
+        deadline = time.monotonic() + 5
+        while (len(pool._runners) < 2 or pool._filling) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(pool._runners), 2)
+        self.assertFalse(pool._filling)
+
+    def test_catalog_args_without_catalogs(self):
+        self.assertEqual(self.make_pool([]).catalog_args(), [])
+
+    def test_mapping_written_again_once_removed(self):
+        pool = self.make_pool([self.catalog])
+        args = ["--mapping-path", os.path.join(self.cache_dir, "catalogs.json")]
+        self.assertEqual(pool.catalog_args(), args)
+        # Like a rebuild of the content folder
+        shutil.rmtree(os.path.dirname(self.cache_dir))
+        self.assertEqual(pool.catalog_args(), args)
+        self.assertTrue(os.path.isfile(args[1]))
+
+    def test_catalogs_used_when_mapping_is_not_writable(self):
+        os.makedirs(os.path.dirname(self.cache_dir))
+        with open(self.cache_dir, "w"):
+            pass  # not a folder
+        pool = self.make_pool([self.catalog, os.path.join(self.work, "missing.xml")])
+        self.assertEqual(pool.catalog_args(), ["--catalog-path", self.catalog])
+
+
+SNAPSHOT_RUNNER = """#!%s
+import os, sys, json
+directory = sys.argv[sys.argv.index("--snapshot") + 1]
+with open(os.path.join(directory, "0.png"), "wb") as image:
+    image.write(b"PNG")
+with open(os.path.join(directory, "windows.json"), "w") as index:
+    json.dump([{"name": "w", "title": "W", "image": "0.png"}], index)
+"""
+
+
+class SessionsManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix="deckard_test_")
+        self.content = os.path.join(self.work, "content")
+        make_content(self.content)
+        self.runner = make_runner(os.path.join(self.work, "runner.sh"))
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_queued_spawn_does_not_keep_sessions(self):
+        manager = SessionsManager(self.runner, self.content, runner_pool_size=0)
+
+        def admit():
+            raise BusyException("Full", "No room for a runner.")
+
+        manager.resources.admit = admit
+        ticket = None
+        for attempt in range(4):
+            with self.assertRaises(QueuedException) as queued:
+                manager.spawn_runner(None, "module", "window.ui", "POSIX", ticket)
+            ticket = queued.exception.ticket
+            self.assertEqual(queued.exception.position, 0)
+            self.assertEqual(manager.users_count(), 0)
+
+    def test_concurrent_requests_on_a_session(self):
+        manager = SessionsManager(
+            self.runner,
+            self.content,
+            max_users=4,
+            runner_pool_size=1,
+            session_ttl=0.2,
+            session_grace=0.2,
+        )
+        uuid, _, _ = manager.spawn_runner(None, "module", "window.ui", "POSIX")
+        errors = []
+        end = time.monotonic() + 1.5
+
+        def loop(request):
+            while time.monotonic() < end:
+                try:
+                    request()
+                except Exception as e:
+                    errors.append(e)
+                time.sleep(0.005)
+
+        def spawn():
+            language = (
+                "fr.po" if "fr.po" in manager.sessions[uuid].custom_po else "POSIX"
+            )
+            self.assertEqual(
+                manager.spawn_runner(uuid, "module", "window.ui", language)[0], uuid
+            )
+
+        def store_po():
+            self.assertEqual(
+                manager.store_po(uuid, "fr.po", "module", io.BytesIO(PO))[0], uuid
+            )
+
+        def keep_alive():
+            self.assertTrue(manager.keep_alive(uuid))
+
+        threads = [
+            Thread(target=loop, args=(request,))
+            for request in (spawn, spawn, store_po, store_po, keep_alive)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        session = manager.sessions[uuid]
+        self.assertEqual(session.users, 0)
+        process = session.process
+        self.assertIsNone(process.poll())
+
+        # Once the requests stopped, the reaper deletes the session
+        del session
+        deadline = time.monotonic() + 5
+        while manager.sessions and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(manager.sessions, {})
+        self.assertEqual(manager.users_count(), 0)
+        self.assertEqual(process.wait(5), -9)
+
+    def test_failed_reload_is_reported(self):
+        manager = SessionsManager(self.runner, self.content, runner_pool_size=1)
+        uuid, port, reused = manager.spawn_runner(None, "module", "window.ui", "POSIX")
+        self.assertFalse(reused)
+        self.assertTrue(manager.spawn_runner(uuid, "module", "window.ui", "POSIX")[2])
+
+        with self.assertRaisesRegex(DeckardException, "no such file"):
+            manager.spawn_runner(uuid, "module", "missing.ui", "POSIX")
+        record = manager.session_store.get(uuid)
+        self.assertFalse(record["runner"])
+        self.assertIn("no such file", record["runner_error"])
+
+        # A new runner is used for the next file
+        self.assertFalse(manager.spawn_runner(uuid, "module", "window.ui", "POSIX")[2])
+
+    def test_event_streams_are_limited(self):
+        manager = SessionsManager(
+            self.runner,
+            self.content,
+            runner_pool_size=0,
+            max_event_streams=2,
+            max_event_streams_per_session=1,
+        )
+        first, _ = manager.store_po(None, "fr.po", "module", io.BytesIO(PO))
+        second, _ = manager.store_po(None, "fr.po", "module", io.BytesIO(PO))
+        third, _ = manager.store_po(None, "fr.po", "module", io.BytesIO(PO))
+
+        stream = manager.watch(first, interval=0.01)
+        self.assertEqual(next(stream)["status"], "ok")
+        # One stream per session
+        self.assertEqual(list(manager.watch(first)), [{"status": "poll"}])
+        other = manager.watch(second, interval=0.01)
+        self.assertEqual(next(other)["status"], "ok")
+        # Two streams in all
+        self.assertEqual(list(manager.watch(third)), [{"status": "poll"}])
+
+        # Closing a stream makes room for another one
+        stream.close()
+        stream = manager.watch(third, interval=0.01)
+        self.assertEqual(next(stream)["users_count"], "3")
+        stream.close()
+        other.close()
+        self.assertEqual(manager._event_streams, {})
+
+    def make_snapshot_manager(self):
+        runner = os.path.join(self.work, "snapshot.py")
+        with open(runner, "w") as script:
+            script.write(SNAPSHOT_RUNNER % sys.executable)
+        os.chmod(runner, 0o755)
+        os.makedirs(os.path.join(self.content, "LANGS", "fr_FR"))
+        return SessionsManager(
+            runner, self.content, runner_pool_size=0, snapshot_cache_size=1000000
+        )
+
+    def test_snapshot_after_content_rebuild(self):
+        manager = self.make_snapshot_manager()
+        key, windows = manager.snapshot(None, "module", "window.ui", "fr_FR")
+        self.assertEqual(windows[0]["image"], "0.png")
+        self.assertEqual(manager.snapshot(None, "module", "window.ui", "fr_FR")[0], key)
+        self.assertNotIn(
+            libdeckard.SNAPSHOT_CACHE,
+            libdeckard.scan_content(self.content)["MODULES"],
+        )
+
+        # The content folder is swapped with a new one
+        shutil.rmtree(os.path.join(self.content, libdeckard.SNAPSHOT_CACHE))
+        self.assertEqual(manager.snapshot(None, "module", "window.ui", "fr_FR")[0], key)
+        self.assertTrue(os.path.isfile(manager.snapshots.image_path(key, "0.png")))
+
+    def test_snapshot_languages_are_checked(self):
+        manager = self.make_snapshot_manager()
+        uuid = manager._create_session(None)
+        for session in (None, uuid):
+            for language in ("..", "de_DE", "fr_FR/../.."):
+                with self.assertRaises(libdeckard.DeckardException):
+                    manager.snapshot(session, "module", "window.ui", language)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+# Deckard, a Web based Glade Runner
+# Copyright (C) 2013  Nicolas Delvaux <contact@nicolas-delvaux.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the session stores, which must all behave the same"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+from http.server import ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sessionstore
+
+
+class StoreTests:
+    """Tests run against each store, given by make_store"""
+
+    def make_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def test_sessions(self):
+        self.assertTrue(self.store.create("a", "owner1", 100.0, 2))
+        self.assertTrue(self.store.create("b", "owner1", 200.0, 2))
+        self.assertFalse(self.store.create("c", "owner1", 100.0, 2))
+        self.assertEqual(self.store.count(), 2)
+        self.assertEqual(
+            self.store.get("a"),
+            {
+                "uuid": "a",
+                "owner": "owner1",
+                "deadline": 100.0,
+                "runner": False,
+                "runner_error": None,
+                "custom_po": [],
+            },
+        )
+        self.assertIsNone(self.store.get("c"))
+
+        self.assertTrue(self.store.renew("a", 150.0))
+        self.assertTrue(self.store.renew("a", 120.0))  # never shortened
+        self.assertEqual(self.store.get("a")["deadline"], 150.0)
+        self.assertFalse(self.store.renew("c", 150.0))
+
+        self.assertTrue(self.store.update("a", owner="owner2", runner=True))
+        session = self.store.get("a")
+        self.assertEqual((session["owner"], session["runner"]), ("owner2", True))
+        self.assertFalse(self.store.update("c", runner=True))
+
+        self.assertEqual(self.store.expire(160.0), 1)
+        self.assertIsNone(self.store.get("a"))
+        self.store.delete("b")
+        self.assertEqual(self.store.count(), 0)
+
+    def test_update_rejects_unknown_fields(self):
+        self.store.create("a", "owner1", 100.0, 2)
+        with self.assertRaises((ValueError, OSError)):
+            self.store.update("a", **{"owner = 'x', deadline": 0})
+        with self.assertRaises((ValueError, OSError)):
+            self.store.update("a", deadline=0)
+        self.assertEqual(self.store.get("a")["owner"], "owner1")
+        self.assertEqual(self.store.get("a")["deadline"], 100.0)
+
+    def test_ports(self):
+        self.store.create("a", "owner1", 100.0, 5)
+        self.store.create("b", "owner1", 100.0, 5)
+        self.assertEqual(self.store.claim_port("a", "host1", 2019, 2), 2019)
+        self.assertEqual(self.store.claim_port("b", "host1", 2019, 2), 2020)
+        self.assertIsNone(self.store.claim_port("b", "host1", 2019, 2))
+        self.assertEqual(self.store.claim_port("b", "host2", 2019, 2), 2019)
+
+        self.store.release_port("b", "host1", 2019)  # not its port
+        self.assertIsNone(self.store.claim_port("b", "host1", 2019, 2))
+        self.store.release_port("a", "host1", 2019)
+        self.assertEqual(self.store.claim_port("b", "host1", 2019, 2), 2019)
+
+        # Ports are freed with their session
+        self.store.delete("b")
+        self.assertEqual(self.store.claim_port("a", "host1", 2019, 2), 2019)
+        self.assertEqual(self.store.claim_port("a", "host1", 2019, 2), 2020)
+
+    def test_po_files(self):
+        self.store.create("a", "owner1", 100.0, 5)
+        self.store.put_po("digest1", b"\x00msgid")
+        self.assertIsNone(self.store.get_po("digest2"))
+        self.store.update("a", custom_po=[["fr.po", "module", "digest1"]])
+        self.assertEqual(self.store.get_po("digest1"), b"\x00msgid")
+        self.assertEqual(
+            self.store.get("a")["custom_po"], [["fr.po", "module", "digest1"]]
+        )
+        # Deleted once no session uses them
+        self.store.update("a", custom_po=[])
+        self.assertIsNone(self.store.get_po("digest1"))
+
+
+class MemorySessionStoreTestCase(StoreTests, unittest.TestCase):
+    def make_store(self):
+        return sessionstore.MemorySessionStore()
+
+
+class SqliteSessionStoreTestCase(StoreTests, unittest.TestCase):
+    def make_store(self):
+        work = tempfile.mkdtemp(prefix="deckard_test_")
+        self.addCleanup(shutil.rmtree, work)
+        return sessionstore.open_store("sqlite:%s" % os.path.join(work, "db"))
+
+
+class HttpSessionStoreTestCase(StoreTests, unittest.TestCase):
+    def make_store(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), sessionstore.SessionStoreHandler)
+        server.daemon_threads = True
+        server.store = sessionstore.MemorySessionStore()
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return sessionstore.open_store("http://127.0.0.1:%d/" % server.server_port)
+
+
+if __name__ == "__main__":
+    unittest.main()